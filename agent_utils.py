@@ -1,6 +1,21 @@
 import asyncio
-from typing import Optional, List
+import time
+from typing import Optional, List, Dict, Any, Tuple
 from task_time_estimator import estimate_task_time
+from deadlines import DeadlineExceeded, JobCancelled, estimation_jobs
+from time_estimation_agent import (
+    ESTIMATE_BATCH_PROMPT_SIZE,
+    ESTIMATION_TIERS,
+    batch_estimate_result,
+    build_batch_prompt,
+    embed_descriptions,
+    heuristic_estimate,
+    merge_similar_tasks,
+    parse_batch_line,
+    route_estimation,
+    similar_tasks_for
+)
+import llm_client
 from websocket_manager import manager
 import db
 from pymongo import MongoClient
@@ -9,6 +24,111 @@ import os
 
 load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+BULK_ESTIMATION_CONCURRENCY = int(os.getenv("BULK_ESTIMATION_CONCURRENCY", "4"))
+
+
+def _agent_result_message(task_client_id: str, result: Dict[str, Any], phase: str) -> Dict[str, Any]:
+    """agent_result message; phase is "provisional" (history heuristic) or "final" (LLM)."""
+    return {
+        "type": "agent_result",
+        "phase": phase,
+        "task_client_id": task_client_id,
+        "duration": result["suggested_minutes"],
+        "recommendation": result["recommendation"],
+        "reasoning": result["reasoning"],
+        "confidence": result["confidence"],
+        "similar_tags_found": result.get("similar_tags_found", 0),
+        "historical_tasks_analyzed": result.get("historical_tasks_analyzed", 0),
+        "degraded": result.get("degraded", False),
+        "tier": result.get("tier")
+    }
+
+
+def _persist_ai_result(task_client_id: str, result: Dict[str, Any]) -> None:
+    """Stores an estimation result on the task; failures are logged, not raised."""
+    mongo_client = MongoClient(MONGO_URI)
+    try:
+        db.update_task_ai_estimation(
+            mongo_client,
+            task_client_id,
+            ai_estimation_status="success",
+            ai_time_estimation=result.get("suggested_minutes", 30),
+            ai_recommendation=result.get("recommendation", "keep"),
+            ai_reasoning=result.get("reasoning", ""),
+            ai_confidence=result.get("confidence", "medium")
+        )
+        print(f"[DEBUG] Persisted AI result to DB for task {task_client_id}")
+    except Exception as e:
+        print(f"[ERROR] Failed to persist AI result: {e}")
+    finally:
+        mongo_client.close()
+
+
+def _lookup_memo(
+    mongo_client: MongoClient,
+    email: str,
+    title: str,
+    description: Optional[str],
+    tag_names: List[str],
+    initial_duration: int
+) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+    """Returns (signature, history_version, memo); the memo is None on a miss or failure."""
+    signature = db.estimation_signature(title, description, tag_names, initial_duration)
+    try:
+        history_version = db.get_history_version(mongo_client, email, tag_names)
+        return signature, history_version, db.get_estimation_memo(mongo_client, email, signature, history_version)
+    except Exception as e:
+        print(f"Warning: Estimation memo lookup failed: {e}")
+        return signature, "", None
+
+
+def _memo_result(memo: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "recommendation": memo["ai_recommendation"],
+        "suggested_minutes": memo["ai_time_estimation"],
+        "reasoning": memo["ai_reasoning"],
+        "confidence": memo["ai_confidence"],
+        "degraded": False,
+        "tier": "memo"
+    }
+
+
+def _store_memo(email: str, signature: str, history_version: str, result: Dict[str, Any]) -> None:
+    """Memoizes an LLM estimate. Heuristic and history-only results are cheap to redo."""
+    if not history_version or result.get("degraded") or result.get("tier") not in ("fast", "standard"):
+        return
+    mongo_client = MongoClient(MONGO_URI)
+    try:
+        db.set_estimation_memo(
+            mongo_client,
+            email,
+            signature,
+            history_version,
+            ai_time_estimation=result["suggested_minutes"],
+            ai_recommendation=result["recommendation"],
+            ai_reasoning=result["reasoning"],
+            ai_confidence=result["confidence"]
+        )
+    except Exception as e:
+        print(f"Warning: Failed to store estimation memo: {e}")
+    finally:
+        mongo_client.close()
+
+
+async def _forward_deltas(queue: asyncio.Queue, message: Dict[str, Any], client_id: str, email: str):
+    """
+    Sends queued text as delta messages until None is queued. Text that arrives
+    while a send is in flight goes out together in the next message.
+    """
+    while True:
+        parts = [await queue.get()]
+        while not queue.empty():
+            parts.append(queue.get_nowait())
+        text = "".join(part for part in parts if part is not None)
+        if text:
+            await manager.send_personal_message({**message, "delta": text}, client_id, email)
+        if None in parts:
+            return
 
 
 async def run_agent_background(
@@ -22,8 +142,22 @@ async def run_agent_background(
 ):
     """
     Runs the time estimation agent in the background and sends updates via WebSocket.
-    Uses tags vector search to find similar tasks and estimate time.
+    Uses tags vector search to find similar tasks and estimate time; every tag
+    of the task is searched, and the first one is the primary tag.
+    The run is limited to ESTIMATION_TIMEOUT_SECONDS and is cancelled if the task is
+    deleted or a newer estimation for it starts; a stopped run writes nothing.
+
+    Results arrive in two phases: a "provisional" agent_result from the median of
+    the user's recent tasks with the tag, sent before the LLM runs, then a "final"
+    one from the LLM. The final message is skipped when it agrees with the
+    provisional one. A task estimated before with the same title, description,
+    tags and initial estimate, and no completed tasks with those tags since, gets
+    the stored estimate as its only "final" result (tier "memo").
+
+    agent_delta messages carry the LLM's text as it streams in.
     """
+    deadline = estimation_jobs.begin(task_client_id)
+    error: Optional[Exception] = None
     try:
         # Notify frontend agent is starting
         await manager.send_personal_message({
@@ -31,7 +165,7 @@ async def run_agent_background(
             "status": "started",
             "task_client_id": task_client_id,
             "message": f"AI analyzing task: {title}"
-        }, client_id)
+        }, client_id, email)
 
         # Get tag description for vector search
         tag_name = tag_names[0] if tag_names else "work"
@@ -43,59 +177,73 @@ async def run_agent_background(
             tag = db.get_tag(mongo_client, email, tag_name)
             if tag:
                 tag_description = tag.get("tag_description", "")
+            history = db.get_recent_tasks_with_tag(
+                mongo_client, email, tag_name, exclude_task_client_id=task_client_id
+            )
+            signature, history_version, memo = _lookup_memo(
+                mongo_client, email, title, description, tag_names or [tag_name], initial_duration
+            )
         finally:
             mongo_client.close()
 
-        # Run the time estimation agent
-        result = estimate_task_time(
-            id=task_client_id,
-            email=email,
-            task_title=title,
-            task_description=description or "",
-            tag_name=tag_name,
-            tag_description=tag_description,
-            initial_estimate_minutes=initial_duration
-        )
+        provisional = None
+        if memo is not None:
+            # Same task as before and unchanged history: reuse the earlier estimate
+            result = _memo_result(memo)
+        else:
+            # Phase 1: instant estimate from the user's own history
+            provisional = heuristic_estimate(initial_duration, history)
+            provisional["historical_tasks_analyzed"] = len(history)
+            await manager.send_personal_message(
+                _agent_result_message(task_client_id, provisional, "provisional"), client_id, email
+            )
+
+            # Run the time estimation agent off the event loop, streaming the
+            # LLM's text to the client as agent_delta messages while it generates
+            loop = asyncio.get_running_loop()
+            deltas: asyncio.Queue = asyncio.Queue()
+            forwarder = asyncio.create_task(_forward_deltas(
+                deltas, {"type": "agent_delta", "task_client_id": task_client_id}, client_id, email
+            ))
+            try:
+                result = await asyncio.to_thread(
+                    estimate_task_time,
+                    id=task_client_id,
+                    email=email,
+                    task_title=title,
+                    task_description=description or "",
+                    tag_name=tag_name,
+                    tag_description=tag_description,
+                    initial_estimate_minutes=initial_duration,
+                    deadline=deadline,
+                    tag_names=tag_names or [tag_name],
+                    on_delta=lambda text: loop.call_soon_threadsafe(deltas.put_nowait, text)
+                )
+            finally:
+                deltas.put_nowait(None)
+                await forwarder
+            if deadline.cancelled:
+                raise JobCancelled(deadline.cancel_reason)
+            _store_memo(email, signature, history_version, result)
 
         # Extract estimation results
         recommendation = result.get("recommendation", "keep")
         suggested_minutes = result.get("suggested_minutes", 30)
-        reasoning = result.get("reasoning", "")
-        confidence = result.get("confidence", "medium")
-        
-        print(f"[DEBUG] Sending WebSocket result: task_client_id={task_client_id}, recommendation={recommendation}, duration={suggested_minutes}")
-
-        # Send estimation result via WebSocket
-        await manager.send_personal_message({
-            "type": "agent_result",
-            "task_client_id": task_client_id,
-            "duration": suggested_minutes,
-            "recommendation": recommendation,
-            "reasoning": reasoning,
-            "confidence": confidence,
-            "similar_tags_found": result.get("similar_tags_found", 0),
-            "historical_tasks_analyzed": result.get("historical_tasks_analyzed", 0)
-        }, client_id)
         
-        print(f"[DEBUG] WebSocket message sent successfully for task {task_client_id}")
+        # Phase 2: send the LLM result only if it changes what the user already sees
+        agrees = (
+            provisional is not None
+            and suggested_minutes == provisional["suggested_minutes"]
+            and recommendation == provisional["recommendation"]
+        )
+        if not agrees:
+            print(f"[DEBUG] Sending WebSocket result: task_client_id={task_client_id}, recommendation={recommendation}, duration={suggested_minutes}")
+            await manager.send_personal_message(
+                _agent_result_message(task_client_id, result, "final"), client_id, email
+            )
 
         # Persist AI result to database
-        mongo_client = MongoClient(MONGO_URI)
-        try:
-            db.update_task_ai_estimation(
-                mongo_client,
-                task_client_id,
-                ai_estimation_status="success",
-                ai_time_estimation=suggested_minutes,
-                ai_recommendation=recommendation,
-                ai_reasoning=reasoning,
-                ai_confidence=confidence
-            )
-            print(f"[DEBUG] Persisted AI result to DB for task {task_client_id}")
-        except Exception as e:
-            print(f"[ERROR] Failed to persist AI result: {e}")
-        finally:
-            mongo_client.close()
+        _persist_ai_result(task_client_id, result)
 
         # Notify completion
         await manager.send_personal_message({
@@ -103,15 +251,24 @@ async def run_agent_background(
             "status": "completed",
             "task_client_id": task_client_id,
             "message": f"AI estimation complete: {recommendation.upper()} - {suggested_minutes} min"
-        }, client_id)
+        }, client_id, email)
 
+    except JobCancelled as e:
+        # The task was deleted or re-estimated; the newer state wins
+        error = e
+        print(f"Estimation for {task_client_id} stopped: {e.reason}")
     except Exception as e:
-        print(f"Error in background agent task: {e}")
+        error = e
+        if isinstance(e, DeadlineExceeded):
+            print(f"Estimation for {task_client_id} timed out in {e.stage}: {deadline.stages}")
+        else:
+            print(f"Error in background agent task: {e}")
         await manager.send_personal_message({
             "type": "agent_error",
             "task_client_id": task_client_id,
-            "error": str(e)
-        }, client_id)
+            "error": str(e),
+            "stage": getattr(e, "stage", None)
+        }, client_id, email)
         
         # Persist error status to database
         mongo_client = MongoClient(MONGO_URI)
@@ -125,6 +282,199 @@ async def run_agent_background(
             pass
         finally:
             mongo_client.close()
+    finally:
+        estimation_jobs.finish(task_client_id, deadline, error)
+
+
+async def run_bulk_agent_background(client_id: str, tasks: List[Dict[str, Any]]):
+    """
+    Runs time estimation for a batch of tasks as one background job.
+    Each task dict carries the run_agent_background arguments (except client_id).
+    At most BULK_ESTIMATION_CONCURRENCY estimations run at once so a large import
+    doesn't flood the LLM provider.
+    """
+    semaphore = asyncio.Semaphore(BULK_ESTIMATION_CONCURRENCY)
+
+    async def estimate(task: Dict[str, Any]):
+        async with semaphore:
+            await run_agent_background(client_id, **task)
+
+    await asyncio.gather(*(estimate(task) for task in tasks))
+
+
+def _load_batch_context(email: str, items: List[Dict[str, Any]]) -> Tuple[Dict[str, str], List[Optional[Dict[str, Any]]]]:
+    """Primary tag descriptions, and the memoized estimate of each batch item (None on a miss)."""
+    mongo_client = MongoClient(MONGO_URI)
+    try:
+        descriptions = {}
+        for tag_name in sorted({item["tag_names"][0] for item in items}):
+            tag = db.get_tag(mongo_client, email, tag_name)
+            descriptions[tag_name] = tag.get("tag_description", "") if tag else ""
+        memos = []
+        for item in items:
+            item["signature"], item["history_version"], memo = _lookup_memo(
+                mongo_client, email, item["title"], item["description"], item["tag_names"], item["estimated_time"]
+            )
+            memos.append(memo)
+        return descriptions, memos
+    finally:
+        mongo_client.close()
+
+
+async def run_batch_estimation(client_id: str, email: str, tasks: List[Dict[str, Any]]):
+    """
+    "Estimate my week": estimates many tasks with as few LLM calls as possible.
+    Each task dict has task_client_id, title, description, tag_names and initial_duration.
+
+    Memoized estimates (see run_agent_background) are sent first. For the other
+    tasks, descriptions are embedded in one call and similar tasks are retrieved for
+    every tag of every task concurrently. Tasks the router sends to the "none" tier are answered from
+    their history straight away; the rest are packed ESTIMATE_BATCH_PROMPT_SIZE to a
+    prompt, and each task's agent_result is sent as soon as its line of the streamed
+    answer is parsed. Tasks the LLM leaves unanswered get the history heuristic.
+    Each task is still cancelled when it is deleted or re-estimated.
+    """
+    items = []
+    for index, task in enumerate(tasks):
+        items.append({
+            "key": str(index + 1),
+            "task_client_id": task["task_client_id"],
+            "title": task["title"],
+            "description": task.get("description") or "",
+            "tag_names": list(dict.fromkeys(task.get("tag_names") or ["work"])),
+            "estimated_time": task.get("initial_duration") or 30,
+            "deadline": estimation_jobs.begin(task["task_client_id"]),
+            "historical_tasks": []
+        })
+    pending = {item["key"]: item for item in items}
+    batch_error: Optional[Exception] = None
+
+    async def deliver(item: Dict[str, Any], result: Dict[str, Any], error: Optional[Exception] = None):
+        if pending.pop(item["key"], None) is None:
+            return
+        deadline = item["deadline"]
+        if not deadline.cancelled:
+            result["historical_tasks_analyzed"] = len(item["historical_tasks"])
+            await manager.send_personal_message(
+                _agent_result_message(item["task_client_id"], result, "final"), client_id, email
+            )
+            await asyncio.to_thread(_persist_ai_result, item["task_client_id"], result)
+        estimation_jobs.finish(item["task_client_id"], deadline, error)
+
+    async def estimate_chunk(chunk: List[Dict[str, Any]]):
+        tier_name = "standard" if any(item["tier"] == "standard" for item in chunk) else "fast"
+        tier = ESTIMATION_TIERS[tier_name]
+        by_key = {item["key"]: item for item in chunk}
+        response = None
+
+        async def handle(line: str):
+            parsed = parse_batch_line(line)
+            item = by_key.pop(parsed["id"], None) if parsed else None
+            if item is not None:
+                result = {**batch_estimate_result(parsed, item["estimated_time"]), "degraded": False, "tier": tier_name}
+                await deliver(item, result)
+                await asyncio.to_thread(_store_memo, email, item["signature"], item["history_version"], result)
+
+        async def consume():
+            nonlocal response
+            buffer = ""
+            async for piece in llm_client.astream_chat(tier.get_llm(), build_batch_prompt(chunk)):
+                response = piece if response is None else response + piece
+                buffer += llm_client.chunk_text(piece)
+                *lines, buffer = buffer.split("\n")
+                for line in lines:
+                    await handle(line)
+            await handle(buffer)
+
+        error: Optional[Exception] = None
+        started = time.monotonic()
+        try:
+            timeout = min(item["deadline"].remaining() for item in chunk)
+            await asyncio.wait_for(consume(), timeout)
+        except asyncio.TimeoutError:
+            error = DeadlineExceeded("estimate_time")
+        except Exception as e:
+            error = e
+        tier.record((time.monotonic() - started) * 1000, response, failed=error is not None)
+        if error is not None:
+            print(f"Batch estimate failed, using heuristic for {len(by_key)} tasks: {error}")
+
+        for item in list(by_key.values()):
+            result = heuristic_estimate(item["estimated_time"], item["historical_tasks"])
+            timed_out = error if isinstance(error, DeadlineExceeded) else None
+            await deliver(item, {**result, "degraded": True, "tier": tier_name}, timed_out)
+
+    try:
+        await manager.send_personal_message({
+            "type": "agent_batch_status",
+            "status": "started",
+            "count": len(items),
+            "message": f"AI estimating {len(items)} tasks"
+        }, client_id, email)
+
+        tag_descriptions, memos = await asyncio.to_thread(_load_batch_context, email, items)
+        # Tasks estimated before with unchanged history need no retrieval or LLM call
+        for item, memo in zip(items, memos):
+            if memo is not None:
+                await deliver(item, _memo_result(memo))
+        remaining = [item for item in items if item["key"] in pending]
+
+        vectors = await asyncio.to_thread(
+            embed_descriptions, [item["description"] or item["title"] for item in remaining]
+        ) if remaining else []
+        # One search per (task, tag), all at once; each task keeps its best matches
+        searches = [(item, tag_name, vector) for item, vector in zip(remaining, vectors) for tag_name in item["tag_names"]]
+        found = await asyncio.gather(*(
+            asyncio.to_thread(similar_tasks_for, item["task_client_id"], email, tag_name, vector, item["deadline"])
+            for item, tag_name, vector in searches
+        ), return_exceptions=True)
+        tag_results: Dict[str, List[Dict[str, Any]]] = {item["key"]: [] for item in remaining}
+        for (item, _, _), tasks_found in zip(searches, found):
+            if isinstance(tasks_found, list):
+                tag_results[item["key"]].extend(tasks_found)
+
+        to_llm = []
+        for item in remaining:
+            item["tag_name"] = item["tag_names"][0]
+            item["tag_description"] = tag_descriptions.get(item["tag_name"], "")
+            item["historical_tasks"] = merge_similar_tasks(tag_results[item["key"]])
+            item["tier"] = route_estimation(item["description"], item["historical_tasks"])
+            if item["tier"] == "none":
+                started = time.monotonic()
+                result = heuristic_estimate(item["estimated_time"], item["historical_tasks"])
+                ESTIMATION_TIERS["none"].record((time.monotonic() - started) * 1000)
+                await deliver(item, {**result, "degraded": False, "tier": "none"})
+            else:
+                to_llm.append(item)
+
+        chunks = [
+            to_llm[start:start + ESTIMATE_BATCH_PROMPT_SIZE]
+            for start in range(0, len(to_llm), ESTIMATE_BATCH_PROMPT_SIZE)
+        ]
+        await asyncio.gather(*(estimate_chunk(chunk) for chunk in chunks))
+
+        await manager.send_personal_message({
+            "type": "agent_batch_status",
+            "status": "completed",
+            "count": len(items),
+            "llm_calls": len(chunks),
+            "message": f"AI estimated {len(items)} tasks"
+        }, client_id, email)
+
+    except Exception as e:
+        batch_error = e
+        print(f"Error in batch estimation: {e}")
+        for item in list(pending.values()):
+            await manager.send_personal_message({
+                "type": "agent_error",
+                "task_client_id": item["task_client_id"],
+                "error": str(e),
+                "stage": getattr(e, "stage", None)
+            }, client_id, email)
+    finally:
+        for item in list(pending.values()):
+            pending.pop(item["key"])
+            estimation_jobs.finish(item["task_client_id"], item["deadline"], batch_error)
 
 
 async def run_search_agent_background(
@@ -144,26 +494,36 @@ async def run_search_agent_background(
             "type": "flowbot_status",
             "status": "thinking",
             "message": "FloBot is thinking..."
-        }, client_id)
+        }, client_id, user_id)
 
-        # Run agent
+        # Run agent, sending the reply's text as flowbot_delta messages as it
+        # streams in; flowbot_result still carries the complete reply
         graph = build_search_agent_graph()
-        result = await asyncio.to_thread(graph.invoke, {
-            "messages": [HumanMessage(content=message)]
-        })
-        
+        result = {}
+        async for mode, chunk in graph.astream(
+            {"messages": [HumanMessage(content=message)], "stream_tokens": True},
+            stream_mode=["custom", "values"]
+        ):
+            if mode == "custom":
+                await manager.send_personal_message({
+                    "type": "flowbot_delta",
+                    "delta": chunk["delta"]
+                }, client_id, user_id)
+            else:
+                result = chunk
+
         response_text = result['messages'][-1].content
 
         # Send result
         await manager.send_personal_message({
             "type": "flowbot_result",
             "response": response_text
-        }, client_id)
+        }, client_id, user_id)
 
     except Exception as e:
         print(f"Error in background search agent: {e}")
         await manager.send_personal_message({
             "type": "flowbot_error",
             "error": str(e)
-        }, client_id)
+        }, client_id, user_id)
 
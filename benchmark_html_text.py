@@ -0,0 +1,59 @@
+"""
+Benchmark of the HTML text extraction backends (see html_text.py).
+
+Runs every installed backend over a corpus of saved HTML pages and prints the
+time per page, throughput, and how closely each backend's text matches
+html.parser's.
+
+Usage:
+    python benchmark_html_text.py path/to/saved_pages [--rounds 5]
+"""
+
+import argparse
+import difflib
+import time
+from pathlib import Path
+
+import html_text
+
+
+def load_corpus(directory: str):
+    paths = sorted(p for p in Path(directory).rglob("*") if p.suffix.lower() in (".html", ".htm"))
+    return [(p.name, p.read_bytes()) for p in paths]
+
+
+def run(corpus, rounds: int):
+    total_bytes = sum(len(content) for _, content in corpus)
+    print(f"{len(corpus)} pages, {total_bytes / 1024 / 1024:.1f} MiB, {rounds} rounds")
+    print(f"Backends: {', '.join(html_text.BACKENDS)}\n")
+
+    reference = {name: html_text.extract_text(content, "html.parser") for name, content in corpus}
+
+    print(f"{'backend':<12} {'ms/page':>10} {'MiB/s':>10} {'match':>8}")
+    for backend in html_text.BACKENDS:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            texts = {name: html_text.extract_text(content, backend) for name, content in corpus}
+        elapsed = (time.perf_counter() - start) / rounds
+
+        # Similarity of the text the agent would see (the first 4000 characters)
+        match = sum(
+            difflib.SequenceMatcher(None, texts[name][:4000], reference[name][:4000]).ratio()
+            for name in texts
+        ) / len(texts)
+        print(
+            f"{backend:<12} {elapsed / len(corpus) * 1000:>10.2f} "
+            f"{total_bytes / 1024 / 1024 / elapsed:>10.1f} {match:>8.1%}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare HTML text extraction backends")
+    parser.add_argument("corpus", help="Directory of saved .html pages")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        raise SystemExit(f"No .html pages found in {args.corpus}")
+    run(corpus, args.rounds)
@@ -0,0 +1,155 @@
+"""
+Circuit Breaker
+
+Stops calling a provider that keeps failing, so requests fail fast instead of each
+one waiting out the provider's timeout.
+
+- closed: calls go through; outcomes are counted over a rolling window.
+- open: once at least CIRCUIT_MIN_CALLS calls in the window failed at a rate of
+  CIRCUIT_FAILURE_RATE or more, calls raise CircuitOpenError without running.
+- half_open: after CIRCUIT_OPEN_SECONDS a single probe call is let through;
+  success closes the circuit, failure opens it again.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "30"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker. Thread-safe; calls run outside the lock."""
+
+    def __init__(
+        self,
+        name: str,
+        window_seconds: float = CIRCUIT_WINDOW_SECONDS,
+        min_calls: int = CIRCUIT_MIN_CALLS,
+        failure_rate: float = CIRCUIT_FAILURE_RATE,
+        open_seconds: float = CIRCUIT_OPEN_SECONDS
+    ):
+        self.name = name
+        self.window = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        # (monotonic time, succeeded) per finished call inside the window
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+        return self._state
+
+    def _acquire(self) -> bool:
+        """Returns whether a call may run now; a half-open circuit admits one probe."""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def _record(self, succeeded: bool) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self.calls += 1
+            if not succeeded:
+                self.failures += 1
+            if self._state == HALF_OPEN:
+                self._probing = False
+                if succeeded:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open(now)
+                return
+
+            self._outcomes.append((now, succeeded))
+            while self._outcomes and now - self._outcomes[0][0] > self.window:
+                self._outcomes.popleft()
+            failed = sum(1 for _, ok in self._outcomes if not ok)
+            if (self._state == CLOSED and len(self._outcomes) >= self.min_calls
+                    and failed / len(self._outcomes) >= self.failure_rate):
+                self._open(now)
+
+    def _open(self, now: float) -> None:
+        self._state = OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        self.opened += 1
+        print(f"Warning: {self.name} circuit opened; failing fast for {self.open_seconds:.0f}s")
+
+    def _release(self) -> None:
+        """Gives back a half-open probe whose call was abandoned without an outcome."""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probing = False
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """
+        Runs the body of a with block as one call through the breaker, for work that
+        isn't a single function call (e.g. consuming a stream). Raises CircuitOpenError
+        while open. A body abandoned by cancellation or generator close counts as neither.
+        """
+        if not self._acquire():
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+        try:
+            yield
+        except Exception:
+            self._record(False)
+            raise
+        except BaseException:
+            self._release()
+            raise
+        self._record(True)
+
+    def call(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Runs fn through the breaker. Raises CircuitOpenError while open."""
+        with self.guard():
+            return fn(*args, **kwargs)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "calls": self.calls,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "opened": self.opened
+        }
@@ -7,25 +7,170 @@ Provides getters and setters for:
 - Tasks: {email, tag_names(list)(optional), description(optional), title(required)}
 """
 
-from pymongo import MongoClient
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+from pymongo import MongoClient, ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from typing import List, Dict, Any, Optional, Callable, Tuple, Union
+from datetime import datetime, timedelta
 from bson import ObjectId
 from dotenv import load_dotenv
+from collections import OrderedDict
+import hashlib
+import json
 import os
+import threading
+import time
 
 import agent
+import llm_client
 
 # Load environment variables for embedding model
 load_dotenv()
 
 DB_NAME = "flowstate_db"
 
+# Tombstones for deleted tasks are kept this long so that delta sync clients
+# can learn about deletions. Clients with an older sync token must do a full reload.
+TOMBSTONE_RETENTION_DAYS = 30
+
+# Sync tokens are handed out this far in the past. A write stamps updated_at on its
+# own worker and may commit after a delta query has run, so a token equal to "now"
+# could skip it forever. Changes inside the window are simply returned twice.
+SYNC_TOKEN_SAFETY_SECONDS = 5
+
+
+def _utcnow() -> datetime:
+    """Current UTC time truncated to milliseconds (the precision MongoDB stores)."""
+    now = datetime.utcnow()
+    return now.replace(microsecond=(now.microsecond // 1000) * 1000)
+
+
+# =============================================================================
+# INDEXES
+# =============================================================================
+
+def ensure_indexes(client: MongoClient) -> None:
+    """
+    Creates the indexes the API relies on. Safe to call on every startup.
+    - tasks (email, updated_at): delta sync queries
+    - task_tombstones (email, deleted_at): delta sync queries for deletions
+    - task_tombstones deleted_at TTL: expires tombstones after the retention window
+    - tasks (email, task_client_id) unique: task_client_id is the idempotency key for creates
+    - estimation_memo (email, signature) unique, created_at TTL: memoized estimates
+    - page_cache url unique, checked_at TTL: scraped page text
+    """
+    db = client[DB_NAME]
+    db["tasks"].create_index([("email", ASCENDING), ("updated_at", ASCENDING)])
+    try:
+        db["tasks"].create_index(
+            [("email", ASCENDING), ("task_client_id", ASCENDING)],
+            name="email_task_client_id_unique",
+            unique=True,
+            partialFilterExpression={"task_client_id": {"$type": "string"}}
+        )
+    except OperationFailure as e:
+        # Existing duplicate task_client_ids must be cleaned up before the index can build
+        print(f"Warning: Could not create unique task_client_id index: {e}")
+    tombstones = db["task_tombstones"]
+    tombstones.create_index([("email", ASCENDING), ("deleted_at", ASCENDING)])
+    tombstones.create_index(
+        "deleted_at",
+        name="deleted_at_ttl",
+        expireAfterSeconds=TOMBSTONE_RETENTION_DAYS * 24 * 60 * 60
+    )
+    memo = db["estimation_memo"]
+    memo.create_index([("email", ASCENDING), ("signature", ASCENDING)], unique=True)
+    memo.create_index(
+        "created_at",
+        name="created_at_ttl",
+        expireAfterSeconds=ESTIMATION_MEMO_TTL_DAYS * 24 * 60 * 60
+    )
+    pages = db["page_cache"]
+    pages.create_index("url", unique=True)
+    pages.create_index(
+        "checked_at",
+        name="checked_at_ttl",
+        expireAfterSeconds=PAGE_CACHE_RETENTION_DAYS * 24 * 60 * 60
+    )
+
+
+# =============================================================================
+# TASK CHANGE LISTENERS
+# =============================================================================
+
+# Called as listener(op, task, fields) after every task write, where op is "created",
+# "updated" or "deleted" and fields lists the top-level fields an update wrote (None
+# when the whole task was written). Deleted tasks only carry _id, email and task_client_id.
+# Listeners run on the writing thread and must not block.
+TaskChangeListener = Callable[[str, Dict[str, Any], Optional[List[str]]], None]
+_task_change_listeners: List[TaskChangeListener] = []
+
+
+def add_task_change_listener(listener: TaskChangeListener) -> None:
+    """Registers a callable to be notified of task writes."""
+    _task_change_listeners.append(listener)
+
+
+def remove_task_change_listener(listener: TaskChangeListener) -> None:
+    """Unregisters a task change listener."""
+    if listener in _task_change_listeners:
+        _task_change_listeners.remove(listener)
+
+
+def _notify_task_change(op: str, task: Dict[str, Any], fields: Optional[List[str]] = None) -> None:
+    """Notifies listeners about a task write, using the document the write returned."""
+    for listener in list(_task_change_listeners):
+        try:
+            listener(op, task, fields)
+        except Exception as e:
+            print(f"Warning: Task change listener failed: {e}")
+
+
+def _updated_fields(update: Dict[str, Any]) -> List[str]:
+    """Top-level fields an update document writes."""
+    return sorted({field.split(".")[0] for operator in update.values() for field in operator})
+
+
+def _update_task_and_notify(
+    collection,
+    task_filter: Dict[str, Any],
+    update: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    """
+    Applies an update to one task and notifies listeners with the updated document.
+    find_one_and_update returns the document in the same round-trip as the write.
+    Returns the updated task (without its embedding), or None if nothing matched.
+    """
+    task = collection.find_one_and_update(
+        task_filter,
+        update,
+        projection={"embedding": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if task is not None:
+        _notify_task_change("updated", task, _updated_fields(update))
+    return task
+
+
 # =============================================================================
 # EMBEDDING UTILITIES
 # =============================================================================
 
 
+# Texts per provider call when embedding in bulk
+EMBEDDING_BATCH_SIZE = 100
+
+_embeddings_model = None
+
+
+def _get_embeddings_model():
+    """Returns a shared Gemini embeddings client, created on first use."""
+    global _embeddings_model
+    if _embeddings_model is None:
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        _embeddings_model = GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001")
+    return _embeddings_model
+
+
 def _generate_embedding(text: str) -> Optional[List[float]]:
     """
     Generates a vector embedding for text using Gemini.
@@ -35,19 +180,162 @@ def _generate_embedding(text: str) -> Optional[List[float]]:
         return None
     
     try:
-        from langchain_google_genai import GoogleGenerativeAIEmbeddings
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001")
-        return embeddings.embed_query(text)
+        return llm_client.embed_query(_get_embeddings_model(), text)
+    except llm_client.CircuitOpenError:
+        return None
     except Exception as e:
         print(f"Warning: Failed to generate embedding: {e}")
         return None
 
 
+def _generate_embeddings(texts: List[str]) -> List[Optional[List[float]]]:
+    """
+    Generates embeddings for many texts in batched provider calls.
+    Returns one entry per input text; empty texts and failed batches yield None.
+    Vectors match _generate_embedding so bulk and single writes are searchable together.
+    """
+    results: List[Optional[List[float]]] = [None] * len(texts)
+    pending = [(i, text) for i, text in enumerate(texts) if text and text.strip()]
+
+    for start in range(0, len(pending), EMBEDDING_BATCH_SIZE):
+        batch = pending[start:start + EMBEDDING_BATCH_SIZE]
+        try:
+            vectors = llm_client.embed_documents(
+                _get_embeddings_model(),
+                [text for _, text in batch],
+                batch_size=EMBEDDING_BATCH_SIZE,
+                task_type="RETRIEVAL_QUERY"
+            )
+        except llm_client.CircuitOpenError:
+            break
+        except Exception as e:
+            print(f"Warning: Failed to generate {len(batch)} embeddings: {e}")
+            continue
+        for (i, _), vector in zip(batch, vectors):
+            results[i] = vector
+    return results
+
+
 def _generate_tag_embedding(tag_description: str) -> Optional[List[float]]:
     """Wrapper for _generate_embedding to maintain backward compatibility if needed."""
     return _generate_embedding(tag_description)
 
 
+def _embedding_fields(embedding: Optional[List[float]]) -> Dict[str, Any]:
+    """
+    $set fields for a task whose text was (re-)embedded. When the provider failed
+    the task is marked pending and backfill_pending_embeddings embeds it later.
+    """
+    if embedding is None:
+        return {"embedding_status": "pending"}
+    return {"embedding": embedding, "embedding_status": "ready"}
+
+
+# =============================================================================
+# READ CACHE
+# =============================================================================
+# Users and tags change rarely but are read on every estimation and dashboard load.
+# Reads go through a small in-process LRU with a TTL; the write helpers below
+# invalidate the affected keys. Writes made by another worker or process are only
+# seen once the TTL expires, so keep it short.
+
+DB_CACHE_ENABLED = os.getenv("DB_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+DB_CACHE_TTL_SECONDS = float(os.getenv("DB_CACHE_TTL_SECONDS", "60"))
+DB_CACHE_MAX_ENTRIES = int(os.getenv("DB_CACHE_MAX_ENTRIES", "1024"))
+
+_MISSING = object()
+
+
+class ReadCache:
+    """Thread-safe LRU cache with per-entry expiry. Cached values may be None."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float, enabled: bool = True):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.enabled = enabled
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Tuple) -> Any:
+        """Returns the cached value, or _MISSING."""
+        if not self.enabled:
+            return _MISSING
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Tuple, value: Any) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys: Tuple) -> None:
+        with self._lock:
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+
+read_cache = ReadCache(DB_CACHE_MAX_ENTRIES, DB_CACHE_TTL_SECONDS, DB_CACHE_ENABLED)
+
+
+def _cached(key: Tuple, load: Callable[[], Any]) -> Any:
+    """
+    Returns the value for key from the read cache, loading it on a miss.
+    Documents are returned as shallow copies because callers mutate them
+    (e.g. stringifying _id), which must not leak into the cache.
+    """
+    value = read_cache.get(key)
+    if value is _MISSING:
+        value = load()
+        read_cache.put(key, value)
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, list):
+        return [dict(doc) for doc in value]
+    return value
+
+
+def _invalidate_tag(email: str, tag_name: str) -> None:
+    read_cache.invalidate(("tag", email, tag_name), ("tags", email))
+
+
 # =============================================================================
 # USER OPERATIONS
 # =============================================================================
@@ -56,14 +344,12 @@ def get_user(client: MongoClient, email: str) -> Optional[Dict[str, Any]]:
     """Retrieves a user document by email."""
     db = client[DB_NAME]
     collection = db["users"]
-    return collection.find_one({"email": email})
+    return _cached(("user", email), lambda: collection.find_one({"email": email}))
 
 
 def get_user_description(client: MongoClient, email: str) -> Optional[str]:
     """Retrieves the description for a user."""
-    db = client[DB_NAME]
-    collection = db["users"]
-    result = collection.find_one({"email": email}, {"description": 1})
+    result = get_user(client, email)
     if result:
         return result.get("description")
     return None
@@ -86,6 +372,7 @@ def set_user(client: MongoClient, email: str, description: Optional[str] = None)
         {"$set": update_data},
         upsert=True
     )
+    read_cache.invalidate(("user", email))
     return result.acknowledged
 
 
@@ -102,6 +389,7 @@ def set_user_description(client: MongoClient, email: str, description: str) -> b
         {"$set": {"description": description}},
         upsert=True
     )
+    read_cache.invalidate(("user", email))
     return result.acknowledged
 
 
@@ -110,6 +398,7 @@ def delete_user(client: MongoClient, email: str) -> bool:
     db = client[DB_NAME]
     collection = db["users"]
     result = collection.delete_one({"email": email})
+    read_cache.invalidate(("user", email))
     return result.deleted_count > 0
 
 
@@ -128,17 +417,15 @@ def get_tag(client: MongoClient, email: str, tag_name: str) -> Optional[Dict[str
     """Retrieves a specific tag by email and tag_name."""
     db = client[DB_NAME]
     collection = db["tags"]
-    return collection.find_one({"email": email, "tag_name": tag_name})
+    return _cached(
+        ("tag", email, tag_name),
+        lambda: collection.find_one({"email": email, "tag_name": tag_name})
+    )
 
 
 def get_tag_description(client: MongoClient, email: str, tag_name: str) -> Optional[str]:
     """Retrieves the description for a specific tag."""
-    db = client[DB_NAME]
-    collection = db["tags"]
-    result = collection.find_one(
-        {"email": email, "tag_name": tag_name}, 
-        {"tag_description": 1}
-    )
+    result = get_tag(client, email, tag_name)
     if result:
         return result.get("tag_description")
     return None
@@ -166,6 +453,7 @@ def set_tag(client: MongoClient, email: str, tag_name: str, tag_description: Opt
         {"$set": update_data},
         upsert=True
     )
+    _invalidate_tag(email, tag_name)
     return result.acknowledged
 
 
@@ -190,6 +478,7 @@ def set_tag_description(client: MongoClient, email: str, tag_name: str, tag_desc
         {"$set": update_data},
         upsert=True
     )
+    _invalidate_tag(email, tag_name)
     return result.acknowledged
 
 
@@ -199,6 +488,7 @@ def delete_tag(client: MongoClient, email: str, tag_name: str) -> bool:
     db = client[DB_NAME]
     collection = db["tags"]
     result = collection.delete_one({"email": email, "tag_name": tag_name})
+    _invalidate_tag(email, tag_name)
     return result.deleted_count > 0
 
 
@@ -206,7 +496,7 @@ def get_all_tags_for_user(client: MongoClient, email: str) -> List[Dict[str, Any
     """Retrieves all tags for a specific user."""
     db = client[DB_NAME]
     collection = db["tags"]
-    return list(collection.find({"email": email}))
+    return _cached(("tags", email), lambda: list(collection.find({"email": email})))
 
 
 def get_all_tags(client: MongoClient) -> List[Dict[str, Any]]:
@@ -216,6 +506,100 @@ def get_all_tags(client: MongoClient) -> List[Dict[str, Any]]:
     return list(collection.find())
 
 
+# =============================================================================
+# TAG TEMPLATES
+# =============================================================================
+# Every new user gets the same default tags. Their embeddings are computed once,
+# stored in the tag_templates collection and copied into the user's tags on
+# sign-up, so onboarding never waits on the embedding provider.
+
+DEFAULT_TAG_TEMPLATES: List[Tuple[str, str]] = [
+    ("work", "Work related tasks and projects"),
+    ("school", "School assignments and academic activities"),
+    ("hobbies", "Personal hobbies and leisure activities")
+]
+
+
+def ensure_tag_templates(client: MongoClient) -> int:
+    """
+    Stores DEFAULT_TAG_TEMPLATES with their embeddings. Only templates that are new,
+    changed or still missing an embedding are embedded, in one batched call.
+    Default tags created while an embedding was missing are backfilled.
+    Safe to call on every startup. Returns the number of templates embedded.
+    """
+    collection = client[DB_NAME]["tag_templates"]
+    stored = {
+        doc["tag_name"]: doc
+        for doc in collection.find({"tag_name": {"$in": [name for name, _ in DEFAULT_TAG_TEMPLATES]}})
+    }
+    stale = [
+        (name, description) for name, description in DEFAULT_TAG_TEMPLATES
+        if stored.get(name, {}).get("tag_description") != description
+        or stored[name].get("embedding") is None
+    ]
+    if not stale:
+        return 0
+
+    embeddings = _generate_embeddings([description for _, description in stale])
+    for (name, description), embedding in zip(stale, embeddings):
+        collection.update_one(
+            {"tag_name": name},
+            {"$set": {"tag_name": name, "tag_description": description, "embedding": embedding}},
+            upsert=True
+        )
+        if embedding is not None:
+            client[DB_NAME]["tags"].update_many(
+                {"tag_name": name, "tag_description": description, "embedding": None},
+                {"$set": {"embedding": embedding}}
+            )
+    read_cache.invalidate(("tag_templates",))
+    return sum(1 for embedding in embeddings if embedding is not None)
+
+
+def get_tag_templates(client: MongoClient) -> List[Dict[str, Any]]:
+    """
+    Returns the default tag templates, with stored embeddings where available.
+    Falls back to the in-code descriptions if templates have not been stored yet.
+    """
+    def load() -> List[Dict[str, Any]]:
+        stored = {
+            doc["tag_name"]: doc
+            for doc in client[DB_NAME]["tag_templates"].find({}, {"_id": 0})
+        }
+        return [
+            {
+                "tag_name": name,
+                "tag_description": description,
+                "embedding": stored.get(name, {}).get("embedding")
+                if stored.get(name, {}).get("tag_description") == description else None
+            }
+            for name, description in DEFAULT_TAG_TEMPLATES
+        ]
+    return _cached(("tag_templates",), load)
+
+
+def create_default_tags(client: MongoClient, email: str) -> int:
+    """
+    Creates the default tags for a new user in one bulk write, using the stored
+    template embeddings. Existing tags with the same name are left untouched.
+    Returns the number of tags created.
+    """
+    operations = [
+        UpdateOne(
+            {"email": email, "tag_name": template["tag_name"]},
+            {"$setOnInsert": {
+                "email": email,
+                **{k: v for k, v in template.items() if v is not None}
+            }},
+            upsert=True
+        )
+        for template in get_tag_templates(client)
+    ]
+    result = client[DB_NAME]["tags"].bulk_write(operations, ordered=False)
+    read_cache.invalidate(("tags", email), *[("tag", email, name) for name, _ in DEFAULT_TAG_TEMPLATES])
+    return result.upserted_count
+
+
 # =============================================================================
 # TASKS OPERATIONS
 # =============================================================================
@@ -244,27 +628,31 @@ def get_task_by_id(client: MongoClient, task_id: str) -> Optional[Dict[str, Any]
     return collection.find_one({"_id": ObjectId(task_id)})
 
 
+def task_exists(client: MongoClient, task_id: str, email: Optional[str] = None) -> bool:
+    """True if the task exists (and, if email is given, is owned by that user)."""
+    db = client[DB_NAME]
+    task_filter: Dict[str, Any] = {"_id": ObjectId(task_id)}
+    if email is not None:
+        task_filter["email"] = email
+    return db["tasks"].find_one(task_filter, {"_id": 1}) is not None
+
+
+def _identifier_filter(email: str, identifier: str) -> Dict[str, Any]:
+    """
+    Builds one filter matching a user's task by ObjectId string or by title, so
+    ID-or-title lookups cost a single round-trip. Strings that are not valid
+    ObjectIds only match by title.
+    """
+    if ObjectId.is_valid(identifier):
+        return {"email": email, "$or": [{"_id": ObjectId(identifier)}, {"title": identifier}]}
+    return {"email": email, "title": identifier}
+
+
 def get_task_description(client: MongoClient, email: str, identifier: str) -> Optional[str]:
     """Retrieves the description for a specific task by ID or Title."""
     db = client[DB_NAME]
     collection = db["tasks"]
-    
-    # Try as ObjectId first
-    try:
-        result = collection.find_one(
-            {"email": email, "_id": ObjectId(identifier)}, 
-            {"description": 1}
-        )
-        if result:
-            return result.get("description")
-    except Exception:
-        pass
-        
-    # Fallback to Title
-    result = collection.find_one(
-        {"email": email, "title": identifier}, 
-        {"description": 1}
-    )
+    result = collection.find_one(_identifier_filter(email, identifier), {"description": 1})
     if result:
         return result.get("description")
     return None
@@ -274,28 +662,88 @@ def get_task_tags(client: MongoClient, email: str, identifier: str) -> Optional[
     """Retrieves the tags for a specific task by ID or Title."""
     db = client[DB_NAME]
     collection = db["tasks"]
-    
-    # Try as ObjectId first
-    try:
-        result = collection.find_one(
-            {"email": email, "_id": ObjectId(identifier)}, 
-            {"tag_names": 1}
-        )
-        if result:
-            return result.get("tag_names")
-    except Exception:
-        pass
-
-    # Fallback to Title
-    result = collection.find_one(
-        {"email": email, "title": identifier}, 
-        {"tag_names": 1}
-    )
+    result = collection.find_one(_identifier_filter(email, identifier), {"tag_names": 1})
     if result:
         return result.get("tag_names")
     return None
 
 
+def _task_embedding_text(title: str, description: Optional[str]) -> str:
+    """Combines title and description for better embedding context."""
+    embedding_text = title
+    if description:
+        embedding_text += f": {description}"
+    return embedding_text
+
+
+def _payload_hash(fields: Dict[str, Any]) -> str:
+    """Stable hash of a task write's fields, used to recognise retried creates."""
+    encoded = json.dumps(fields, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def _needs_embedding(existing: Optional[Dict[str, Any]], embedding_text: str) -> bool:
+    """True unless the stored task already has an embedding of the same text."""
+    if existing is None or "embedding" not in existing or existing.get("embedding_status") == "pending":
+        return True
+    return embedding_text != _task_embedding_text(existing.get("title", ""), existing.get("description"))
+
+
+# Fields read from an existing task to decide whether a write can be skipped
+_IDEMPOTENCY_PROJECTION = {
+    "email": 1, "task_client_id": 1, "payload_hash": 1, "title": 1, "description": 1, "embedding": 1,
+    "embedding_status": 1
+}
+
+
+def _build_task_fields(
+    email: str,
+    title: str,
+    task_client_id: str,
+    description: Optional[str] = None,
+    tag_names: Optional[List[str]] = None,
+    start_time: Optional[Any] = None,
+    duration: Optional[int] = 0,
+    recurrence: Optional[str] = None,
+    is_completed: bool = False,
+    flowbot_suggest_duration: Optional[int] = None,
+    actual_duration: Optional[int] = None,
+    color: Optional[str] = None,
+    ai_estimation_status: Optional[str] = None,
+    ai_time_estimation: Optional[int] = None,
+    ai_recommendation: Optional[str] = None,
+    ai_reasoning: Optional[str] = None,
+    ai_confidence: Optional[str] = None
+) -> Dict[str, Any]:
+    """Builds the $set document for a task write, skipping unset optional fields."""
+    update_data = {
+        "email": email, 
+        "title": title,
+        "task_client_id": task_client_id,
+        "is_completed": is_completed
+    }
+
+    optional_fields = {
+        "description": description,
+        "tag_names": tag_names,
+        "start_time": start_time,
+        "duration": duration,
+        "recurrence": recurrence,
+        "flowbot_suggest_duration": flowbot_suggest_duration,
+        "actual_duration": actual_duration,
+        "color": color,
+        "ai_estimation_status": ai_estimation_status,
+        "ai_time_estimation": ai_time_estimation,
+        "ai_recommendation": ai_recommendation,
+        "ai_reasoning": ai_reasoning,
+        "ai_confidence": ai_confidence,
+    }
+    for field, value in optional_fields.items():
+        if value is not None:
+            update_data[field] = value
+    return update_data
+
+
 def set_task(
     client: MongoClient, 
     email: str, 
@@ -315,72 +763,226 @@ def set_task(
     ai_recommendation: Optional[str] = None,
     ai_reasoning: Optional[str] = None,
     ai_confidence: Optional[str] = None
-) -> bool:
+) -> str:
     """
-    Creates or updates a task. 
+    Creates or updates a task, keyed by (email, task_client_id).
     - title is required
     - description and tag_names are optional
-    Returns True if the operation was successful.
+    task_client_id is an idempotency key: repeating a write with an identical
+    payload changes nothing and skips the embedding call. The embedding is also
+    reused when the title and description are unchanged.
+    Returns "created", "updated" or "unchanged".
     """
     db = client[DB_NAME]
     collection = db["tasks"]
     
-    update_data = {
-        "email": email, 
-        "title": title,
-        "task_client_id": task_client_id,
-        "is_completed": is_completed
-    }
-    
-    if description is not None:
-        update_data["description"] = description
-    if tag_names is not None:
-        update_data["tag_names"] = tag_names
+    update_data = _build_task_fields(
+        email, title, task_client_id, description, tag_names, start_time, duration,
+        recurrence, is_completed, flowbot_suggest_duration, actual_duration, color,
+        ai_estimation_status, ai_time_estimation, ai_recommendation, ai_reasoning,
+        ai_confidence
+    )
+    payload_hash = _payload_hash(update_data)
+
+    task_filter = {"email": email, "task_client_id": task_client_id}
+    existing = collection.find_one(task_filter, _IDEMPOTENCY_PROJECTION)
+    if existing is not None and existing.get("payload_hash") == payload_hash:
+        return "unchanged"
+    update_data["payload_hash"] = payload_hash
     
     # Generate embedding for vector search using title and description
-    # Combine title and description for better context
-    embedding_text = title
-    if description:
-        embedding_text += f": {description}"
-    
-    embedding = _generate_embedding(embedding_text)
-    if embedding is not None:
-        update_data["embedding"] = embedding
-    if start_time is not None:
-        update_data["start_time"] = start_time
-    if duration is not None:
-        update_data["duration"] = duration
-    if recurrence is not None:
-        update_data["recurrence"] = recurrence
-    if flowbot_suggest_duration is not None:
-        update_data["flowbot_suggest_duration"] = flowbot_suggest_duration
-    if actual_duration is not None:
-        update_data["actual_duration"] = actual_duration
-    if color is not None:
-        update_data["color"] = color
-    if ai_estimation_status is not None:
-        update_data["ai_estimation_status"] = ai_estimation_status
-    if ai_time_estimation is not None:
-        update_data["ai_time_estimation"] = ai_time_estimation
-    if ai_recommendation is not None:
-        update_data["ai_recommendation"] = ai_recommendation
-    if ai_reasoning is not None:
-        update_data["ai_reasoning"] = ai_reasoning
-    if ai_confidence is not None:
-        update_data["ai_confidence"] = ai_confidence
+    embedding_text = _task_embedding_text(title, description)
+    if _needs_embedding(existing, embedding_text):
+        update_data.update(_embedding_fields(_generate_embedding(embedding_text)))
+
+    now = _utcnow()
+    update_data["updated_at"] = now
     
-    result = collection.update_one(
-        {"email": email, "title": title},
-        {"$set": update_data},
-        upsert=True
-    )
+    try:
+        task = collection.find_one_and_update(
+            task_filter,
+            {"$set": update_data, "$setOnInsert": {"created_at": now}},
+            projection={"embedding": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # A concurrent retry with the same task_client_id inserted it first
+        return "unchanged"
+    status = "created" if existing is None else "updated"
+    _notify_task_change(status, task)
     
-    return result.acknowledged
+    return status
+
+
+def set_tasks_bulk(client: MongoClient, tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Creates or updates many tasks with batched embeddings and one unordered bulk_write.
+    Each entry takes the same keyword arguments as set_task, with the same
+    task_client_id idempotency: unchanged tasks are skipped and unchanged texts
+    are not re-embedded.
+    Returns one result per input, in order:
+    {"index", "title", "task_client_id",
+     "status": "created" | "updated" | "unchanged" | "error", "error"?}
+    """
+    db = client[DB_NAME]
+    collection = db["tasks"]
+
+    results: List[Dict[str, Any]] = [
+        {"index": i, "title": task.get("title"), "task_client_id": task.get("task_client_id")}
+        for i, task in enumerate(tasks)
+    ]
+
+    # Two upserts on the same task_client_id in one unordered batch could both insert
+    seen = set()
+    candidates = []
+    for i, task in enumerate(tasks):
+        key = (task.get("email"), task.get("task_client_id"))
+        if key in seen:
+            results[i].update(status="error", error="Duplicate task_client_id in request")
+            continue
+        seen.add(key)
+        candidates.append(i)
+
+    if not candidates:
+        return results
+
+    client_ids_by_email: Dict[str, List[str]] = {}
+    for i in candidates:
+        client_ids_by_email.setdefault(tasks[i]["email"], []).append(tasks[i]["task_client_id"])
+    existing = {
+        (task["email"], task["task_client_id"]): task
+        for task in collection.find(
+            {"$or": [
+                {"email": email, "task_client_id": {"$in": client_ids}}
+                for email, client_ids in client_ids_by_email.items()
+            ]},
+            _IDEMPOTENCY_PROJECTION
+        )
+    }
+
+    writable = []
+    fields: Dict[int, Dict[str, Any]] = {}
+    for i in candidates:
+        update_data = _build_task_fields(**tasks[i])
+        update_data["payload_hash"] = _payload_hash(update_data)
+        stored = existing.get((tasks[i]["email"], tasks[i]["task_client_id"]))
+        if stored is not None and stored.get("payload_hash") == update_data["payload_hash"]:
+            results[i]["status"] = "unchanged"
+            continue
+        fields[i] = update_data
+        writable.append(i)
+
+    if not writable:
+        return results
+
+    texts = {i: _task_embedding_text(tasks[i]["title"], tasks[i].get("description")) for i in writable}
+    to_embed = [
+        i for i in writable
+        if _needs_embedding(existing.get((tasks[i]["email"], tasks[i]["task_client_id"])), texts[i])
+    ]
+    if to_embed:
+        for i, embedding in zip(to_embed, _generate_embeddings([texts[i] for i in to_embed])):
+            fields[i].update(_embedding_fields(embedding))
+
+    now = _utcnow()
+    operations = []
+    for i in writable:
+        update_data = fields[i]
+        update_data["updated_at"] = now
+        operations.append(UpdateOne(
+            {"email": update_data["email"], "task_client_id": update_data["task_client_id"]},
+            {"$set": update_data, "$setOnInsert": {"created_at": now}},
+            upsert=True
+        ))
+
+    try:
+        bulk_result = collection.bulk_write(operations, ordered=False)
+        details = bulk_result.bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+
+    upserted = {entry["index"] for entry in details.get("upserted", [])}
+    errors = {entry["index"]: entry.get("errmsg", "Write failed") for entry in details.get("writeErrors", [])}
+    written = []
+    for op_index, i in enumerate(writable):
+        if op_index in errors:
+            results[i].update(status="error", error=errors[op_index])
+            continue
+        results[i]["status"] = "created" if op_index in upserted else "updated"
+        written.append(i)
+
+    if _task_change_listeners and written:
+        # bulk_write does not return documents, so read the written tasks back in one query
+        written_by_email: Dict[str, List[str]] = {}
+        for i in written:
+            written_by_email.setdefault(tasks[i]["email"], []).append(tasks[i]["task_client_id"])
+        saved = {
+            (task["email"], task["task_client_id"]): task
+            for task in collection.find(
+                {"$or": [
+                    {"email": email, "task_client_id": {"$in": client_ids}}
+                    for email, client_ids in written_by_email.items()
+                ]},
+                {"embedding": 0}
+            )
+        }
+        for i in written:
+            task = saved.get((tasks[i]["email"], tasks[i]["task_client_id"]))
+            if task is not None:
+                _notify_task_change(results[i]["status"], task)
+    return results
+
+
+def backfill_pending_embeddings(client: MongoClient, limit: int = EMBEDDING_BATCH_SIZE) -> int:
+    """
+    Embeds tasks written while the embedding provider was unavailable
+    (embedding_status "pending"), in one batched provider call.
+    A task edited in the meantime is left pending for the next run.
+    Returns the number of tasks embedded.
+    """
+    if llm_client.embedding_breaker.state == "open":
+        return 0
+    collection = client[DB_NAME]["tasks"]
+    pending = list(collection.find(
+        {"embedding_status": "pending"},
+        {"title": 1, "description": 1},
+        limit=limit
+    ))
+    if not pending:
+        return 0
+
+    texts = [_task_embedding_text(task.get("title", ""), task.get("description")) for task in pending]
+    operations = [
+        UpdateOne(
+            {
+                "_id": task["_id"],
+                "embedding_status": "pending",
+                "title": task.get("title"),
+                "description": task.get("description")
+            },
+            {"$set": _embedding_fields(embedding)}
+        )
+        for task, embedding in zip(pending, _generate_embeddings(texts))
+        if embedding is not None
+    ]
+    if not operations:
+        return 0
+    return collection.bulk_write(operations, ordered=False).matched_count
 
 
-def update_task_fields(client: MongoClient, task_id: str, updates: Dict[str, Any]) -> bool:
+def update_task_fields(
+    client: MongoClient,
+    task_id: str,
+    updates: Dict[str, Any],
+    email: Optional[str] = None,
+    return_document: bool = False
+) -> Union[bool, Optional[Dict[str, Any]]]:
     """
     Updates specific fields of a task using its _id.
+    If email is given, only a task owned by that user is updated.
+    Returns True if a task was updated, or the updated task (None if not found)
+    when return_document is True.
     """
     from bson import ObjectId
     db = client[DB_NAME]
@@ -389,12 +991,57 @@ def update_task_fields(client: MongoClient, task_id: str, updates: Dict[str, Any
     # potentially filter out _id from updates if passed
     if "_id" in updates:
         del updates["_id"]
+    updates["updated_at"] = _utcnow()
 
-    result = collection.update_one(
-        {"_id": ObjectId(task_id)},
-        {"$set": updates}
-    )
-    return result.acknowledged
+    task_filter: Dict[str, Any] = {"_id": ObjectId(task_id)}
+    if email is not None:
+        task_filter["email"] = email
+    task = _update_task_and_notify(collection, task_filter, {"$set": updates})
+    return task if return_document else task is not None
+
+
+def update_tasks_fields_bulk(
+    client: MongoClient,
+    updates: List[Tuple[str, Optional[str], Dict[str, Any]]]
+) -> int:
+    """
+    Applies many update_task_fields calls in one ordered bulk_write.
+    Each entry is (task_id, email or None, fields); entries are applied in order.
+    Returns the number of tasks matched.
+    """
+    db = client[DB_NAME]
+    collection = db["tasks"]
+    if not updates:
+        return 0
+
+    now = _utcnow()
+    operations = []
+    for task_id, email, fields in updates:
+        task_filter: Dict[str, Any] = {"_id": ObjectId(task_id)}
+        if email is not None:
+            task_filter["email"] = email
+        operations.append(UpdateOne(task_filter, {"$set": {**fields, "updated_at": now}}))
+    result = collection.bulk_write(operations, ordered=True)
+
+    if _task_change_listeners:
+        # bulk_write does not return documents, so read the updated tasks back in one query
+        written: Dict[str, set] = {}
+        for task_id, _, fields in updates:
+            written.setdefault(task_id, {"updated_at"}).update(fields)
+        task_ids = [ObjectId(task_id) for task_id in written]
+        for task in collection.find({"_id": {"$in": task_ids}, "updated_at": now}, {"embedding": 0}):
+            _notify_task_change("updated", task, sorted(written[str(task["_id"])]))
+    return result.bulk_api_result.get("nMatched", 0)
+
+
+def _record_tombstone(client: MongoClient, task: Dict[str, Any]) -> None:
+    """Records a deleted task so delta sync clients can drop it."""
+    client[DB_NAME]["task_tombstones"].insert_one({
+        "email": task.get("email"),
+        "task_id": str(task["_id"]),
+        "task_client_id": task.get("task_client_id"),
+        "deleted_at": _utcnow()
+    })
 
 
 def delete_task_by_id(client: MongoClient, task_id: str) -> bool:
@@ -404,149 +1051,109 @@ def delete_task_by_id(client: MongoClient, task_id: str) -> bool:
     from bson import ObjectId
     db = client[DB_NAME]
     collection = db["tasks"]
-    result = collection.delete_one({"_id": ObjectId(task_id)})
-    return result.deleted_count > 0
+    deleted = collection.find_one_and_delete(
+        {"_id": ObjectId(task_id)},
+        projection={"email": 1, "task_client_id": 1}
+    )
+    if deleted is None:
+        return False
+    _record_tombstone(client, deleted)
+    _notify_task_change("deleted", deleted)
+    return True
 
 
-def set_task_description(client: MongoClient, email: str, identifier: str, description: str) -> bool:
+def set_task_description(
+    client: MongoClient,
+    email: str,
+    identifier: str,
+    description: str,
+    return_document: bool = False
+) -> Union[bool, Optional[Dict[str, Any]]]:
     """
     Sets or updates only the description for a task by ID or Title.
+    Returns True if a task was updated, or the updated task (None if not found)
+    when return_document is True.
     """
     db = client[DB_NAME]
     collection = db["tasks"]
     
-    update_data = {"description": description}
+    update_data = {"description": description, "updated_at": _utcnow()}
     
     # Regenerate embedding since description changed
     embedding_text = description
-    embedding = _generate_embedding(embedding_text)
-    if embedding is not None:
-        update_data["embedding"] = embedding
+    update_data.update(_embedding_fields(_generate_embedding(embedding_text)))
 
-    try:
-        # Try as ObjectId first
-        result = collection.update_one(
-            {"email": email, "_id": ObjectId(identifier)},
-            {"$set": {"description": description}}
-        )
-        if result.acknowledged and result.matched_count > 0:
-            return True
-    except Exception:
-        pass
-        
-    # Fallback to Title
-    try:
-        result = collection.update_one(
-            {"email": email, "title": identifier},
-            {"$set": update_data}
-        )
-        return result.acknowledged
-    except Exception:
-        return False
+    task = _update_task_and_notify(collection, _identifier_filter(email, identifier), {"$set": update_data})
+    return task if return_document else task is not None
 
 
-def set_task_tags(client: MongoClient, email: str, identifier: str, tag_names: List[str]) -> bool:
+def set_task_tags(
+    client: MongoClient,
+    email: str,
+    identifier: str,
+    tag_names: List[str],
+    return_document: bool = False
+) -> Union[bool, Optional[Dict[str, Any]]]:
     """
     Sets or updates the tag_names list for a task by ID or Title.
+    Returns True if a task was updated, or the updated task when return_document is True.
     """
     db = client[DB_NAME]
     collection = db["tasks"]
-    
-    try:
-        # Try as ObjectId first
-        result = collection.update_one(
-            {"email": email, "_id": ObjectId(identifier)},
-            {"$set": {"tag_names": tag_names}}
-        )
-        if result.acknowledged and result.matched_count > 0:
-            return True
-    except Exception:
-        pass
-        
-    # Fallback to Title
-    try:
-        result = collection.update_one(
-            {"email": email, "title": identifier},
-            {"$set": {"tag_names": tag_names}}
-        )
-        return result.acknowledged
-    except Exception:
-        return False
+    update = {"$set": {"tag_names": tag_names, "updated_at": _utcnow()}}
+    task = _update_task_and_notify(collection, _identifier_filter(email, identifier), update)
+    return task if return_document else task is not None
 
 
-def add_tag_to_task(client: MongoClient, email: str, identifier: str, tag_name: str) -> bool:
+def add_tag_to_task(
+    client: MongoClient,
+    email: str,
+    identifier: str,
+    tag_name: str,
+    return_document: bool = False
+) -> Union[bool, Optional[Dict[str, Any]]]:
     """
     Adds a single tag to a task's tag_names list (avoids duplicates) by ID or Title.
+    Returns True if a task was updated, or the updated task when return_document is True.
     """
     db = client[DB_NAME]
     collection = db["tasks"]
-    
-    try:
-        # Try as ObjectId first
-        result = collection.update_one(
-            {"email": email, "_id": ObjectId(identifier)},
-            {"$addToSet": {"tag_names": tag_name}}
-        )
-        if result.acknowledged and result.matched_count > 0:
-            return True
-    except Exception:
-        pass
-        
-    # Fallback to Title
-    try:
-        result = collection.update_one(
-            {"email": email, "title": identifier},
-            {"$addToSet": {"tag_names": tag_name}}
-        )
-        return result.acknowledged
-    except Exception:
-        return False
+    update = {"$addToSet": {"tag_names": tag_name}, "$set": {"updated_at": _utcnow()}}
+    task = _update_task_and_notify(collection, _identifier_filter(email, identifier), update)
+    return task if return_document else task is not None
 
 
-def remove_tag_from_task(client: MongoClient, email: str, identifier: str, tag_name: str) -> bool:
+def remove_tag_from_task(
+    client: MongoClient,
+    email: str,
+    identifier: str,
+    tag_name: str,
+    return_document: bool = False
+) -> Union[bool, Optional[Dict[str, Any]]]:
     """
     Removes a single tag from a task's tag_names list by ID or Title.
+    Returns True if a task was updated, or the updated task when return_document is True.
     """
     db = client[DB_NAME]
     collection = db["tasks"]
-    
-    try:
-        # Try as ObjectId first
-        result = collection.update_one(
-            {"email": email, "_id": ObjectId(identifier)},
-            {"$pull": {"tag_names": tag_name}}
-        )
-        if result.acknowledged and result.matched_count > 0:
-            return True
-    except Exception:
-        pass
-        
-    # Fallback to Title
-    try:
-        result = collection.update_one(
-            {"email": email, "title": identifier},
-            {"$pull": {"tag_names": tag_name}}
-        )
-        return result.acknowledged
-    except Exception:
-        return False
+    update = {"$pull": {"tag_names": tag_name}, "$set": {"updated_at": _utcnow()}}
+    task = _update_task_and_notify(collection, _identifier_filter(email, identifier), update)
+    return task if return_document else task is not None
 
 
 def delete_task(client: MongoClient, email: str, identifier: str) -> bool:
     """Deletes a specific task by ID or Title."""
     db = client[DB_NAME]
     collection = db["tasks"]
-    try:
-        # Try as ObjectId first
-        result = collection.delete_one({"email": email, "_id": ObjectId(identifier)})
-        if result.deleted_count > 0:
-            return True
-    except Exception:
-        pass
-    
-    # Fallback to Title
-    result = collection.delete_one({"email": email, "title": identifier})
-    return result.deleted_count > 0
+    deleted = collection.find_one_and_delete(
+        _identifier_filter(email, identifier),
+        projection={"email": 1, "task_client_id": 1}
+    )
+    if deleted is None:
+        return False
+    _record_tombstone(client, deleted)
+    _notify_task_change("deleted", deleted)
+    return True
 
 
 def get_all_tasks_for_user(client: MongoClient, email: str) -> List[Dict[str, Any]]:
@@ -556,6 +1163,44 @@ def get_all_tasks_for_user(client: MongoClient, email: str) -> List[Dict[str, An
     return list(collection.find({"email": email}))
 
 
+def get_task_changes(client: MongoClient, email: str, since: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Returns the tasks changed and deleted for a user since a sync token.
+    - since is the sync_token a previous call returned (None for the initial sync)
+    - full_resync is True when the client must replace its whole task list, either
+      because this is the initial sync or because tombstones older than the token
+      may already have expired
+    Changes in the SYNC_TOKEN_SAFETY_SECONDS before the token are returned again on
+    the next call, so clients should upsert by _id.
+    Task documents are returned without their embedding vectors.
+    """
+    db = client[DB_NAME]
+    now = _utcnow()
+    sync_token = now - timedelta(seconds=SYNC_TOKEN_SAFETY_SECONDS)
+    projection = {"embedding": 0}
+
+    full_resync = since is None or since < now - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    if full_resync:
+        return {
+            "tasks": list(db["tasks"].find({"email": email}, projection)),
+            "deleted": [],
+            "sync_token": sync_token,
+            "full_resync": True
+        }
+
+    tasks = list(db["tasks"].find({"email": email, "updated_at": {"$gte": since}}, projection))
+    deleted = list(db["task_tombstones"].find(
+        {"email": email, "deleted_at": {"$gte": since}},
+        {"_id": 0, "task_id": 1, "task_client_id": 1, "deleted_at": 1}
+    ))
+    return {
+        "tasks": tasks,
+        "deleted": deleted,
+        "sync_token": sync_token,
+        "full_resync": False
+    }
+
+
 def get_tasks_by_tag(client: MongoClient, email: str, tag_name: str) -> List[Dict[str, Any]]:
     """Retrieves all tasks for a user that have a specific tag."""
     db = client[DB_NAME]
@@ -563,6 +1208,215 @@ def get_tasks_by_tag(client: MongoClient, email: str, tag_name: str) -> List[Dic
     return list(collection.find({"email": email, "tag_names": tag_name}))
 
 
+def get_recent_tasks_with_tag(
+    client: MongoClient,
+    email: str,
+    tag_name: str,
+    exclude_task_client_id: Optional[str] = None,
+    limit: int = 20
+) -> List[Dict[str, Any]]:
+    """
+    Retrieves the user's most recently updated tasks with a tag and a recorded
+    duration, as {"title", "duration"} only. Used for instant estimates.
+    """
+    db = client[DB_NAME]
+    collection = db["tasks"]
+    query: Dict[str, Any] = {"email": email, "tag_names": tag_name, "duration": {"$gt": 0}}
+    if exclude_task_client_id is not None:
+        query["task_client_id"] = {"$ne": exclude_task_client_id}
+    return list(collection.find(
+        query,
+        {"_id": 0, "title": 1, "duration": 1},
+        sort=[("updated_at", -1)],
+        limit=limit
+    ))
+
+
+# =============================================================================
+# ESTIMATION MEMO
+# =============================================================================
+# Recurring tasks and tasks copied from templates ask for the same estimate again
+# and again. LLM estimates are stored per user under a signature of the task
+# (normalized title, description, tags and initial estimate) together with the
+# history version of its tags: a count and latest update of the user's completed
+# tasks with those tags. Completing, editing or deleting such a task changes the
+# version, so later lookups miss and the estimate is recomputed.
+
+ESTIMATION_MEMO_ENABLED = os.getenv("ESTIMATION_MEMO_ENABLED", "true").lower() not in ("0", "false", "no")
+ESTIMATION_MEMO_TTL_DAYS = int(os.getenv("ESTIMATION_MEMO_TTL_DAYS", "30"))
+
+estimation_memo_stats = {"hits": 0, "misses": 0, "stale": 0, "stored": 0}
+
+
+def _normalize_text(text: Optional[str]) -> str:
+    return " ".join((text or "").lower().split())
+
+
+def estimation_signature(
+    title: str,
+    description: Optional[str],
+    tag_names: List[str],
+    initial_duration: int
+) -> str:
+    """Signature of what an estimate depends on; case and whitespace are ignored."""
+    fields = {
+        "title": _normalize_text(title),
+        "description": _normalize_text(description),
+        "tags": sorted({_normalize_text(tag) for tag in tag_names}),
+        "initial_duration": initial_duration
+    }
+    return _payload_hash(fields)
+
+
+def get_history_version(client: MongoClient, email: str, tag_names: List[str]) -> str:
+    """Changes whenever a completed task with one of the tags is added, edited or removed."""
+    db = client[DB_NAME]
+    collection = db["tasks"]
+    parts = []
+    for tag_name in sorted(set(tag_names)):
+        query = {"email": email, "tag_names": tag_name, "is_completed": True}
+        latest = collection.find(query, {"_id": 0, "updated_at": 1}, sort=[("updated_at", -1)], limit=1)
+        latest_at = next(iter(latest), {}).get("updated_at")
+        parts.append(f"{tag_name}:{collection.count_documents(query)}:{latest_at.isoformat() if latest_at else ''}")
+    return "|".join(parts)
+
+
+def get_estimation_memo(
+    client: MongoClient,
+    email: str,
+    signature: str,
+    history_version: str
+) -> Optional[Dict[str, Any]]:
+    """Returns the stored estimate for the signature if the history hasn't changed since."""
+    if not ESTIMATION_MEMO_ENABLED:
+        return None
+    db = client[DB_NAME]
+    memo = db["estimation_memo"].find_one({"email": email, "signature": signature}, {"_id": 0})
+    if memo is None:
+        estimation_memo_stats["misses"] += 1
+        return None
+    if memo.get("history_version") != history_version:
+        estimation_memo_stats["stale"] += 1
+        return None
+    estimation_memo_stats["hits"] += 1
+    return memo
+
+
+def set_estimation_memo(
+    client: MongoClient,
+    email: str,
+    signature: str,
+    history_version: str,
+    ai_time_estimation: int,
+    ai_recommendation: str,
+    ai_reasoning: str,
+    ai_confidence: str
+) -> bool:
+    """Stores an estimate for the signature, replacing any older one."""
+    if not ESTIMATION_MEMO_ENABLED:
+        return False
+    db = client[DB_NAME]
+    db["estimation_memo"].update_one(
+        {"email": email, "signature": signature},
+        {"$set": {
+            "history_version": history_version,
+            "ai_time_estimation": ai_time_estimation,
+            "ai_recommendation": ai_recommendation,
+            "ai_reasoning": ai_reasoning,
+            "ai_confidence": ai_confidence,
+            "created_at": _utcnow()
+        }},
+        upsert=True
+    )
+    estimation_memo_stats["stored"] += 1
+    return True
+
+
+# =============================================================================
+# PAGE CACHE
+# =============================================================================
+# Users paste the same course pages and docs links again and again. The search
+# agent stores the text it extracted from a page together with the page's ETag
+# and Last-Modified headers. For PAGE_CACHE_TTL_SECONDS after it was last checked
+# the text is used as is; after that the page is fetched with a conditional
+# request and a 304 answer keeps the stored text without downloading it again.
+
+PAGE_CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+PAGE_CACHE_TTL_SECONDS = int(os.getenv("PAGE_CACHE_TTL_SECONDS", "3600"))
+PAGE_CACHE_RETENTION_DAYS = int(os.getenv("PAGE_CACHE_RETENTION_DAYS", "7"))
+
+page_cache_stats = {"hits": 0, "misses": 0, "stale": 0, "revalidated": 0, "stored": 0, "bytes_saved": 0}
+
+
+def get_cached_pages(client: MongoClient, urls: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the cached pages of the urls, keyed by url. Pages checked more than
+    PAGE_CACHE_TTL_SECONDS ago have "fresh": False and must be revalidated first.
+    """
+    if not PAGE_CACHE_ENABLED or not urls:
+        return {}
+    db = client[DB_NAME]
+    pages = {
+        page["url"]: page
+        for page in db["page_cache"].find({"url": {"$in": list(urls)}}, {"_id": 0})
+    }
+    fresh_since = _utcnow() - timedelta(seconds=PAGE_CACHE_TTL_SECONDS)
+    for url in dict.fromkeys(urls):
+        page = pages.get(url)
+        if page is None:
+            page_cache_stats["misses"] += 1
+        elif page["checked_at"] >= fresh_since:
+            page["fresh"] = True
+            page_cache_stats["hits"] += 1
+            page_cache_stats["bytes_saved"] += page.get("size", 0)
+        else:
+            page["fresh"] = False
+            page_cache_stats["stale"] += 1
+    return pages
+
+
+def set_cached_page(
+    client: MongoClient,
+    url: str,
+    text: str,
+    etag: Optional[str],
+    last_modified: Optional[str],
+    size: int
+) -> bool:
+    """Stores the extracted text of a downloaded page of size bytes, replacing any older copy."""
+    if not PAGE_CACHE_ENABLED:
+        return False
+    db = client[DB_NAME]
+    db["page_cache"].update_one(
+        {"url": url},
+        {"$set": {
+            "text": text,
+            "etag": etag,
+            "last_modified": last_modified,
+            "size": size,
+            "checked_at": _utcnow()
+        }},
+        upsert=True
+    )
+    page_cache_stats["stored"] += 1
+    return True
+
+
+def revalidate_cached_page(client: MongoClient, url: str, size: int) -> None:
+    """Marks a cached page as fresh again after the server answered 304 Not Modified."""
+    db = client[DB_NAME]
+    db["page_cache"].update_one({"url": url}, {"$set": {"checked_at": _utcnow()}})
+    page_cache_stats["revalidated"] += 1
+    page_cache_stats["bytes_saved"] += size
+
+
+def page_cache_metrics() -> Dict[str, Any]:
+    """Page cache counters plus the share of lookups answered without a download."""
+    lookups = page_cache_stats["hits"] + page_cache_stats["stale"] + page_cache_stats["misses"]
+    served = page_cache_stats["hits"] + page_cache_stats["revalidated"]
+    return {**page_cache_stats, "hit_rate": round(served / lookups, 3) if lookups else None}
+
+
 def get_all_tasks(client: MongoClient) -> List[Dict[str, Any]]:
     """Retrieves all tasks in the database."""
     db = client[DB_NAME]
@@ -773,7 +1627,8 @@ def update_task_ai_estimation(
     collection = db["tasks"]
     
     update_data = {
-        "ai_estimation_status": ai_estimation_status
+        "ai_estimation_status": ai_estimation_status,
+        "updated_at": _utcnow()
     }
     
     if ai_time_estimation is not None:
@@ -785,9 +1640,6 @@ def update_task_ai_estimation(
     if ai_confidence is not None:
         update_data["ai_confidence"] = ai_confidence
         
-    result = collection.update_one(
-        {"task_client_id": task_client_id},
-        {"$set": update_data}
-    )
+    _update_task_and_notify(collection, {"task_client_id": task_client_id}, {"$set": update_data})
     
-    return result.acknowledged
\ No newline at end of file
+    return True
\ No newline at end of file
@@ -0,0 +1,180 @@
+"""
+Deadlines and Cancellation for Estimation Jobs
+
+Each estimation runs with a Deadline that travels through the graph state into
+the Mongo and LLM calls, so a hung provider can only hold a job for
+ESTIMATION_TIMEOUT_SECONDS. The deadline doubles as a cancellation token:
+
+- starting a new estimation for a task cancels the one still running ("superseded")
+- deleting a task cancels its estimation ("deleted")
+- editing a task's title, description, tags or duration cancels it ("edited")
+
+Deletes and edits arrive as task events (see task_events.py), so a write made
+on any API worker cancels the job on the worker running it.
+
+A cancelled or timed-out job raises at its next check and never writes results.
+Time spent in each stage, and which stage ran out of time, is recorded on the
+deadline and counted in EstimationJobs.metrics().
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ESTIMATION_TIMEOUT_SECONDS = float(os.getenv("ESTIMATION_TIMEOUT_SECONDS", "30"))
+
+# Task fields an estimate is computed from; updating one makes a running estimate stale
+ESTIMATION_INPUT_FIELDS = {"title", "description", "tag_names", "duration"}
+
+
+class DeadlineExceeded(Exception):
+    """The job ran out of time in the given stage."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class JobCancelled(Exception):
+    """The job was cancelled, e.g. because its task was deleted."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Job cancelled: {reason}")
+        self.reason = reason
+
+
+class Deadline:
+    """Absolute deadline plus cancellation flag for one job. Thread-safe."""
+
+    def __init__(self, timeout_seconds: float = ESTIMATION_TIMEOUT_SECONDS):
+        self.expires_at = time.monotonic() + timeout_seconds
+        self._cancelled = threading.Event()
+        self.cancel_reason: Optional[str] = None
+        # stage -> {"ms": float, "status": "ok" | "timeout" | "cancelled" | "error"}
+        self.stages: Dict[str, Dict[str, Any]] = {}
+
+    def remaining(self) -> float:
+        """Seconds left, never negative."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self, reason: str) -> None:
+        if not self._cancelled.is_set():
+            self.cancel_reason = reason
+            self._cancelled.set()
+
+    def check(self, stage: str) -> None:
+        """Raises JobCancelled or DeadlineExceeded if the job should stop now."""
+        if self.cancelled:
+            raise JobCancelled(self.cancel_reason or "cancelled")
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(stage)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Checks the deadline on entry and records how long the stage took and how it ended."""
+        started = time.monotonic()
+        status = "ok"
+        try:
+            self.check(name)
+            yield
+        except DeadlineExceeded:
+            status = "timeout"
+            raise
+        except JobCancelled:
+            status = "cancelled"
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            self.stages[name] = {"ms": round((time.monotonic() - started) * 1000, 1), "status": status}
+
+
+class EstimationJobs:
+    """Tracks the running estimation per task_client_id so it can be cancelled."""
+
+    def __init__(self, timeout_seconds: float = ESTIMATION_TIMEOUT_SECONDS):
+        self.timeout = timeout_seconds
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Deadline] = {}
+        self.started = 0
+        self.completed = 0
+        self.cancelled: Dict[str, int] = {}
+        self.timeouts: Dict[str, int] = {}
+
+    def start(self, events: Any) -> None:
+        """Cancels estimations of tasks as they are deleted or edited, given a TaskEventPublisher."""
+        events.add_listener(self._on_task_event)
+
+    def stop(self, events: Any) -> None:
+        events.remove_listener(self._on_task_event)
+
+    def begin(self, task_client_id: str) -> Deadline:
+        """Starts a job for the task, superseding any estimation still running for it."""
+        deadline = Deadline(self.timeout)
+        with self._lock:
+            previous = self._jobs.get(task_client_id)
+            self._jobs[task_client_id] = deadline
+            self.started += 1
+        if previous is not None:
+            previous.cancel("superseded")
+        return deadline
+
+    def cancel(self, task_client_id: str, reason: str) -> bool:
+        """Cancels the running estimation for the task. Returns True if there was one."""
+        with self._lock:
+            deadline = self._jobs.pop(task_client_id, None)
+        if deadline is None:
+            return False
+        deadline.cancel(reason)
+        return True
+
+    def finish(self, task_client_id: str, deadline: Deadline, error: Optional[Exception] = None) -> None:
+        """Records how a job ended and forgets it, unless a newer job replaced it."""
+        with self._lock:
+            if self._jobs.get(task_client_id) is deadline:
+                del self._jobs[task_client_id]
+            if isinstance(error, DeadlineExceeded):
+                self.timeouts[error.stage] = self.timeouts.get(error.stage, 0) + 1
+            elif isinstance(error, JobCancelled) or deadline.cancelled:
+                reason = deadline.cancel_reason or "cancelled"
+                self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+            elif error is None:
+                self.completed += 1
+
+    def _on_task_event(self, event: Dict[str, Any]) -> None:
+        task_client_id = event.get("task_client_id")
+        if not task_client_id:
+            return
+        if event["op"] == "deleted":
+            self.cancel(task_client_id, "deleted")
+        elif event["op"] == "updated":
+            # Unknown fields (a whole-task write) may have changed the inputs too
+            fields = event.get("fields")
+            if fields is None or ESTIMATION_INPUT_FIELDS.intersection(fields):
+                self.cancel(task_client_id, "edited")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            running = len(self._jobs)
+        return {
+            "timeout_seconds": self.timeout,
+            "running": running,
+            "started": self.started,
+            "completed": self.completed,
+            "cancelled": dict(self.cancelled),
+            "timeouts_by_stage": dict(self.timeouts)
+        }
+
+
+estimation_jobs = EstimationJobs()
@@ -43,6 +43,19 @@ export interface Task {
     ai_confidence?: string;
 }
 
+export interface TaskTombstone {
+    task_id: string;
+    task_client_id?: string;
+    deleted_at: string;
+}
+
+export interface TaskChanges {
+    tasks: Task[];
+    deleted: TaskTombstone[];
+    sync_token: string;
+    full_resync: boolean;
+}
+
 // ============================================================================
 // USER API
 // ============================================================================
@@ -216,6 +229,13 @@ export const taskAPI = {
         return response.json();
     },
 
+    getChanges: async (email: string, since?: string | null): Promise<TaskChanges> => {
+        const query = since ? `?since=${encodeURIComponent(since)}` : '';
+        const response = await fetch(`${API_BASE}/sync/${encodeURIComponent(email)}/tasks${query}`);
+        if (!response.ok) throw new Error('Failed to fetch task changes');
+        return response.json();
+    },
+
     create: async (
         email: string,
         title: string,
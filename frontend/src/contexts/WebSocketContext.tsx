@@ -1,7 +1,9 @@
-import React, { createContext, useContext, useEffect, useState, useRef } from 'react';
+import React, { createContext, useCallback, useContext, useEffect, useState, useRef } from 'react';
 import { v4 as uuidv4 } from 'uuid';
+import { decode } from '@msgpack/msgpack';
+import { useAuth } from './AuthContext';
 
-interface WebSocketMessage {
+export interface WebSocketMessage {
     type: string;
     [key: string]: any;
 }
@@ -10,12 +12,25 @@ interface WebSocketContextType {
     socketId: string;
     lastMessage: WebSocketMessage | null;
     sendMessage: (message: any) => void;
+    // Called for every message; unlike lastMessage, none are lost to batched renders
+    subscribe: (listener: (message: WebSocketMessage) => void) => () => void;
+    // Sends an RPC over the socket; rejects if it is closed, errors or times out
+    call: (method: string, params: Record<string, any>) => Promise<any>;
     isConnected: boolean;
 }
 
+const RPC_TIMEOUT_MS = 10000;
+
+interface PendingCall {
+    resolve: (result: any) => void;
+    reject: (error: Error) => void;
+    timer: ReturnType<typeof setTimeout>;
+}
+
 const WebSocketContext = createContext<WebSocketContextType | null>(null);
 
 export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({ children }) => {
+    const { email } = useAuth();
     const [socketId] = useState(() => {
         const saved = localStorage.getItem('flowstate_socket_id');
         if (saved) return saved;
@@ -27,12 +42,19 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({ chi
     const [lastMessage, setLastMessage] = useState<WebSocketMessage | null>(null);
     const [isConnected, setIsConnected] = useState(false);
     const socketRef = useRef<WebSocket | null>(null);
+    const listenersRef = useRef(new Set<(message: WebSocketMessage) => void>());
+    const pendingCallsRef = useRef(new Map<string, PendingCall>());
 
     useEffect(() => {
         const baseWsUrl = import.meta.env.VITE_WS_URL || 'ws://localhost:8000/ws';
-        const wsUrl = `${baseWsUrl}/${socketId}`;
+        // The email lets the server push this user's task changes to the socket;
+        // batch=true lets it merge bursts of events into one frame, sent as binary MessagePack
+        const params = new URLSearchParams({ batch: 'true', encoding: 'msgpack' });
+        if (email) params.set('email', email);
+        const wsUrl = `${baseWsUrl}/${socketId}?${params}`;
         console.log('Connecting to WebSocket:', wsUrl);
         const socket = new WebSocket(wsUrl);
+        socket.binaryType = 'arraybuffer';
         socketRef.current = socket;
 
         socket.onopen = () => {
@@ -42,8 +64,23 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({ chi
 
         socket.onmessage = (event) => {
             try {
-                const data = JSON.parse(event.data);
-                setLastMessage(data);
+                const data = (event.data instanceof ArrayBuffer
+                    ? decode(new Uint8Array(event.data))
+                    : JSON.parse(event.data)) as WebSocketMessage;
+                const messages: WebSocketMessage[] = data.type === 'batch' ? data.messages : [data];
+                for (const message of messages) {
+                    if (message.type === 'rpc_ack' || message.type === 'rpc_error') {
+                        const pending = pendingCallsRef.current.get(message.id);
+                        if (!pending) continue;
+                        pendingCallsRef.current.delete(message.id);
+                        clearTimeout(pending.timer);
+                        if (message.type === 'rpc_ack') pending.resolve(message.result);
+                        else pending.reject(new Error(message.error));
+                        continue;
+                    }
+                    setLastMessage(message);
+                    listenersRef.current.forEach((listener) => listener(message));
+                }
             } catch (err) {
                 console.error('Failed to parse WebSocket message:', err);
             }
@@ -62,7 +99,7 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({ chi
         return () => {
             socket.close();
         };
-    }, [socketId]);
+    }, [socketId, email]);
 
     const sendMessage = (message: any) => {
         if (socketRef.current?.readyState === WebSocket.OPEN) {
@@ -70,8 +107,32 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({ chi
         }
     };
 
+    const call = useCallback((method: string, params: Record<string, any>) => {
+        return new Promise<any>((resolve, reject) => {
+            const socket = socketRef.current;
+            if (socket?.readyState !== WebSocket.OPEN) {
+                reject(new Error('WebSocket not connected'));
+                return;
+            }
+            const id = uuidv4();
+            const timer = setTimeout(() => {
+                pendingCallsRef.current.delete(id);
+                reject(new Error(`RPC ${method} timed out`));
+            }, RPC_TIMEOUT_MS);
+            pendingCallsRef.current.set(id, { resolve, reject, timer });
+            socket.send(JSON.stringify({ type: 'rpc', id, method, params }));
+        });
+    }, []);
+
+    const subscribe = useCallback((listener: (message: WebSocketMessage) => void) => {
+        listenersRef.current.add(listener);
+        return () => {
+            listenersRef.current.delete(listener);
+        };
+    }, []);
+
     return (
-        <WebSocketContext.Provider value={{ socketId, lastMessage, sendMessage, isConnected }}>
+        <WebSocketContext.Provider value={{ socketId, lastMessage, sendMessage, subscribe, call, isConnected }}>
             {children}
         </WebSocketContext.Provider>
     );
@@ -1,44 +1,105 @@
-import { useState, useCallback, useEffect } from 'react';
+import { useState, useCallback, useEffect, useRef } from 'react';
 import type { Task } from '../types/calendarTypes';
 import { addMinutes, isSameDay } from 'date-fns';
 import { taskAPI } from '../api/flowstate';
+import { useWebSocket } from '../contexts/WebSocketContext';
+
+// Transform an API task to the frontend Task format
+function toTask(t: any): Task {
+    return {
+        id: t._id || t.id,
+        taskClientId: t.task_client_id, // Preserve for WebSocket matching
+        title: t.title,
+        description: t.description,
+        startTime: t.start_time ? new Date(t.start_time) : new Date(), // Fallback
+        endTime: t.end_time ? new Date(t.end_time) : addMinutes(new Date(), 30),
+        duration: t.duration || 30,
+        color: t.color || '#3b82f6',
+        isCompleted: t.is_completed || false,
+        estimatedTime: t.estimatedTime || 30,
+        recurrence: t.recurrence,
+        tagNames: t.tag_names || [],
+        aiEstimationStatus: t.ai_estimation_status,
+        aiTimeEstimation: t.ai_time_estimation,
+        aiRecommendation: t.ai_recommendation,
+        aiReasoning: t.ai_reasoning,
+        aiConfidence: t.ai_confidence
+    };
+}
+
+// An optimistic task carries its client id as id until the server copy arrives
+function isSameTask(t: Task, taskId?: string, taskClientId?: string) {
+    return t.id === taskId || (!!taskClientId && (t.taskClientId === taskClientId || t.id === taskClientId));
+}
+
+function upsertTask(tasks: Task[], incoming: Task): Task[] {
+    const index = tasks.findIndex((t) => isSameTask(t, incoming.id, incoming.taskClientId));
+    if (index === -1) return [...tasks, incoming];
+    const next = [...tasks];
+    next[index] = incoming;
+    return next;
+}
 
 export function useCalendarState(userEmail: string | null) {
     const [tasks, setTasks] = useState<Task[]>([]);
+    const { subscribe, call, isConnected } = useWebSocket();
+    const syncTokenRef = useRef<string | null>(null);
 
-    const fetchTasks = useCallback(async () => {
+    // Loads the task list, or only what changed since the last sync token
+    const syncTasks = useCallback(async () => {
         if (!userEmail) return;
         try {
-            const fetchedTasks = await taskAPI.getAllForUser(userEmail);
-            // Transform API tasks to frontend Task format
-            const formattedTasks: Task[] = fetchedTasks.map((t: any) => ({
-                id: t._id || t.id,
-                taskClientId: t.task_client_id, // Preserve for WebSocket matching
-                title: t.title,
-                description: t.description,
-                startTime: t.start_time ? new Date(t.start_time) : new Date(), // Fallback
-                endTime: t.end_time ? new Date(t.end_time) : addMinutes(new Date(), 30),
-                duration: t.duration || 30,
-                color: t.color || '#3b82f6',
-                isCompleted: t.is_completed || false,
-                estimatedTime: t.estimatedTime || 30,
-                recurrence: t.recurrence,
-                tagNames: t.tag_names || [],
-                aiEstimationStatus: t.ai_estimation_status,
-                aiTimeEstimation: t.ai_time_estimation,
-                aiRecommendation: t.ai_recommendation,
-                aiReasoning: t.ai_reasoning,
-                aiConfidence: t.ai_confidence
-            }));
-            setTasks(formattedTasks);
+            const changes = await taskAPI.getChanges(userEmail, syncTokenRef.current);
+            syncTokenRef.current = changes.sync_token;
+            if (changes.full_resync) {
+                setTasks(changes.tasks.map(toTask));
+                return;
+            }
+            setTasks((prev) => {
+                let next = prev.filter((t) => !changes.deleted.some(
+                    (d) => isSameTask(t, d.task_id, d.task_client_id)
+                ));
+                for (const t of changes.tasks) next = upsertTask(next, toTask(t));
+                return next;
+            });
         } catch (error) {
             console.error("Failed to fetch tasks:", error);
         }
     }, [userEmail]);
 
     useEffect(() => {
-        fetchTasks();
-    }, [fetchTasks]);
+        syncTokenRef.current = null;
+        syncTasks();
+    }, [syncTasks]);
+
+    // Catch up on anything missed while the socket was down
+    useEffect(() => {
+        if (isConnected && syncTokenRef.current) syncTasks();
+    }, [isConnected, syncTasks]);
+
+    // Task changes from this and other tabs/devices arrive over the WebSocket
+    useEffect(() => {
+        return subscribe((message) => {
+            // Estimates arrive as a provisional result, then possibly a refined final one
+            if (message.type === 'agent_result') {
+                setTasks((prev) => prev.map((t) => (isSameTask(t, undefined, message.task_client_id) ? {
+                    ...t,
+                    aiEstimationStatus: 'success',
+                    aiTimeEstimation: message.duration,
+                    aiRecommendation: message.recommendation,
+                    aiReasoning: message.reasoning,
+                    aiConfidence: message.confidence
+                } : t)));
+                return;
+            }
+            if (message.type !== 'task_event') return;
+            if (message.op === 'deleted') {
+                setTasks((prev) => prev.filter((t) => !isSameTask(t, message.task_id, message.task_client_id)));
+            } else if (message.task) {
+                setTasks((prev) => upsertTask(prev, toTask(message.task)));
+            }
+        });
+    }, [subscribe]);
 
     const addTask = useCallback(async (task: Task, socketId?: string) => {
         if (!userEmail) return;
@@ -59,15 +120,29 @@ export function useCalendarState(userEmail: string | null) {
                 task.aiEstimationStatus,
                 task.duration
             );
-            // Refresh to get ID (though WebSocket might beat it)
-            fetchTasks();
+            // The server copy (with its _id) replaces the optimistic task via a task_event
         } catch (e) {
             console.error("Failed to add task", e);
         }
-    }, [fetchTasks, userEmail]);
+    }, [userEmail]);
+
+    // Interactive edits go over the socket; HTTP is the fallback when it is down
+    const sendEdit = useCallback((method: string, params: Record<string, any>, httpUpdates: any) => {
+        return call(method, params).catch((e: Error) => {
+            if (e.message !== 'WebSocket not connected') throw e;
+            return taskAPI.update(params.task_id, httpUpdates);
+        });
+    }, [call]);
 
     const updateTask = useCallback(async (id: string, updates: Partial<Task>) => {
         setTasks((prev) => prev.map((t) => (t.id === id ? { ...t, ...updates } : t)));
+        const keys = Object.keys(updates);
+        if (keys.length === 1 && keys[0] === 'isCompleted') {
+            const isCompleted = !!updates.isCompleted;
+            await sendEdit('toggle_completion', { task_id: id, is_completed: isCompleted }, { is_completed: isCompleted })
+                .catch((e) => console.error("Failed to update task", e));
+            return;
+        }
         try {
             const backendUpdates: any = { ...updates };
             // Map frontend keys to backend keys
@@ -86,7 +161,7 @@ export function useCalendarState(userEmail: string | null) {
         } catch (e) {
             console.error("Failed to update task", e);
         }
-    }, []);
+    }, [sendEdit]);
 
     const moveTask = useCallback((id: string, newStartTime: Date, newTag?: string) => {
         setTasks((prev) => prev.map((t) => {
@@ -104,18 +179,19 @@ export function useCalendarState(userEmail: string | null) {
             };
 
             // We call the API asynchronously but update state immediately
-            taskAPI.update(id, {
+            const params = {
                 start_time: newStartTime.toISOString(),
                 // end_time: endTime.toISOString(), // Removed
                 tag_names: newTagNames
-            }).catch(console.error);
+            };
+            sendEdit('move_task', { task_id: id, ...params }, params).catch(console.error);
 
             return {
                 ...t,
                 ...updates
             };
         }));
-    }, []);
+    }, [sendEdit]);
 
     const resizeTask = useCallback((id: string, newDuration: number) => {
         setTasks((prev) => prev.map((t) => {
@@ -124,9 +200,8 @@ export function useCalendarState(userEmail: string | null) {
             const endTime = addMinutes(t.startTime, newDuration);
 
             // Trigger API update
-            taskAPI.update(id, {
-                duration: newDuration
-            }).catch(console.error);
+            sendEdit('update_duration', { task_id: id, duration: newDuration }, { duration: newDuration })
+                .catch(console.error);
 
             return {
                 ...t,
@@ -135,7 +210,7 @@ export function useCalendarState(userEmail: string | null) {
                 estimatedTime: newDuration,
             };
         }));
-    }, []);
+    }, [sendEdit]);
 
     const deleteTask = useCallback(async (id: string) => {
         setTasks((prev) => prev.filter((t) => t.id !== id));
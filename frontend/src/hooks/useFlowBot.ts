@@ -6,11 +6,13 @@ import { useAuth } from '../contexts/AuthContext';
 export interface ChatMessage {
     role: 'user' | 'bot';
     content: string;
+    // True while the reply is still streaming in as flowbot_delta messages
+    streaming?: boolean;
 }
 
 export function useFlowBot() {
     const { email } = useAuth();
-    const { socketId, lastMessage, isConnected } = useWebSocket();
+    const { socketId, subscribe, isConnected } = useWebSocket();
     const [messages, setMessages] = useState<ChatMessage[]>([
         { role: 'bot', content: "Hello! I can help you organize your schedule or read web pages for you. How can I help you flow today?" }
     ]);
@@ -18,21 +20,39 @@ export function useFlowBot() {
 
     // Initial greeting or persistence could go here
 
+    // subscribe sees every message, so no streamed delta is lost to batched renders
     useEffect(() => {
-        if (!lastMessage) return;
-
-        if (lastMessage.type === 'flowbot_status') {
-            if (lastMessage.status === 'thinking') {
-                setIsTyping(true);
+        return subscribe((message) => {
+            if (message.type === 'flowbot_status') {
+                if (message.status === 'thinking') {
+                    setIsTyping(true);
+                }
+            } else if (message.type === 'flowbot_delta') {
+                setIsTyping(false);
+                setMessages(prev => {
+                    const last = prev[prev.length - 1];
+                    if (last?.streaming) {
+                        return [...prev.slice(0, -1), { ...last, content: last.content + message.delta }];
+                    }
+                    return [...prev, { role: 'bot', content: message.delta, streaming: true }];
+                });
+            } else if (message.type === 'flowbot_result') {
+                setIsTyping(false);
+                // The complete reply replaces the streamed text
+                setMessages(prev => {
+                    const last = prev[prev.length - 1];
+                    const rest = last?.streaming ? prev.slice(0, -1) : prev;
+                    return [...rest, { role: 'bot', content: message.response }];
+                });
+            } else if (message.type === 'flowbot_error') {
+                setIsTyping(false);
+                setMessages(prev => [
+                    ...prev.map(m => (m.streaming ? { ...m, streaming: false } : m)),
+                    { role: 'bot', content: `Error: ${message.error}` }
+                ]);
             }
-        } else if (lastMessage.type === 'flowbot_result') {
-            setIsTyping(false);
-            setMessages(prev => [...prev, { role: 'bot', content: lastMessage.response }]);
-        } else if (lastMessage.type === 'flowbot_error') {
-            setIsTyping(false);
-            setMessages(prev => [...prev, { role: 'bot', content: `Error: ${lastMessage.error}` }]);
-        }
-    }, [lastMessage]);
+        });
+    }, [subscribe]);
 
     const sendMessage = useCallback(async (text: string) => {
         if (!text.trim() || !email) return;
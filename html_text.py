@@ -0,0 +1,92 @@
+"""
+HTML Text Extraction
+
+Turns a downloaded page into the visible text the search agent puts in its prompt:
+scripts and styles are dropped and the text is split into one phrase per line.
+
+Backends, fastest first: selectolax and lxml (parsing in C; both are in
+requirements.txt, but a missing one is skipped) and BeautifulSoup's html.parser,
+which is always available. SCRAPE_HTML_BACKEND picks one; by default the fastest
+installed backend is used. Parsing runs on a small worker pool so large pages
+don't stall the event loop.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from bs4 import BeautifulSoup
+from dotenv import load_dotenv
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # optional: lxml or html.parser is used instead
+    LexborHTMLParser = None
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:  # optional: html.parser is used instead
+    lxml = None
+
+load_dotenv()
+
+SCRAPE_PARSE_WORKERS = int(os.getenv("SCRAPE_PARSE_WORKERS", "2"))
+
+_pool = ThreadPoolExecutor(max_workers=SCRAPE_PARSE_WORKERS, thread_name_prefix="html")
+
+
+def _selectolax_text(content: bytes) -> str:
+    tree = LexborHTMLParser(content)
+    tree.strip_tags(["script", "style"])
+    return tree.root.text(separator="") if tree.root is not None else ""
+
+
+def _lxml_text(content: bytes) -> str:
+    try:
+        tree = lxml.html.fromstring(content)
+    except etree.ParserError:  # Empty document
+        return ""
+    etree.strip_elements(tree, "script", "style", with_tail=False)
+    return tree.text_content()
+
+
+def _html_parser_text(content: bytes) -> str:
+    soup = BeautifulSoup(content, 'html.parser')
+
+    # Remove script and style elements
+    for script in soup(["script", "style"]):
+        script.extract()
+
+    return soup.get_text()
+
+
+BACKENDS: Dict[str, Callable[[bytes], str]] = {}
+if LexborHTMLParser is not None:
+    BACKENDS["selectolax"] = _selectolax_text
+if lxml is not None:
+    BACKENDS["lxml"] = _lxml_text
+BACKENDS["html.parser"] = _html_parser_text
+
+SCRAPE_HTML_BACKEND = os.getenv("SCRAPE_HTML_BACKEND", next(iter(BACKENDS)))
+if SCRAPE_HTML_BACKEND not in BACKENDS:
+    print(f"Warning: HTML backend {SCRAPE_HTML_BACKEND} is not installed, using html.parser")
+    SCRAPE_HTML_BACKEND = "html.parser"
+
+
+def extract_text(content: bytes, backend: Optional[str] = None) -> str:
+    """Visible text of an HTML page, one phrase per line."""
+    text = BACKENDS[backend or SCRAPE_HTML_BACKEND](content)
+
+    # Break into lines and remove leading/trailing space on each
+    lines = (line.strip() for line in text.splitlines())
+    # Break multi-headlines into a line each
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    # Drop blank lines
+    return '\n'.join(chunk for chunk in chunks if chunk)
+
+
+async def extract_text_async(content: bytes) -> str:
+    """extract_text on the parse pool."""
+    return await asyncio.get_running_loop().run_in_executor(_pool, extract_text, content)
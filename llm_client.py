@@ -0,0 +1,407 @@
+"""
+LLM Client
+
+Every call to the Gemini chat and embedding models goes through here, behind one
+circuit breaker per provider. While a provider is down its calls raise
+CircuitOpenError immediately, and callers switch to their degraded path:
+- task writes store embedding_status "pending" and are embedded later
+- estimations fall back to a heuristic based on the user's history
+
+Calls made with a deadline (see deadlines.Deadline) run on a worker pool and are
+abandoned when the deadline passes or the job is cancelled, since the provider
+SDKs are blocking and cannot be interrupted.
+
+With LLM_HEDGING=true, a chat call still running after the rolling p95 latency
+gets a duplicate request; whichever succeeds first is used. Hedges are capped at
+LLM_HEDGE_BUDGET_PER_MINUTE. The losing request cannot be interrupted, so it runs
+to completion on its worker and its result is dropped: every hedge costs a pool
+worker and provider quota until both requests finish. At most
+LLM_HEDGE_MAX_IN_FLIGHT hedges run at once, which bounds the workers they take.
+
+Streamed calls are hedged on time to first chunk instead, against their own rolling
+percentile: a stream with no chunk after it gets a backup stream, and whichever
+yields first is kept. The other stream is closed as soon as the race is decided,
+so a streaming hedge costs little more than the provider's time to first token.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional
+
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, message_chunk_to_message
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+load_dotenv()
+
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "16"))
+LLM_HEDGING = os.getenv("LLM_HEDGING", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# Latencies needed before the percentile is trusted enough to hedge on
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_BUDGET_PER_MINUTE = int(os.getenv("LLM_HEDGE_BUDGET_PER_MINUTE", "10"))
+# Hedge requests still running (won or lost) before no more are sent
+LLM_HEDGE_MAX_IN_FLIGHT = int(os.getenv("LLM_HEDGE_MAX_IN_FLIGHT", "4"))
+
+# How often a call waiting on the provider checks for cancellation
+_CANCEL_POLL_SECONDS = 0.05
+
+chat_breaker = CircuitBreaker("Gemini chat")
+embedding_breaker = CircuitBreaker("Gemini embeddings")
+
+_pool = ThreadPoolExecutor(max_workers=LLM_POOL_SIZE, thread_name_prefix="llm")
+
+
+class HedgePolicy:
+    """Rolling latency percentile and per-minute budget that decide when to hedge."""
+
+    def __init__(
+        self,
+        enabled: bool = LLM_HEDGING,
+        percentile: float = LLM_HEDGE_PERCENTILE,
+        min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+        budget_per_minute: int = LLM_HEDGE_BUDGET_PER_MINUTE,
+        max_in_flight: int = LLM_HEDGE_MAX_IN_FLIGHT,
+        window: int = 200
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget_per_minute = budget_per_minute
+        self.max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._spent: Deque[float] = deque()
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_exhausted = 0
+        self.in_flight = 0
+        self.in_flight_limited = 0
+
+    def count_call(self) -> None:
+        with self._lock:
+            self.calls += 1
+
+    def count_win(self) -> None:
+        with self._lock:
+            self.hedge_wins += 1
+
+    def record(self, seconds: float) -> None:
+        """Adds the latency of a successful request."""
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None when hedging is off or still warming up."""
+        with self._lock:
+            if not self.enabled or len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[index]
+
+    def try_spend(self) -> bool:
+        """
+        Takes one hedge from this minute's budget and the in-flight limit.
+        Call hedge_done() once the hedge request has finished.
+        """
+        with self._lock:
+            if self.in_flight >= self.max_in_flight:
+                self.in_flight_limited += 1
+                return False
+            now = time.monotonic()
+            while self._spent and now - self._spent[0] > 60:
+                self._spent.popleft()
+            if len(self._spent) >= self.budget_per_minute:
+                self.budget_exhausted += 1
+                return False
+            self._spent.append(now)
+            self.hedges += 1
+            self.in_flight += 1
+            return True
+
+    def hedge_done(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def metrics(self) -> Dict[str, Any]:
+        threshold = self.delay()
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": round(threshold * 1000, 1) if threshold is not None else None,
+            "samples": len(self._latencies),
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "budget_exhausted": self.budget_exhausted,
+            "in_flight": self.in_flight,
+            "in_flight_limited": self.in_flight_limited,
+            "hedge_rate": round(self.hedges / self.calls, 3) if self.calls else 0.0,
+            "win_rate": round(self.hedge_wins / self.hedges, 3) if self.hedges else 0.0
+        }
+
+
+chat_hedging = HedgePolicy()
+# Streams hedge on time to first chunk, which is much shorter than a whole response
+stream_hedging = HedgePolicy()
+
+
+class StreamRace:
+    """Decides which of a stream and its hedge produced a chunk first."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._winner: Optional[object] = None
+
+    @property
+    def decided(self) -> bool:
+        return self._winner is not None
+
+    def claim(self, stream: object) -> bool:
+        """True if stream is first to claim (or already won) the race."""
+        with self._lock:
+            if self._winner is None:
+                self._winner = stream
+            return self._winner is stream
+
+
+# Returned by a hedged stream that lost the race; the winner's result is used
+_LOST = object()
+
+
+def _attempt(breaker: CircuitBreaker, hedging: Optional[HedgePolicy], fn: Callable[..., Any], *args: Any) -> Any:
+    started = time.monotonic()
+    result = breaker.call(fn, *args)
+    if hedging is not None:
+        hedging.record(time.monotonic() - started)
+    return result
+
+
+def _call(
+    breaker: CircuitBreaker,
+    stage: str,
+    deadline: Optional[Any],
+    fn: Callable[..., Any],
+    *args: Any,
+    hedging: Optional[HedgePolicy] = None,
+    race: Optional[StreamRace] = None
+) -> Any:
+    """
+    Runs fn through the breaker. With a deadline, waits at most until it passes,
+    raising the deadline's DeadlineExceeded / JobCancelled for stage.
+    With a hedging policy, a duplicate request is sent once the first has run
+    longer than the policy's delay, and the first success is returned.
+    With a race, fn is a stream that claims it on its first chunk and returns
+    _LOST if the other stream got there first; fn records its own latency and
+    no hedge is sent once the race is decided.
+    """
+    hedge_delay = None
+    if hedging is not None:
+        hedging.count_call()
+        hedge_delay = hedging.delay()
+    # Streams record time to first chunk themselves
+    recording = hedging if race is None else None
+    if deadline is None and hedge_delay is None:
+        return _attempt(breaker, recording, fn, *args)
+    if deadline is not None:
+        deadline.check(stage)
+
+    primary = _pool.submit(_attempt, breaker, recording, fn, *args)
+    pending: List[Future] = [primary]
+    hedge_at = time.monotonic() + hedge_delay if hedge_delay is not None else None
+    first_error: Optional[BaseException] = None
+    while True:
+        timeouts = []
+        if deadline is not None:
+            timeouts.append(min(deadline.remaining(), _CANCEL_POLL_SECONDS))
+        if hedge_at is not None:
+            timeouts.append(max(0.0, hedge_at - time.monotonic()))
+        done, _ = wait(pending, timeout=min(timeouts) if timeouts else None, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            pending.remove(future)
+            if future.exception() is None:
+                if future.result() is _LOST:
+                    continue
+                if future is not primary:
+                    hedging.count_win()
+                for other in pending:
+                    # Only stops a request that has not started; a running one is abandoned
+                    other.cancel()
+                return future.result()
+            first_error = first_error or future.exception()
+        if not pending:
+            raise first_error
+        if first_error is not None:
+            # A failed request is not retried by hedging
+            hedge_at = None
+
+        if hedge_at is not None and time.monotonic() >= hedge_at:
+            hedge_at = None
+            if (race is None or not race.decided) and hedging.try_spend():
+                hedge = _pool.submit(_attempt, breaker, recording, fn, *args)
+                # Counts as in flight until it finishes, even after it has lost
+                hedge.add_done_callback(lambda _: hedging.hedge_done())
+                pending.append(hedge)
+        if deadline is not None:
+            # Requests still running keep their workers; outcomes still count for the breaker
+            deadline.check(stage)
+
+
+def invoke_chat(llm: Any, messages: List[Any], deadline: Optional[Any] = None, stage: str = "llm") -> Any:
+    """Runs llm.invoke(messages) through the chat circuit breaker, hedged when enabled."""
+    return _call(chat_breaker, stage, deadline, llm.invoke, messages, hedging=chat_hedging)
+
+
+async def _first_chunk(llm: Any, messages: List[Any]) -> Any:
+    """
+    Starts llm.astream(messages), plus a backup stream when it has no chunk after
+    stream_hedging's delay. Returns (stream, first chunk or None if it was empty)
+    for whichever stream got there first, and closes the other.
+    """
+    stream_hedging.count_call()
+    hedge_delay = stream_hedging.delay()
+    started = time.monotonic()
+    primary = llm.astream(messages)
+    pending: Dict[asyncio.Future, Any] = {asyncio.ensure_future(primary.__anext__()): primary}
+    hedged = False
+    first_error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedge_delay = None
+                if stream_hedging.try_spend():
+                    hedged = True
+                    hedge = llm.astream(messages)
+                    pending[asyncio.ensure_future(hedge.__anext__())] = hedge
+                continue
+            for future in done:
+                stream = pending.pop(future)
+                try:
+                    chunk = future.result()
+                except StopAsyncIteration:
+                    chunk = None
+                except Exception as e:
+                    # A failed stream is not retried by hedging
+                    first_error = first_error or e
+                    hedge_delay = None
+                    continue
+                stream_hedging.record(time.monotonic() - started)
+                if stream is not primary:
+                    stream_hedging.count_win()
+                return stream, chunk
+        raise first_error
+    finally:
+        for future, stream in pending.items():
+            future.cancel()
+            await asyncio.gather(future, return_exceptions=True)
+            await stream.aclose()
+        if hedged:
+            # The losing stream is closed above, so the hedge ends with the race
+            stream_hedging.hedge_done()
+
+
+async def astream_chat(llm: Any, messages: List[Any]) -> AsyncIterator[Any]:
+    """
+    Streams llm.astream(messages) through the chat circuit breaker, yielding chunks
+    as they arrive. The first chunk is hedged (see _first_chunk); wrap the
+    consumer in asyncio.wait_for to bound it.
+    """
+    with chat_breaker.guard():
+        stream, first = await _first_chunk(llm, messages)
+        if first is None:
+            return
+        yield first
+        async for chunk in stream:
+            yield chunk
+
+
+def _stream_into(
+    llm: Any,
+    messages: List[Any],
+    on_delta: Callable[[str], None],
+    deadline: Optional[Any],
+    race: StreamRace
+) -> Any:
+    """
+    Consumes llm.stream(messages), passing each chunk's text to on_delta; returns the
+    whole message. Returns _LOST, closing the stream, if another stream in the race
+    produced a chunk first.
+    """
+    started = time.monotonic()
+    stream = llm.stream(messages)
+    message = None
+    try:
+        for chunk in stream:
+            if message is None:
+                if not race.claim(stream):
+                    return _LOST
+                stream_hedging.record(time.monotonic() - started)
+            message = chunk if message is None else message + chunk
+            if deadline is not None and (deadline.cancelled or deadline.remaining() <= 0):
+                # The caller has given up on this call; stop forwarding text nobody will use
+                break
+            text = chunk_text(chunk)
+            if text:
+                on_delta(text)
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    if message is None and not race.claim(stream):
+        return _LOST
+    return message_chunk_to_message(message) if message is not None else AIMessage(content="")
+
+
+def stream_chat(
+    llm: Any,
+    messages: List[Any],
+    on_delta: Callable[[str], None],
+    deadline: Optional[Any] = None,
+    stage: str = "llm"
+) -> Any:
+    """
+    Like invoke_chat, but streams the response, calling on_delta with the text of
+    each chunk as it arrives (on a worker thread when a deadline is given or the
+    stream may be hedged). Returns the complete message. A stream with no chunk
+    after stream_hedging's delay gets a backup; only the first to yield is forwarded.
+    """
+    race = StreamRace()
+    return _call(
+        chat_breaker, stage, deadline, _stream_into, llm, messages, on_delta, deadline, race,
+        hedging=stream_hedging, race=race
+    )
+
+
+def chunk_text(chunk: Any) -> str:
+    """Text of a streamed chunk; Gemini may return content as a list of parts."""
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+
+def embed_query(model: Any, text: str, deadline: Optional[Any] = None, stage: str = "embedding") -> List[float]:
+    """Embeds one text through the embedding circuit breaker."""
+    return _call(embedding_breaker, stage, deadline, model.embed_query, text)
+
+
+def embed_documents(model: Any, texts: List[str], **kwargs: Any) -> List[List[float]]:
+    """Embeds many texts in one provider call through the embedding circuit breaker."""
+    return embedding_breaker.call(model.embed_documents, texts, **kwargs)
+
+
+def metrics() -> Dict[str, Any]:
+    return {
+        "chat": chat_breaker.metrics(),
+        "embeddings": embedding_breaker.metrics(),
+        "chat_hedging": chat_hedging.metrics(),
+        "stream_hedging": stream_hedging.metrics()
+    }
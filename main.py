@@ -3,8 +3,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
-from datetime import datetime
+from datetime import datetime, timezone
 from pymongo import MongoClient
+from bson.errors import InvalidId
 from dotenv import load_dotenv
 import os
 import json
@@ -12,6 +13,10 @@ import asyncio
 
 # Import all db functions
 import db
+import llm_client
+import web_fetcher
+from deadlines import estimation_jobs
+from time_estimation_agent import tier_metrics
 
 # Load environment variables
 load_dotenv()
@@ -23,6 +28,12 @@ ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:5173,http://loc
 # Global MongoDB client
 mongo_client: Optional[MongoClient] = None
 
+# Upper bound on tasks accepted by one bulk request
+MAX_BULK_TASKS = int(os.getenv("MAX_BULK_TASKS", "200"))
+
+# How often tasks written while the embedding provider was down are re-embedded
+EMBEDDING_BACKFILL_SECONDS = float(os.getenv("EMBEDDING_BACKFILL_SECONDS", "60"))
+
 
 # ============================================================================
 # PYDANTIC MODELS
@@ -68,6 +79,12 @@ class TaskCreate(BaseModel):
     socket_id: Optional[str] = None
 
 
+class TaskBulkCreate(BaseModel):
+    tasks: List[TaskCreate]
+    socket_id: Optional[str] = None
+    estimate: bool = False
+
+
 class TaskUpdate(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
@@ -113,10 +130,36 @@ class AgentRetrieveRequest(BaseModel):
     user_id: str
 
 
+class BatchEstimateTask(BaseModel):
+    task_client_id: str
+    title: str
+    description: Optional[str] = None
+    tag_names: Optional[List[str]] = None
+    duration: Optional[int] = 30
+
+
+class BatchEstimateRequest(BaseModel):
+    email: str
+    socket_id: str
+    tasks: List[BatchEstimateTask]
+
+
 # ============================================================================
 # LIFECYCLE MANAGEMENT
 # ============================================================================
 
+async def backfill_embeddings_loop(client: MongoClient):
+    """Periodically embeds tasks left with embedding_status "pending"."""
+    while True:
+        await asyncio.sleep(EMBEDDING_BACKFILL_SECONDS)
+        try:
+            embedded = await asyncio.to_thread(db.backfill_pending_embeddings, client)
+            if embedded:
+                print(f"✓ Backfilled embeddings for {embedded} tasks")
+        except Exception as e:
+            print(f"Warning: Embedding backfill failed: {e}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage MongoDB connection lifecycle"""
@@ -128,12 +171,33 @@ async def lifespan(app: FastAPI):
     try:
         mongo_client.admin.command('ping')
         print("✓ MongoDB connected successfully")
+        db.ensure_indexes(mongo_client)
     except Exception as e:
         print(f"✗ MongoDB connection failed: {e}")
+    else:
+        # Embed the default tag templates off the startup path; sign-ups before
+        # this finishes get tags without embeddings, which it then backfills
+        asyncio.get_running_loop().run_in_executor(None, db.ensure_tag_templates, mongo_client)
+
+    # Fan WebSocket messages out across API workers
+    await manager.start(create_pubsub_backend(mongo_client))
+    # Push task changes to the owning user's other tabs and devices
+    task_events.start(mongo_client, asyncio.get_running_loop())
+    # Merge bursts of task field updates when TASK_WRITE_BEHIND_MS is set
+    task_writes.start(mongo_client, asyncio.get_running_loop())
+    # Cancel running estimations of tasks as they are deleted or edited
+    estimation_jobs.start(task_events)
+    backfill_task = asyncio.create_task(backfill_embeddings_loop(mongo_client))
     
     yield
     
     # Shutdown
+    backfill_task.cancel()
+    estimation_jobs.stop(task_events)
+    await task_writes.stop()
+    task_events.stop()
+    await manager.stop()
+    await web_fetcher.close()
     if mongo_client:
         mongo_client.close()
         print("✓ MongoDB connection closed")
@@ -167,18 +231,37 @@ app.add_middleware(
 # ============================================================================
 
 from websocket_manager import manager
+from ws_pubsub import create_pubsub_backend
+from task_events import TaskEventPublisher
+from ws_rpc import handle_rpc
+from write_behind import task_writes
 
 
 @app.websocket("/ws/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    await manager.connect(websocket, client_id)
+async def websocket_endpoint(
+    websocket: WebSocket,
+    client_id: str,
+    email: Optional[str] = None,
+    encoding: str = "json",
+    batch: bool = False
+):
+    # Connections that pass ?email= also receive task_event pushes for that user.
+    # ?encoding=msgpack selects binary MessagePack frames, ?batch=true merges
+    # bursts of events into one frame.
+    await manager.connect(websocket, client_id, email, encoding, batch)
     try:
         while True:
-            # Keep connection alive
             data = await websocket.receive_text()
-            # Handle incoming client messages if needed
+            try:
+                request = json.loads(data)
+            except ValueError:
+                continue
+            # Task edits sent as RPCs; replies go through the socket's send queue
+            if isinstance(request, dict) and request.get("type") == "rpc":
+                reply = await handle_rpc(get_client(), email, request)
+                await manager.send_personal_message(reply, client_id)
     except WebSocketDisconnect:
-        manager.disconnect(client_id)
+        manager.disconnect(client_id, websocket)
 
 
 # ============================================================================
@@ -195,6 +278,22 @@ def get_client() -> MongoClient:
     return mongo_client
 
 
+def parse_start_time(start_time: Optional[str]) -> Optional[datetime]:
+    """
+    Parses a client start_time ISO string (with potential Z suffix) to a datetime.
+    Returns None if missing or unparseable.
+    """
+    if not start_time:
+        return None
+    try:
+        clean_time = start_time.replace('Z', '+00:00')
+        return datetime.fromisoformat(clean_time)
+    except Exception as e:
+        print(f"Error parsing start_time: {e}")
+        # If user sent bad time, None is better than guessing
+        return None
+
+
 def serialize_task(task: Dict[str, Any]) -> Dict[str, Any]:
     """
     Serialize task dictionary for JSON response.
@@ -215,10 +314,37 @@ def serialize_task(task: Dict[str, Any]) -> Dict[str, Any]:
         # .isoformat() might return '2023-01-01T12:00:00' (no Z)
         # We want '2023-01-01T12:00:00Z'
         task["start_time"] = dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    # Sync bookkeeping timestamps keep millisecond precision
+    for field in ("created_at", "updated_at"):
+        if isinstance(task.get(field), datetime):
+            task[field] = format_sync_timestamp(task[field])
         
     return task
 
 
+def parse_sync_token(token: str) -> Optional[datetime]:
+    """
+    Parses a sync token (ISO string, 'Z' or offset suffix) into naive UTC,
+    the form timestamps are stored in. Returns None if it is not a valid token.
+    """
+    try:
+        parsed = datetime.fromisoformat(token.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def format_sync_timestamp(dt: datetime) -> str:
+    """Formats a naive UTC datetime as an ISO string with milliseconds and 'Z'."""
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.') + f"{dt.microsecond // 1000:03d}Z"
+
+
+task_events = TaskEventPublisher(manager, serialize_task)
+
+
 # ============================================================================
 # ROOT ENDPOINT
 # ============================================================================
@@ -284,16 +410,9 @@ async def create_user(user: UserCreate):
     if not result:
         raise HTTPException(status_code=500, detail="Failed to create user")
     
-    # If this is a new user, create default tags
+    # If this is a new user, create default tags from the precomputed templates
     if is_new_user:
-        default_tags = [
-            ("work", "Work related tasks and projects"),
-            ("school", "School assignments and academic activities"),
-            ("hobbies", "Personal hobbies and leisure activities")
-        ]
-        
-        for tag_name, tag_description in default_tags:
-            db.set_tag(client, user.email, tag_name, tag_description)
+        db.create_default_tags(client, user.email)
     
     return {"message": "User created successfully", "email": user.email}
 
@@ -412,10 +531,36 @@ async def get_all_tasks():
 async def get_all_tasks_for_user(email: str):
     """Get all tasks for a specific user"""
     client = get_client()
-    tasks = db.get_all_tasks_for_user(client, email)
+    tasks = task_writes.overlay(db.get_all_tasks_for_user(client, email))
     return [serialize_task(task) for task in tasks]
 
 
+@app.get("/api/sync/{email}/tasks")
+async def get_task_changes(email: str, since: Optional[str] = None):
+    """
+    Get tasks changed or deleted since a sync token.
+    Lives outside /api/tasks/{email}/... so that it can't shadow a task's title.
+    Pass the sync_token from the previous response as `since`; omit it for the initial sync.
+    When full_resync is true, `tasks` is the complete list and replaces the client's copy.
+    """
+    client = get_client()
+    since_dt = None
+    if since:
+        since_dt = parse_sync_token(since)
+        if since_dt is None:
+            raise HTTPException(status_code=400, detail="Invalid sync token")
+
+    changes = db.get_task_changes(client, email, since_dt)
+    for tombstone in changes["deleted"]:
+        tombstone["deleted_at"] = format_sync_timestamp(tombstone["deleted_at"])
+    return {
+        "tasks": [serialize_task(task) for task in task_writes.overlay(changes["tasks"])],
+        "deleted": changes["deleted"],
+        "sync_token": format_sync_timestamp(changes["sync_token"]),
+        "full_resync": changes["full_resync"]
+    }
+
+
 @app.get("/api/tasks/{email}/{title}")
 async def get_task(email: str, title: str):
     """Get a specific task by Title (Legacy)"""
@@ -423,7 +568,7 @@ async def get_task(email: str, title: str):
     task = db.get_task_by_title(client, email, title)
     if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
-    return serialize_task(task)
+    return serialize_task(task_writes.overlay([task])[0])
 
 
 @app.get("/api/tasks/by-id/{task_id}")
@@ -434,7 +579,7 @@ async def get_task_by_id(task_id: str):
         task = db.get_task_by_id(client, task_id)
         if task is None:
             raise HTTPException(status_code=404, detail="Task not found")
-        return serialize_task(task)
+        return serialize_task(task_writes.overlay([task])[0])
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid task ID: {str(e)}")
 
@@ -467,7 +612,7 @@ async def get_task_tags(email: str, title: str):
 async def get_tasks_by_tag(email: str, tag_name: str):
     """Get all tasks for a user with a specific tag"""
     client = get_client()
-    tasks = db.get_tasks_by_tag(client, email, tag_name)
+    tasks = task_writes.overlay(db.get_tasks_by_tag(client, email, tag_name))
     return [serialize_task(task) for task in tasks]
 
 
@@ -483,20 +628,9 @@ async def create_task(task: TaskCreate, background_tasks: BackgroundTasks):
     #     task.duration = int(delta.total_seconds() / 60) # minutes
 
     # Parse start_time string to datetime if provided
-    start_time_dt = None
-    if task.start_time:
-        try:
-            # Handle ISO string with potential Z suffix
-            clean_time = task.start_time.replace('Z', '+00:00')
-            start_time_dt = datetime.fromisoformat(clean_time)
-        except Exception as e:
-            print(f"Error parsing start_time: {e}")
-            # Fallback to current time or keep as None? 
-            # If user sent bad time, maybe None is better or error.
-            # For now, let's allow it to fail to None if critical
-            pass
+    start_time_dt = parse_start_time(task.start_time)
 
-    success = db.set_task(
+    status = db.set_task(
         client, 
         task.email, 
         task.title, 
@@ -514,11 +648,12 @@ async def create_task(task: TaskCreate, background_tasks: BackgroundTasks):
         ai_reasoning=task.ai_reasoning,
         ai_confidence=task.ai_confidence
     )
-    if not success:
+    if not status:
         raise HTTPException(status_code=500, detail="Failed to create task")
     
-    # Run AI estimation in background if socket_id is provided
-    if task.socket_id:
+    # Run AI estimation in background if socket_id is provided.
+    # A retry of an identical create ("unchanged") was already estimated.
+    if task.socket_id and status != "unchanged":
         from agent_utils import run_agent_background
         background_tasks.add_task(
             run_agent_background, 
@@ -531,7 +666,63 @@ async def create_task(task: TaskCreate, background_tasks: BackgroundTasks):
             task.duration or 30
         )
     
-    return {"message": "Task created successfully", "title": task.title}
+    return {"message": "Task created successfully", "title": task.title, "status": status}
+
+
+@app.post("/api/tasks/bulk")
+async def create_tasks_bulk(request: TaskBulkCreate, background_tasks: BackgroundTasks):
+    """
+    Create or update many tasks in one request.
+    Embeddings are generated in batched provider calls and all writes go out in a
+    single unordered bulk_write. Returns a per-item result for every submitted task.
+    If estimate is true and socket_id is provided, one batched AI estimation runs in
+    the background for the tasks that were written.
+    """
+    client = get_client()
+    if not request.tasks:
+        raise HTTPException(status_code=400, detail="No tasks provided")
+    if len(request.tasks) > MAX_BULK_TASKS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many tasks: {len(request.tasks)} (max {MAX_BULK_TASKS})"
+        )
+
+    task_kwargs = []
+    for task in request.tasks:
+        fields = task.dict(exclude={"socket_id"})
+        fields["start_time"] = parse_start_time(task.start_time)
+        task_kwargs.append(fields)
+
+    results = await asyncio.to_thread(db.set_tasks_bulk, client, task_kwargs)
+
+    if request.estimate and request.socket_id:
+        from agent_utils import run_bulk_agent_background
+        written = [
+            request.tasks[result["index"]] for result in results
+            if result["status"] in ("created", "updated")
+        ]
+        if written:
+            background_tasks.add_task(
+                run_bulk_agent_background,
+                request.socket_id,
+                [
+                    {
+                        "task_client_id": task.task_client_id,
+                        "email": task.email,
+                        "title": task.title,
+                        "description": task.description,
+                        "tag_names": task.tag_names or [],
+                        "initial_duration": task.duration or 30
+                    }
+                    for task in written
+                ]
+            )
+
+    failed = sum(1 for result in results if result["status"] == "error")
+    return {
+        "message": f"Processed {len(results)} tasks ({failed} failed)",
+        "results": results
+    }
 
 
 @app.patch("/api/tasks/{task_id}")
@@ -552,6 +743,16 @@ async def update_task(task_id: str, updates: TaskUpdate):
     
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
+
+    if task_writes.enabled:
+        # Merged with other updates to this task and written within the window
+        try:
+            queued = await task_writes.queue(task_id, update_data)
+        except InvalidId:
+            queued = False
+        if not queued:
+            raise HTTPException(status_code=404, detail="Task not found or update failed")
+        return {"message": "Task update queued"}
         
     result = db.update_task_fields(client, task_id, update_data)
     if not result:
@@ -565,7 +766,7 @@ async def update_task_description(email: str, title: str, update: TaskDescriptio
     client = get_client()
     result = db.set_task_description(client, email, title, update.description)
     if not result:
-        raise HTTPException(status_code=500, detail="Failed to update task description")
+        raise HTTPException(status_code=404, detail="Task not found")
     return {"message": "Task description updated successfully"}
 
 
@@ -575,7 +776,7 @@ async def update_task_tags(email: str, title: str, update: TaskTagsUpdate):
     client = get_client()
     result = db.set_task_tags(client, email, title, update.tag_names)
     if not result:
-        raise HTTPException(status_code=500, detail="Failed to update task tags")
+        raise HTTPException(status_code=404, detail="Task not found")
     return {"message": "Task tags updated successfully"}
 
 
@@ -585,7 +786,7 @@ async def add_tag_to_task(email: str, title: str, tag: TaskTagAdd):
     client = get_client()
     result = db.add_tag_to_task(client, email, title, tag.tag_name)
     if not result:
-        raise HTTPException(status_code=500, detail="Failed to add tag to task")
+        raise HTTPException(status_code=404, detail="Task not found")
     return {"message": "Tag added to task successfully"}
 
 
@@ -595,7 +796,7 @@ async def remove_tag_from_task(email: str, title: str, tag: TaskTagRemove):
     client = get_client()
     result = db.remove_tag_from_task(client, email, title, tag.tag_name)
     if not result:
-        raise HTTPException(status_code=500, detail="Failed to remove tag from task")
+        raise HTTPException(status_code=404, detail="Task not found")
     return {"message": "Tag removed from task successfully"}
 
 
@@ -646,7 +847,7 @@ async def agent_chat(request: AgentChatRequest, background_tasks: BackgroundTask
 
     try:
         graph = build_search_agent_graph()
-        result = graph.invoke({
+        result = await graph.ainvoke({
             "messages": [HumanMessage(content=request.message)]
         })
         
@@ -663,6 +864,40 @@ async def agent_chat(request: AgentChatRequest, background_tasks: BackgroundTask
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/estimate/batch", status_code=status.HTTP_202_ACCEPTED)
+async def estimate_batch(request: BatchEstimateRequest, background_tasks: BackgroundTasks):
+    """
+    Estimate many tasks at once ("estimate my week").
+    Tasks are packed into a few multi-task LLM prompts in the background, and each
+    task's agent_result is sent over the socket as soon as it is parsed.
+    """
+    if not request.tasks:
+        raise HTTPException(status_code=400, detail="No tasks provided")
+    if len(request.tasks) > MAX_BULK_TASKS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many tasks: {len(request.tasks)} (max {MAX_BULK_TASKS})"
+        )
+
+    from agent_utils import run_batch_estimation
+    background_tasks.add_task(
+        run_batch_estimation,
+        request.socket_id,
+        request.email,
+        [
+            {
+                "task_client_id": task.task_client_id,
+                "title": task.title,
+                "description": task.description,
+                "tag_names": task.tag_names or [],
+                "initial_duration": task.duration or 30
+            }
+            for task in request.tasks
+        ]
+    )
+    return {"message": f"Estimating {len(request.tasks)} tasks in background", "count": len(request.tasks)}
+
+
 @app.post("/api/agent/retrieve")
 async def agent_retrieve(request: AgentRetrieveRequest):
     """
@@ -708,6 +943,26 @@ async def health_check():
         }
 
 
+# ============================================================================
+# METRICS
+# ============================================================================
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Runtime metrics for this API worker"""
+    return {
+        "websocket": manager.metrics(),
+        "write_behind": task_writes.metrics(),
+        "cache": db.read_cache.stats(),
+        "providers": llm_client.metrics(),
+        "estimation_jobs": estimation_jobs.metrics(),
+        "estimation_tiers": tier_metrics(),
+        "estimation_memo": dict(db.estimation_memo_stats),
+        "page_cache": db.page_cache_metrics()
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # permessage-deflate is negotiated with clients that offer it
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws_per_message_deflate=True)
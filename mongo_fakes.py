@@ -0,0 +1,265 @@
+"""
+In-memory stand-ins for the small slice of the pymongo API that db.py uses.
+Test-only: lets the db.py helpers run without a MongoDB server.
+
+Every collection call is appended to FakeClient.calls as (collection, method),
+so tests can assert how many round-trips an operation costs.
+"""
+
+import copy
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+
+class FakeResult:
+    def __init__(self, matched_count=0, modified_count=0, upserted_id=None, deleted_count=0, inserted_id=None):
+        self.acknowledged = True
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+        self.deleted_count = deleted_count
+        self.inserted_id = inserted_id
+
+
+class FakeBulkResult:
+    def __init__(self, details: Dict[str, Any]):
+        self.acknowledged = True
+        self.bulk_api_result = details
+        self.upserted_count = len(details["upserted"])
+        self.matched_count = details["nMatched"]
+
+
+def _get(doc: Dict[str, Any], path: str):
+    value: Any = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _matches_value(actual, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        for op, operand in condition.items():
+            if op == "$eq" and not _matches_value(actual, operand):
+                return False
+            if op == "$ne" and _matches_value(actual, operand):
+                return False
+            if op == "$in" and not any(_matches_value(actual, item) for item in operand):
+                return False
+            if op == "$nin" and any(_matches_value(actual, item) for item in operand):
+                return False
+            if op == "$exists" and (actual is not None) != bool(operand):
+                return False
+            if op in ("$gt", "$gte", "$lt", "$lte"):
+                if actual is None:
+                    return False
+                if op == "$gt" and not actual > operand:
+                    return False
+                if op == "$gte" and not actual >= operand:
+                    return False
+                if op == "$lt" and not actual < operand:
+                    return False
+                if op == "$lte" and not actual <= operand:
+                    return False
+        return True
+    if isinstance(actual, list) and not isinstance(condition, list):
+        return condition in actual
+    return actual == condition
+
+
+def matches(doc: Dict[str, Any], query: Optional[Dict[str, Any]]) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif not _matches_value(_get(doc, key), condition):
+            return False
+    return True
+
+
+def project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    included = {k for k, v in projection.items() if v and k != "_id"}
+    if included:
+        result = {k: doc[k] for k in included if k in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    for key, value in projection.items():
+        if not value:
+            doc.pop(key, None)
+    return doc
+
+
+def _apply_update(doc: Dict[str, Any], update: Dict[str, Any], inserting: bool) -> None:
+    for field, value in update.get("$set", {}).items():
+        doc[field] = copy.deepcopy(value)
+    if inserting:
+        for field, value in update.get("$setOnInsert", {}).items():
+            doc[field] = copy.deepcopy(value)
+    for field, value in update.get("$inc", {}).items():
+        doc[field] = doc.get(field, 0) + value
+    for field, value in update.get("$addToSet", {}).items():
+        items = doc.setdefault(field, [])
+        if value not in items:
+            items.append(value)
+    for field, value in update.get("$pull", {}).items():
+        doc[field] = [item for item in doc.get(field, []) if item != value]
+    for field in update.get("$unset", {}):
+        doc.pop(field, None)
+
+
+class FakeCollection:
+    def __init__(self, name: str, client: "FakeClient"):
+        self.name = name
+        self.client = client
+        self.docs: List[Dict[str, Any]] = []
+        self.indexes: List[Any] = []
+
+    def _record(self, method: str):
+        self.client.calls.append((self.name, method))
+
+    def _upsert_seed(self, query: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: copy.deepcopy(v) for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+
+    def create_index(self, keys, **kwargs):
+        self._record("create_index")
+        self.indexes.append((keys, kwargs))
+        return kwargs.get("name", str(keys))
+
+    def insert_one(self, doc: Dict[str, Any]) -> FakeResult:
+        self._record("insert_one")
+        doc.setdefault("_id", ObjectId())
+        self.docs.append(copy.deepcopy(doc))
+        return FakeResult(inserted_id=doc["_id"])
+
+    def insert_many(self, docs: List[Dict[str, Any]], ordered: bool = True) -> FakeResult:
+        self._record("insert_many")
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+            self.docs.append(copy.deepcopy(doc))
+        return FakeResult()
+
+    def find(self, query=None, projection=None, sort=None, limit=0, **kwargs) -> List[Dict[str, Any]]:
+        """Supports find's sort=[(field, direction)] and limit keyword arguments."""
+        self._record("find")
+        found = [doc for doc in self.docs if matches(doc, query)]
+        for field, direction in reversed(sort or []):
+            found.sort(key=lambda doc: (_get(doc, field) is not None, _get(doc, field)), reverse=direction < 0)
+        if limit:
+            found = found[:limit]
+        return [project(doc, projection) for doc in found]
+
+    def find_one(self, query=None, projection=None, **kwargs) -> Optional[Dict[str, Any]]:
+        self._record("find_one")
+        for doc in self.docs:
+            if matches(doc, query):
+                return project(doc, projection)
+        return None
+
+    def count_documents(self, query=None, **kwargs) -> int:
+        self._record("count_documents")
+        return sum(1 for doc in self.docs if matches(doc, query))
+
+    def _update(self, query, update, upsert) -> FakeResult:
+        for doc in self.docs:
+            if matches(doc, query):
+                _apply_update(doc, update, inserting=False)
+                return FakeResult(matched_count=1, modified_count=1)
+        if upsert:
+            doc = self._upsert_seed(query)
+            doc["_id"] = ObjectId()
+            _apply_update(doc, update, inserting=True)
+            self.docs.append(doc)
+            return FakeResult(upserted_id=doc["_id"])
+        return FakeResult()
+
+    def update_one(self, query, update, upsert: bool = False) -> FakeResult:
+        self._record("update_one")
+        return self._update(query, update, upsert)
+
+    def update_many(self, query, update) -> FakeResult:
+        self._record("update_many")
+        matched = [doc for doc in self.docs if matches(doc, query)]
+        for doc in matched:
+            _apply_update(doc, update, inserting=False)
+        return FakeResult(matched_count=len(matched), modified_count=len(matched))
+
+    def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=False, **kwargs):
+        self._record("find_one_and_update")
+        for doc in self.docs:
+            if matches(doc, query):
+                before = project(doc, projection)
+                _apply_update(doc, update, inserting=False)
+                return project(doc, projection) if return_document else before
+        if upsert:
+            result = self._update(query, update, True)
+            doc = next(d for d in self.docs if d["_id"] == result.upserted_id)
+            return project(doc, projection) if return_document else None
+        return None
+
+    def delete_one(self, query) -> FakeResult:
+        self._record("delete_one")
+        for i, doc in enumerate(self.docs):
+            if matches(doc, query):
+                del self.docs[i]
+                return FakeResult(deleted_count=1)
+        return FakeResult()
+
+    def find_one_and_delete(self, query, projection=None, **kwargs):
+        self._record("find_one_and_delete")
+        for i, doc in enumerate(self.docs):
+            if matches(doc, query):
+                del self.docs[i]
+                return project(doc, projection)
+        return None
+
+    def bulk_write(self, operations, ordered: bool = True) -> FakeBulkResult:
+        """Applies UpdateOne requests. Indexes in client.fail_bulk_indexes fail with a write error."""
+        self._record("bulk_write")
+        details: Dict[str, Any] = {"upserted": [], "writeErrors": [], "nMatched": 0}
+        for index, op in enumerate(operations):
+            if index in self.client.fail_bulk_indexes:
+                details["writeErrors"].append({"index": index, "code": 11000, "errmsg": "E11000 duplicate key"})
+                if ordered:
+                    break
+                continue
+            result = self._update(op._filter, op._doc, op._upsert)
+            if result.upserted_id is not None:
+                details["upserted"].append({"index": index, "_id": result.upserted_id})
+            else:
+                details["nMatched"] += result.matched_count
+        if details["writeErrors"]:
+            raise BulkWriteError(details)
+        return FakeBulkResult(details)
+
+
+class FakeDatabase:
+    def __init__(self, client: "FakeClient"):
+        self.client = client
+        self.collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(name, self.client)
+        return self.collections[name]
+
+
+class FakeClient:
+    def __init__(self):
+        self.databases: Dict[str, FakeDatabase] = {}
+        self.calls: List[Any] = []
+        self.fail_bulk_indexes = set()
+
+    def __getitem__(self, name: str) -> FakeDatabase:
+        if name not in self.databases:
+            self.databases[name] = FakeDatabase(self)
+        return self.databases[name]
@@ -1,18 +1,28 @@
 
+import asyncio
 import os
-import requests
 import re
 from typing import Annotated, TypedDict, List, Dict, Any, Literal
 from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, BaseMessage
-from bs4 import BeautifulSoup
+from pymongo import MongoClient
+
+import db
+import html_text
+import llm_client
+import web_fetcher
 
 # Load environment variables
 load_dotenv()
 
+# Scraped pages are cached in MongoDB (see db.py PAGE CACHE)
+MONGO_URI = os.getenv("MONGO_URI")
+client = MongoClient(MONGO_URI)
+
 # Initialize LLM
 llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
 
@@ -22,6 +32,7 @@ class SearchAgentState(TypedDict):
     messages: Annotated[list, add_messages]
     urls: List[str]
     scraped_content: Dict[str, str]
+    stream_tokens: bool  # Send partial LLM text to the graph's "custom" stream
 
 # Node 1: Extract URLs
 def extract_urls_node(state: SearchAgentState) -> Dict[str, Any]:
@@ -56,47 +67,90 @@ def extract_urls_node(state: SearchAgentState) -> Dict[str, Any]:
     return {"urls": urls}
 
 # Node 2: Scrape URLs
-def scrape_urls_node(state: SearchAgentState) -> Dict[str, Any]:
+async def scrape_urls_node(state: SearchAgentState) -> Dict[str, Any]:
     """
     Scrapes content from the extracted URLs.
+    Recently checked pages come from the page cache; the rest are fetched
+    concurrently, with conditional requests for cached pages.
     """
     urls = state.get("urls", [])
     scraped_content = {}
-    
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    
+
+    print(f"Scraping {urls}...")
+    cached = await asyncio.to_thread(_cached_pages, urls) if urls else {}
+
+    to_fetch = []
+    conditional_headers = {}
     for url in urls:
-        try:
-            print(f"Scraping {url}...")
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Remove script and style elements
-            for script in soup(["script", "style"]):
-                script.extract()
-                
-            # Get text
-            text = soup.get_text()
-            
-            # Break into lines and remove leading/trailing space on each
-            lines = (line.strip() for line in text.splitlines())
-            # Break multi-headlines into a line each
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            # Drop blank lines
-            text = '\n'.join(chunk for chunk in chunks if chunk)
-            
-            # Limit content length to avoid token limits (approx 4000 chars per URL)
-            scraped_content[url] = text[:4000]
-            
-        except Exception as e:
-            print(f"Error scraping {url}: {e}")
-            scraped_content[url] = f"Error scraping content: {str(e)}"
-            
-    return {"scraped_content": scraped_content}
+        page = cached.get(url)
+        if page and page["fresh"]:
+            scraped_content[url] = page["text"]
+            continue
+        to_fetch.append(url)
+        if page:
+            conditional_headers[url] = _conditional_headers(page)
+
+    responses = await web_fetcher.fetch_all(to_fetch, headers=conditional_headers)
+
+    revalidated = []
+    downloaded = []
+    for url, response in responses.items():
+        page = cached.get(url)
+        if isinstance(response, Exception):
+            print(f"Error scraping {url}: {response}")
+            # An outdated copy beats no content at all
+            scraped_content[url] = page["text"] if page else f"Error scraping content: {str(response)}"
+        elif response.status_code == 304:
+            scraped_content[url] = page["text"]
+            revalidated.append((url, page.get("size", 0)))
+        else:
+            downloaded.append((url, response))
+
+    # Parse the downloaded pages side by side on the parse pool
+    texts = await asyncio.gather(*(html_text.extract_text_async(response.content) for _, response in downloaded))
+    for (url, response), text in zip(downloaded, texts):
+        # Limit content length to avoid token limits (approx 4000 chars per URL)
+        scraped_content[url] = text[:4000]
+
+    if revalidated or downloaded:
+        await asyncio.to_thread(_update_page_cache, revalidated, downloaded, scraped_content)
+
+    return {"scraped_content": {url: scraped_content[url] for url in urls if url in scraped_content}}
+
+
+def _cached_pages(urls: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Cached pages of the urls. If the cache is unreachable every page is fetched."""
+    try:
+        return db.get_cached_pages(client, urls)
+    except Exception as e:
+        print(f"Warning: Page cache lookup failed: {e}")
+        return {}
+
+
+def _conditional_headers(page: Dict[str, Any]) -> Dict[str, str]:
+    headers = {}
+    if page.get("etag"):
+        headers["If-None-Match"] = page["etag"]
+    if page.get("last_modified"):
+        headers["If-Modified-Since"] = page["last_modified"]
+    return headers
+
+
+def _update_page_cache(revalidated: List[tuple], downloaded: List[tuple], scraped_content: Dict[str, str]) -> None:
+    """Refreshes revalidated pages and stores downloaded ones."""
+    try:
+        for url, size in revalidated:
+            db.revalidate_cached_page(client, url, size)
+        for url, response in downloaded:
+            db.set_cached_page(
+                client, url, scraped_content[url],
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+                len(response.content)
+            )
+    except Exception as e:
+        print(f"Warning: Page cache update failed: {e}")
+
 
 # Node 3: Generate Response
 def generate_response_node(state: SearchAgentState) -> Dict[str, Any]:
@@ -130,7 +184,11 @@ def generate_response_node(state: SearchAgentState) -> Dict[str, Any]:
     
     llm_messages = [SystemMessage(content=system_prompt)] + messages
     
-    response = llm.invoke(llm_messages)
+    if state.get("stream_tokens"):
+        writer = get_stream_writer()
+        response = llm_client.stream_chat(llm, llm_messages, lambda text: writer({"delta": text}))
+    else:
+        response = llm_client.invoke_chat(llm, llm_messages)
     
     return {"messages": [response]}
 
@@ -163,7 +221,7 @@ if __name__ == "__main__":
         if user_input.lower() in ["quit", "exit"]:
             break
             
-        result = graph.invoke({"messages": [HumanMessage(content=user_input)]})
+        result = asyncio.run(graph.ainvoke({"messages": [HumanMessage(content=user_input)]}))
         
         # improved printing of the last message
         last_message = result['messages'][-1]
@@ -0,0 +1,201 @@
+"""
+Task Change Events
+
+Pushes task create/update/delete events to every WebSocket connection a user
+has open, so other tabs and devices stay in sync without polling the REST API.
+
+Two sources of events are supported:
+- change_stream: a MongoDB change stream on the tasks and task_tombstones
+  collections. Sees writes from every API worker and from scripts. Requires a
+  replica set or sharded cluster (MongoDB Atlas qualifies).
+- write_hook: db.py notifies listeners after each task write. Works against a
+  standalone mongod, but only sees writes made by this process, so events go
+  through the manager's pub/sub backend to reach the other workers.
+
+TASK_EVENTS_MODE selects the source: "auto" (default) uses a change stream when
+the server supports one and falls back to write hooks, "off" stops pushing events
+to sockets (listeners still hear this worker's writes).
+
+Clients receive:
+{"type": "task_event", "op": "created" | "updated" | "deleted",
+ "task_id": str, "task_client_id": str | None, "task": dict | None,
+ "fields": [str] | None}
+fields lists the top-level fields an update wrote, or is None when unknown.
+
+Server-side listeners (add_listener) get the same event for every task write on
+any worker, whether or not the user has a socket open.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+import db
+from websocket_manager import ConnectionManager
+
+load_dotenv()
+
+TASK_EVENTS_MODE = os.getenv("TASK_EVENTS_MODE", "auto")
+
+
+def supports_change_streams(client: MongoClient) -> bool:
+    """Change streams need a replica set or a mongos; standalone servers lack an oplog."""
+    try:
+        hello = client.admin.command("hello")
+    except Exception as e:
+        print(f"Warning: Could not determine MongoDB topology: {e}")
+        return False
+    return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+
+class TaskEventPublisher:
+    """Watches task writes and fans them out to the owning user's connections."""
+
+    def __init__(
+        self,
+        manager: ConnectionManager,
+        serializer: Callable[[Dict[str, Any]], Dict[str, Any]],
+        mode: str = TASK_EVENTS_MODE
+    ):
+        self.manager = manager
+        self.serializer = serializer
+        self.requested_mode = mode
+        self.mode: Optional[str] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        """Calls listener(event) for each task event, on whichever thread produced it."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify_listeners(self, event: Dict[str, Any]) -> None:
+        for listener in list(self._listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"Warning: Task event listener failed: {e}")
+
+    def start(self, client: MongoClient, loop: asyncio.AbstractEventLoop) -> None:
+        """Starts publishing events in the configured mode."""
+        self._loop = loop
+        mode = self.requested_mode
+        if mode == "auto":
+            mode = "change_stream" if supports_change_streams(client) else "write_hook"
+
+        self.mode = mode
+        if mode == "change_stream":
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._watch, args=(client,), name="task-change-stream", daemon=True
+            )
+            self._thread.start()
+        else:
+            db.add_task_change_listener(self.publish)
+            if mode == "write_hook" and not self.manager.backend.is_local:
+                # Write hooks only fire in the writing worker; hear the others' events
+                self.manager.add_message_hook("task_event", self._notify_listeners)
+        if mode != "off":
+            print(f"✓ Task events enabled ({mode})")
+
+    def stop(self) -> None:
+        """Stops the change stream thread or unregisters the write hook."""
+        if self.mode in ("write_hook", "off"):
+            db.remove_task_change_listener(self.publish)
+            self.manager.remove_message_hook("task_event", self._notify_listeners)
+        elif self.mode == "change_stream" and self._thread:
+            self._stop.set()
+            self._thread.join(timeout=5)
+        self.mode = None
+
+    def publish(self, op: str, task: Dict[str, Any], fields: Optional[List[str]] = None) -> None:
+        """
+        Schedules delivery of one task event. Safe to call from any thread.
+        """
+        email = task.get("email")
+        if not email or self._loop is None:
+            return
+        task_id = str(task.get("_id", task.get("task_id", "")))
+        message = {
+            "type": "task_event",
+            "op": op,
+            "task_id": task_id,
+            "task_client_id": task.get("task_client_id"),
+            "task": None if op == "deleted" else self.serializer(dict(task)),
+            "fields": fields
+        }
+        self._notify_listeners(message)
+        if self.mode == "off":
+            return
+
+        # Every worker watches the change stream, so each one only serves its own sockets.
+        # Write hooks only fire in the writing worker, which publishes to all workers.
+        local_only = self.mode == "change_stream"
+        if (local_only or self.manager.backend.is_local) and not self.manager.user_connections.get(email):
+            return
+
+        send = self.manager.send_to_user_local if local_only else self.manager.send_to_user
+        asyncio.run_coroutine_threadsafe(send(message, email), self._loop)
+
+    def _watch(self, client: MongoClient) -> None:
+        """Change stream loop. Resumes after transient errors using the last resume token."""
+        database = client[db.DB_NAME]
+        pipeline = [
+            {"$match": {"$or": [
+                {"ns.coll": "tasks", "operationType": {"$in": ["insert", "update", "replace"]}},
+                {"ns.coll": "task_tombstones", "operationType": "insert"}
+            ]}},
+            {"$project": {"fullDocument.embedding": 0}}
+        ]
+        resume_token = None
+        backoff = 1
+
+        while not self._stop.is_set():
+            try:
+                with database.watch(
+                    pipeline,
+                    full_document="updateLookup",
+                    resume_after=resume_token,
+                    max_await_time_ms=1000
+                ) as stream:
+                    backoff = 1
+                    while not self._stop.is_set():
+                        change = stream.try_next()
+                        if change is None:
+                            continue
+                        resume_token = stream.resume_token
+                        self._handle_change(change)
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                print(f"Warning: Task change stream interrupted: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _handle_change(self, change: Dict[str, Any]) -> None:
+        document = change.get("fullDocument")
+        if not document:
+            # Task deleted before the update lookup ran; its tombstone follows
+            return
+        if change["ns"]["coll"] == "task_tombstones":
+            self.publish("deleted", {
+                "_id": document.get("task_id"),
+                "email": document.get("email"),
+                "task_client_id": document.get("task_client_id")
+            })
+        elif change["operationType"] == "update":
+            description = change.get("updateDescription", {})
+            written = list(description.get("updatedFields", {})) + list(description.get("removedFields", []))
+            self.publish("updated", document, sorted({field.split(".")[0] for field in written}))
+        else:
+            self.publish("created" if change["operationType"] == "insert" else "updated", document)
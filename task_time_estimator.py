@@ -5,7 +5,8 @@ Simple interface for the time estimation agent pipeline.
 Provides an easy-to-use function for estimating task time based on historical data.
 """
 
-from typing import Dict, Any, Literal
+from typing import Callable, Dict, Any, List, Literal, Optional
+from deadlines import Deadline
 from time_estimation_agent import build_time_estimation_graph
 
 
@@ -16,7 +17,10 @@ def estimate_task_time(
     task_description: str,
     tag_name: str,
     tag_description: str,
-    initial_estimate_minutes: int
+    initial_estimate_minutes: int,
+    deadline: Optional[Deadline] = None,
+    tag_names: Optional[List[str]] = None,
+    on_delta: Optional[Callable[[str], None]] = None
 ) -> Dict[str, Any]:
     """
     Estimates appropriate time allocation for a task based on historical data.
@@ -28,6 +32,12 @@ def estimate_task_time(
         tag_name: Primary tag for the task
         tag_description: Description of the tag
         initial_estimate_minutes: User's initial time estimate in minutes
+        deadline: Optional time limit and cancellation token for the run; raises
+            deadlines.DeadlineExceeded / deadlines.JobCancelled when it stops the run
+        tag_names: All of the task's tags; similar tasks are searched for each of
+            them in parallel. Defaults to just tag_name
+        on_delta: Optional callback for the LLM's partial text as it streams in;
+            the returned fields are still parsed from the complete response
         
     Returns:
         Dictionary containing:
@@ -37,6 +47,8 @@ def estimate_task_time(
         - confidence: "high", "medium", or "low"
         - similar_tags_found: Number of similar tags found
         - historical_tasks_analyzed: Number of historical tasks analyzed
+        - degraded: True if the LLM was unavailable and a heuristic estimate was used
+        - tier: Model tier the estimate was routed to ("none", "fast" or "standard")
         
     Example:
         >>> result = estimate_task_time(
@@ -61,15 +73,27 @@ def estimate_task_time(
         "task_description": task_description,
         "tag_name": tag_name,
         "tag_description": tag_description,
+        "tag_names": tag_names or [tag_name],
         "email": email,
         "estimated_time": initial_estimate_minutes,
+        "deadline": deadline,
+        "stream_tokens": on_delta is not None,
         "similar_tags": [],
+        "tag_results": [],
         "historical_tasks": [],
         "messages": []
     }
     
     # Run the agent pipeline
-    result = graph.invoke(initial_state)
+    if on_delta is None:
+        result = graph.invoke(initial_state)
+    else:
+        result = {}
+        for mode, chunk in graph.stream(initial_state, stream_mode=["custom", "values"]):
+            if mode == "custom":
+                on_delta(chunk["delta"])
+            else:
+                result = chunk
     
     # Format output
     return {
@@ -78,7 +102,9 @@ def estimate_task_time(
         "reasoning": result.get("reasoning", "No reasoning provided"),
         "confidence": result.get("confidence", "medium"),
         "similar_tags_found": len(result.get("similar_tags", [])),
-        "historical_tasks_analyzed": len(result.get("historical_tasks", []))
+        "historical_tasks_analyzed": len(result.get("historical_tasks", [])),
+        "degraded": result.get("degraded", False),
+        "tier": result.get("tier", "standard")
     }
 
 
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessageChunk
+
+import agent_utils
+import main
+import time_estimation_agent
+
+EMAIL = "me@example.com"
+CONSISTENT = [{"title": "Run", "duration": 40}, {"title": "Run", "duration": 42}, {"title": "Run", "duration": 44}]
+
+
+class StreamingLLM:
+    """Streams a canned answer a few characters at a time."""
+
+    def __init__(self, answer=None, error=None):
+        self.answer = answer
+        self.error = error
+        self.prompts = []
+
+    async def astream(self, messages):
+        self.prompts.append(messages[0].content)
+        if self.error:
+            raise self.error
+        for start in range(0, len(self.answer), 7):
+            yield AIMessageChunk(content=self.answer[start:start + 7])
+
+
+def answer(*lines):
+    return "\n".join(json.dumps(line) for line in lines) + "\n"
+
+
+def task(task_client_id, description="", duration=30):
+    return {
+        "task_client_id": task_client_id,
+        "title": task_client_id.upper(),
+        "description": description,
+        "tag_names": ["work"],
+        "initial_duration": duration
+    }
+
+
+class TestRunBatchEstimation(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = AsyncMock()
+        self.persist = MagicMock()
+        self.histories = {}
+        patchers = [
+            patch.object(agent_utils.manager, "send_personal_message", self.sent),
+            patch.object(agent_utils.db, "get_tag", return_value=None),
+            patch.object(agent_utils.db, "update_task_ai_estimation", self.persist),
+            patch.object(agent_utils, "MongoClient", MagicMock()),
+            patch.object(agent_utils, "embed_descriptions", side_effect=lambda texts: [[1.0]] * len(texts)),
+            patch.object(
+                agent_utils, "similar_tasks_for",
+                side_effect=lambda task_id, *args: self.histories.get(task_id, [])
+            ),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_with(self, llm, tasks):
+        with patch.object(time_estimation_agent.ModelTier, "get_llm", return_value=llm):
+            asyncio.run(agent_utils.run_batch_estimation("client", EMAIL, tasks))
+        return [call.args[0] for call in self.sent.await_args_list if call.args[0]["type"] == "agent_result"]
+
+    def test_tasks_share_one_llm_call(self):
+        llm = StreamingLLM(answer(
+            {"id": "1", "recommendation": "increase", "suggested_minutes": 60, "confidence": "high", "reasoning": "Big"},
+            {"id": "2", "recommendation": "keep", "suggested_minutes": 45, "confidence": "low", "reasoning": "Fine"},
+        ))
+        results = self.run_with(llm, [task("a"), task("b", duration=45)])
+        self.assertEqual(len(llm.prompts), 1)
+        self.assertEqual({r["task_client_id"]: r["duration"] for r in results}, {"a": 60, "b": 45})
+        self.assertTrue(all(r["phase"] == "final" and not r["degraded"] for r in results))
+        self.assertEqual(self.persist.call_count, 2)
+
+    def test_history_tier_is_answered_without_the_llm(self):
+        self.histories["a"] = CONSISTENT
+        llm = StreamingLLM(answer(
+            {"id": "2", "recommendation": "keep", "suggested_minutes": 30, "confidence": "medium", "reasoning": "-"},
+        ))
+        results = self.run_with(llm, [task("a"), task("b")])
+        self.assertEqual([r["task_client_id"] for r in results], ["a", "b"])
+        self.assertEqual(results[0]["tier"], "none")
+        self.assertEqual(results[0]["duration"], 42)
+        self.assertNotIn("[1]", llm.prompts[0])
+
+    def test_never_decreases_the_estimate(self):
+        llm = StreamingLLM(answer(
+            {"id": "1", "recommendation": "increase", "suggested_minutes": 10, "confidence": "high", "reasoning": "-"},
+        ))
+        results = self.run_with(llm, [task("a", duration=30)])
+        self.assertEqual(results[0]["duration"], 30)
+        self.assertEqual(results[0]["recommendation"], "keep")
+
+    def test_unanswered_tasks_fall_back_to_heuristic(self):
+        llm = StreamingLLM("```json\n" + answer(
+            {"id": "1", "recommendation": "keep", "suggested_minutes": 30, "confidence": "high", "reasoning": "-"},
+        ) + "```")
+        results = self.run_with(llm, [task("a"), task("b")])
+        by_task = {r["task_client_id"]: r for r in results}
+        self.assertFalse(by_task["a"]["degraded"])
+        self.assertTrue(by_task["b"]["degraded"])
+
+    def test_llm_failure_degrades_every_task(self):
+        results = self.run_with(StreamingLLM(error=RuntimeError("503")), [task("a"), task("b")])
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all(r["degraded"] for r in results))
+
+    def test_splits_large_batches_into_several_prompts(self):
+        llm = StreamingLLM(answer())
+        with patch.object(agent_utils, "ESTIMATE_BATCH_PROMPT_SIZE", 2):
+            self.run_with(llm, [task("a"), task("b"), task("c")])
+        self.assertEqual(len(llm.prompts), 2)
+
+
+class TestEmbedDescriptions(unittest.TestCase):
+
+    def test_embeds_as_retrieval_queries(self):
+        with patch.object(time_estimation_agent.llm_client, "embed_documents", return_value=[[0.1], [0.2]]) as embed:
+            vectors = time_estimation_agent.embed_descriptions(["a", "b"])
+        self.assertEqual(vectors, [[0.1], [0.2]])
+        self.assertEqual(embed.call_args.kwargs["task_type"], "RETRIEVAL_QUERY")
+
+
+class TestParseBatchLine(unittest.TestCase):
+
+    def test_ignores_non_json_lines(self):
+        self.assertIsNone(time_estimation_agent.parse_batch_line("```json"))
+        self.assertIsNone(time_estimation_agent.parse_batch_line('{"id": "1"}'))
+
+    def test_parses_estimate(self):
+        parsed = time_estimation_agent.parse_batch_line('{"id": 3, "suggested_minutes": "45", "reasoning": "ok"},')
+        self.assertEqual(parsed["id"], "3")
+        self.assertEqual(parsed["suggested_minutes"], 45)
+
+
+class TestBatchEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.http = TestClient(main.app)
+
+    def test_rejects_empty_batch(self):
+        response = self.http.post("/api/estimate/batch", json={"email": EMAIL, "socket_id": "s", "tasks": []})
+        self.assertEqual(response.status_code, 400)
+
+    def test_schedules_batch_estimation(self):
+        with patch.object(agent_utils, "run_batch_estimation", AsyncMock()) as run:
+            response = self.http.post("/api/estimate/batch", json={
+                "email": EMAIL, "socket_id": "s",
+                "tasks": [{"task_client_id": "a", "title": "A", "duration": 50}]
+            })
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["count"], 1)
+        run.assert_awaited_once()
+        self.assertEqual(run.await_args.args[2][0]["initial_duration"], 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
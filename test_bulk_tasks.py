@@ -0,0 +1,102 @@
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import db
+import main
+from mongo_fakes import FakeClient
+
+EMAIL = "me@example.com"
+
+
+def task(title, **fields):
+    return {"email": EMAIL, "title": title, "task_client_id": f"c-{title}", **fields}
+
+
+class TestSetTasksBulk(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        patcher = patch.object(db, "_generate_embeddings", side_effect=lambda texts: [[float(len(t))] for t in texts])
+        self.embed = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_embeds_all_texts_in_one_call(self):
+        db.set_tasks_bulk(self.client, [task("A", description="first"), task("B"), task("C")])
+        self.embed.assert_called_once_with(["A: first", "B", "C"])
+        stored = self.client[db.DB_NAME]["tasks"].find({"title": "A"})[0]
+        self.assertEqual(stored["embedding"], [float(len("A: first"))])
+
+    def test_single_bulk_write(self):
+        db.set_tasks_bulk(self.client, [task("A"), task("B")])
+        self.assertEqual(
+            [call for call in self.client.calls if call[1] in ("update_one", "bulk_write")],
+            [("tasks", "bulk_write")]
+        )
+
+    def test_reports_created_vs_updated(self):
+        db.set_tasks_bulk(self.client, [task("A")])
+        results = db.set_tasks_bulk(self.client, [task("A", duration=30), task("B")])
+        self.assertEqual([r["status"] for r in results], ["updated", "created"])
+        self.assertEqual(self.client[db.DB_NAME]["tasks"].find({"title": "A"})[0]["duration"], 30)
+
+    def test_duplicate_client_id_rejected_without_embedding(self):
+        results = db.set_tasks_bulk(self.client, [task("A"), task("A", duration=5), task("B")])
+        self.assertEqual([r["status"] for r in results], ["created", "error", "created"])
+        self.assertEqual(results[1]["error"], "Duplicate task_client_id in request")
+        self.embed.assert_called_once_with(["A", "B"])
+
+    def test_retried_batch_is_unchanged_and_not_re_embedded(self):
+        db.set_tasks_bulk(self.client, [task("A"), task("B", description="x")])
+        self.embed.reset_mock()
+        results = db.set_tasks_bulk(self.client, [task("A"), task("B", description="x", duration=15)])
+        self.assertEqual([r["status"] for r in results], ["unchanged", "updated"])
+        # B's text did not change, so its stored embedding is kept
+        self.embed.assert_not_called()
+        self.assertEqual(self.client[db.DB_NAME]["tasks"].find({"title": "B"})[0]["duration"], 15)
+
+    def test_write_errors_map_to_input_positions(self):
+        # Operation 1 is input 2, because input 1 was rejected as a duplicate
+        self.client.fail_bulk_indexes = {1}
+        results = db.set_tasks_bulk(self.client, [task("A"), task("A"), task("B"), task("C")])
+        self.assertEqual([r["status"] for r in results], ["created", "error", "error", "created"])
+        self.assertIn("duplicate key", results[2]["error"])
+        self.assertEqual([r["index"] for r in results], [0, 1, 2, 3])
+
+    def test_empty_batch_skips_database(self):
+        self.assertEqual(db.set_tasks_bulk(self.client, []), [])
+        self.assertEqual(self.client.calls, [])
+        self.embed.assert_not_called()
+
+
+class TestBulkEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        patcher = patch.object(db, "_generate_embeddings", side_effect=lambda texts: [None] * len(texts))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        previous = main.mongo_client
+        main.mongo_client = self.client
+        self.addCleanup(setattr, main, "mongo_client", previous)
+        self.http = TestClient(main.app)
+
+    def payload(self, count):
+        return {"tasks": [
+            {"email": EMAIL, "title": f"T{i}", "task_client_id": f"c-{i}"} for i in range(count)
+        ]}
+
+    def test_creates_tasks(self):
+        response = self.http.post("/api/tasks/bulk", json=self.payload(3))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["status"] for r in response.json()["results"]], ["created"] * 3)
+
+    def test_rejects_empty_and_oversized_batches(self):
+        self.assertEqual(self.http.post("/api/tasks/bulk", json=self.payload(0)).status_code, 400)
+        oversized = self.http.post("/api/tasks/bulk", json=self.payload(main.MAX_BULK_TASKS + 1))
+        self.assertEqual(oversized.status_code, 413)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+import unittest
+from unittest.mock import patch
+
+import circuit_breaker
+import db
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from mongo_fakes import FakeClient
+from time_estimation_agent import heuristic_estimate
+
+EMAIL = "me@example.com"
+
+
+def fail():
+    raise TimeoutError("provider timed out")
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = patch.object(circuit_breaker.time, "monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker("test", window_seconds=30, min_calls=4, failure_rate=0.5, open_seconds=10)
+
+    def trip(self):
+        for _ in range(4):
+            with self.assertRaises(TimeoutError):
+                self.breaker.call(fail)
+
+    def test_stays_closed_below_failure_rate(self):
+        for _ in range(3):
+            self.breaker.call(lambda: "ok")
+        with self.assertRaises(TimeoutError):
+            self.breaker.call(fail)
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_needs_minimum_calls_before_opening(self):
+        for _ in range(3):
+            with self.assertRaises(TimeoutError):
+                self.breaker.call(fail)
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_open_circuit_fails_fast(self):
+        self.trip()
+        self.assertEqual(self.breaker.state, "open")
+        called = []
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(called.append, 1)
+        self.assertEqual(called, [])
+        self.assertEqual(self.breaker.metrics()["rejected"], 1)
+
+    def test_old_failures_leave_the_window(self):
+        for _ in range(3):
+            with self.assertRaises(TimeoutError):
+                self.breaker.call(fail)
+        self.now += 31
+        with self.assertRaises(TimeoutError):
+            self.breaker.call(fail)
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_successful_probe_closes(self):
+        self.trip()
+        self.now += 10
+        self.assertEqual(self.breaker.state, "half_open")
+        self.assertEqual(self.breaker.call(lambda: "ok"), "ok")
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_failed_probe_reopens(self):
+        self.trip()
+        self.now += 10
+        with self.assertRaises(TimeoutError):
+            self.breaker.call(fail)
+        self.assertEqual(self.breaker.state, "open")
+        self.assertEqual(self.breaker.metrics()["opened"], 2)
+
+    def test_half_open_admits_one_probe(self):
+        self.trip()
+        self.now += 10
+
+        def probe():
+            with self.assertRaises(CircuitOpenError):
+                self.breaker.call(lambda: None)
+            return "ok"
+
+        self.assertEqual(self.breaker.call(probe), "ok")
+
+    def test_abandoned_probe_is_released(self):
+        self.trip()
+        self.now += 10
+        with self.assertRaises(GeneratorExit):
+            with self.breaker.guard():
+                raise GeneratorExit()
+        self.assertEqual(self.breaker.state, "half_open")
+        self.assertEqual(self.breaker.call(lambda: "ok"), "ok")
+        self.assertEqual(self.breaker.state, "closed")
+
+
+class TestDegradedEmbeddings(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+
+    def stored(self):
+        return self.client[db.DB_NAME]["tasks"].find_one({"task_client_id": "c1"})
+
+    def test_provider_outage_marks_task_pending(self):
+        with patch.object(db, "_generate_embedding", return_value=None):
+            self.assertEqual(db.set_task(self.client, EMAIL, "Gym", "c1"), "created")
+        self.assertEqual(self.stored()["embedding_status"], "pending")
+        self.assertNotIn("embedding", self.stored())
+
+    def test_pending_task_is_re_embedded_on_next_write(self):
+        with patch.object(db, "_generate_embedding", return_value=None):
+            db.set_task(self.client, EMAIL, "Gym", "c1")
+        with patch.object(db, "_generate_embedding", return_value=[0.5]) as embed:
+            db.set_task(self.client, EMAIL, "Gym", "c1", duration=45)
+        embed.assert_called_once()
+        self.assertEqual(self.stored()["embedding_status"], "ready")
+
+    def test_backfill_embeds_pending_tasks(self):
+        with patch.object(db, "_generate_embedding", return_value=None):
+            db.set_task(self.client, EMAIL, "Gym", "c1", description="legs")
+        with patch.object(db, "_generate_embeddings", return_value=[[0.7]]) as embed:
+            self.assertEqual(db.backfill_pending_embeddings(self.client), 1)
+        embed.assert_called_once_with(["Gym: legs"])
+        self.assertEqual(self.stored()["embedding"], [0.7])
+        self.assertEqual(self.stored()["embedding_status"], "ready")
+
+    def test_backfill_skips_tasks_edited_meanwhile(self):
+        with patch.object(db, "_generate_embedding", return_value=None):
+            db.set_task(self.client, EMAIL, "Gym", "c1")
+
+        def edit_then_embed(texts):
+            self.client[db.DB_NAME]["tasks"].update_one({"task_client_id": "c1"}, {"$set": {"title": "Run"}})
+            return [[0.7]]
+
+        with patch.object(db, "_generate_embeddings", side_effect=edit_then_embed):
+            self.assertEqual(db.backfill_pending_embeddings(self.client), 0)
+        self.assertEqual(self.stored()["embedding_status"], "pending")
+
+    def test_open_circuit_skips_embedding_calls(self):
+        breaker = CircuitBreaker("test", min_calls=1, failure_rate=0.5)
+        with self.assertRaises(TimeoutError):
+            breaker.call(fail)
+        with patch.object(db.llm_client, "embedding_breaker", breaker), \
+                patch.object(db, "_get_embeddings_model") as model:
+            self.assertIsNone(db._generate_embedding("Gym"))
+            self.assertEqual(db._generate_embeddings(["a", "b"]), [None, None])
+        model.return_value.embed_query.assert_not_called()
+        model.return_value.embed_documents.assert_not_called()
+
+
+class TestHeuristicEstimate(unittest.TestCase):
+
+    def test_uses_median_of_history(self):
+        result = heuristic_estimate(30, [{"duration": 40}, {"duration": 60}, {"duration": 300}])
+        self.assertEqual(result["suggested_minutes"], 60)
+        self.assertEqual(result["recommendation"], "increase")
+
+    def test_never_decreases(self):
+        result = heuristic_estimate(90, [{"duration": 20}, {"duration": 30}])
+        self.assertEqual(result["suggested_minutes"], 90)
+        self.assertEqual(result["recommendation"], "keep")
+
+    def test_without_history_keeps_estimate(self):
+        result = heuristic_estimate(45, [{"title": "No duration"}])
+        self.assertEqual(result["suggested_minutes"], 45)
+        self.assertEqual(result["confidence"], "low")
+
+
+if __name__ == "__main__":
+    unittest.main()
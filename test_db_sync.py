@@ -0,0 +1,259 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import db
+import main
+from mongo_fakes import FakeClient
+
+EMAIL = "me@example.com"
+
+
+def tasks_of(client):
+    return client[db.DB_NAME]["tasks"]
+
+
+class TestUpdatedAtStamping(unittest.TestCase):
+    """Every write path must bump updated_at, or delta sync never sees the change."""
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.clock = datetime(2026, 1, 1, 12, 0, 0)
+        patchers = [
+            patch.object(db, "_utcnow", side_effect=lambda: self.clock),
+            patch.object(db, "_generate_embedding", return_value=[0.1, 0.2]),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        db.set_task(self.client, EMAIL, "Write report", "c-1", description="draft")
+        self.task = tasks_of(self.client).find_one({"title": "Write report"})
+
+    def advance(self):
+        self.clock += timedelta(minutes=1)
+        return self.clock
+
+    def updated_at(self):
+        return tasks_of(self.client).find_one({"_id": self.task["_id"]})["updated_at"]
+
+    def test_create_sets_created_and_updated_at(self):
+        self.assertEqual(self.task["created_at"], self.clock)
+        self.assertEqual(self.task["updated_at"], self.clock)
+
+    def test_upsert_keeps_created_at(self):
+        created = self.clock
+        now = self.advance()
+        db.set_task(self.client, EMAIL, "Write report", "c-1", description="final")
+        task = tasks_of(self.client).find_one({"_id": self.task["_id"]})
+        self.assertEqual(task["created_at"], created)
+        self.assertEqual(task["updated_at"], now)
+
+    def test_field_writes_stamp_updated_at(self):
+        task_id = str(self.task["_id"])
+        writes = [
+            lambda: db.update_task_fields(self.client, task_id, {"duration": 30}),
+            lambda: db.set_task_description(self.client, EMAIL, task_id, "new text"),
+            lambda: db.set_task_tags(self.client, EMAIL, "Write report", ["work"]),
+            lambda: db.add_tag_to_task(self.client, EMAIL, task_id, "deep"),
+            lambda: db.remove_tag_from_task(self.client, EMAIL, task_id, "deep"),
+            lambda: db.update_task_ai_estimation(self.client, "c-1", "completed", ai_time_estimation=45),
+        ]
+        for write in writes:
+            now = self.advance()
+            write()
+            self.assertEqual(self.updated_at(), now)
+
+
+class TestIdempotentCreate(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        patcher = patch.object(db, "_generate_embedding", return_value=[0.3])
+        self.embed = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_identical_retry_is_unchanged(self):
+        self.assertEqual(db.set_task(self.client, EMAIL, "Gym", "c1", description="legs"), "created")
+        self.client.calls.clear()
+        self.assertEqual(db.set_task(self.client, EMAIL, "Gym", "c1", description="legs"), "unchanged")
+        self.assertEqual(self.client.calls, [("tasks", "find_one")])
+        self.assertEqual(self.embed.call_count, 1)
+
+    def test_changed_payload_updates_the_same_task(self):
+        db.set_task(self.client, EMAIL, "Gym", "c1", description="legs")
+        self.assertEqual(db.set_task(self.client, EMAIL, "Gym day", "c1", description="legs"), "updated")
+        [task] = tasks_of(self.client).find({"task_client_id": "c1"})
+        self.assertEqual(task["title"], "Gym day")
+        self.assertEqual(self.embed.call_count, 2)
+
+    def test_unchanged_text_reuses_embedding(self):
+        db.set_task(self.client, EMAIL, "Gym", "c1", description="legs")
+        db.set_task(self.client, EMAIL, "Gym", "c1", description="legs", duration=60)
+        self.assertEqual(self.embed.call_count, 1)
+
+    def test_same_title_with_new_client_id_is_a_new_task(self):
+        db.set_task(self.client, EMAIL, "Gym", "c1")
+        self.assertEqual(db.set_task(self.client, EMAIL, "Gym", "c2"), "created")
+        self.assertEqual(len(tasks_of(self.client).find({"title": "Gym"})), 2)
+
+
+class TestTombstones(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        patcher = patch.object(db, "_generate_embedding", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        db.set_task(self.client, EMAIL, "Task A", "c-a")
+        db.set_task(self.client, EMAIL, "Task B", "c-b")
+
+    def tombstones(self):
+        return self.client[db.DB_NAME]["task_tombstones"].find({})
+
+    def test_delete_by_title_records_tombstone(self):
+        task_id = str(tasks_of(self.client).find_one({"title": "Task A"})["_id"])
+        self.assertTrue(db.delete_task(self.client, EMAIL, "Task A"))
+        [tombstone] = self.tombstones()
+        self.assertEqual(tombstone["task_id"], task_id)
+        self.assertEqual(tombstone["task_client_id"], "c-a")
+        self.assertEqual(tombstone["email"], EMAIL)
+
+    def test_delete_by_id_records_tombstone(self):
+        task_id = str(tasks_of(self.client).find_one({"title": "Task B"})["_id"])
+        self.assertTrue(db.delete_task_by_id(self.client, task_id))
+        [tombstone] = self.tombstones()
+        self.assertEqual(tombstone["task_id"], task_id)
+
+    def test_missing_task_records_nothing(self):
+        self.assertFalse(db.delete_task(self.client, EMAIL, "Nope"))
+        self.assertEqual(self.tombstones(), [])
+
+
+class TestGetTaskChanges(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.clock = datetime(2026, 1, 1, 12, 0, 0)
+        patchers = [
+            patch.object(db, "_utcnow", side_effect=lambda: self.clock),
+            patch.object(db, "_generate_embedding", return_value=[0.5]),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        db.set_task(self.client, EMAIL, "Old", "c-old")
+        db.set_task(self.client, "other@example.com", "Theirs", "c-x")
+
+    def test_initial_sync_is_full_resync(self):
+        changes = db.get_task_changes(self.client, EMAIL)
+        self.assertTrue(changes["full_resync"])
+        self.assertEqual([t["title"] for t in changes["tasks"]], ["Old"])
+
+    def test_token_is_shifted_back_by_safety_window(self):
+        changes = db.get_task_changes(self.client, EMAIL)
+        self.assertEqual(
+            changes["sync_token"],
+            self.clock - timedelta(seconds=db.SYNC_TOKEN_SAFETY_SECONDS)
+        )
+
+    def test_write_committed_after_token_is_not_lost(self):
+        token = db.get_task_changes(self.client, EMAIL)["sync_token"]
+        # A write stamped just before the previous query but committed after it
+        self.clock -= timedelta(seconds=1)
+        db.set_task(self.client, EMAIL, "Late", "c-late")
+        self.clock += timedelta(seconds=2)
+        changes = db.get_task_changes(self.client, EMAIL, token)
+        self.assertFalse(changes["full_resync"])
+        self.assertIn("Late", [t["title"] for t in changes["tasks"]])
+
+    def test_delta_returns_changes_and_deletions_since_token(self):
+        self.clock += timedelta(minutes=10)
+        since = self.clock
+        self.clock += timedelta(minutes=1)
+        db.set_task(self.client, EMAIL, "New", "c-new")
+        db.delete_task(self.client, EMAIL, "Old")
+
+        changes = db.get_task_changes(self.client, EMAIL, since)
+        self.assertFalse(changes["full_resync"])
+        self.assertEqual([t["title"] for t in changes["tasks"]], ["New"])
+        self.assertEqual([d["task_client_id"] for d in changes["deleted"]], ["c-old"])
+        self.assertNotIn("_id", changes["deleted"][0])
+
+    def test_delta_omits_embeddings(self):
+        for since in (None, self.clock - timedelta(minutes=1)):
+            changes = db.get_task_changes(self.client, EMAIL, since)
+            self.assertTrue(changes["tasks"])
+            for task in changes["tasks"]:
+                self.assertNotIn("embedding", task)
+
+    def test_token_older_than_tombstone_retention_forces_full_resync(self):
+        since = self.clock - timedelta(days=db.TOMBSTONE_RETENTION_DAYS + 1)
+        changes = db.get_task_changes(self.client, EMAIL, since)
+        self.assertTrue(changes["full_resync"])
+        self.assertEqual(changes["deleted"], [])
+
+
+class TestSyncTokenParsing(unittest.TestCase):
+
+    def test_parses_z_suffix_as_naive_utc(self):
+        self.assertEqual(
+            main.parse_sync_token("2026-01-01T12:00:00.250Z"),
+            datetime(2026, 1, 1, 12, 0, 0, 250000)
+        )
+
+    def test_converts_offsets_to_utc(self):
+        self.assertEqual(
+            main.parse_sync_token("2026-01-01T14:00:00+02:00"),
+            datetime(2026, 1, 1, 12, 0, 0)
+        )
+
+    def test_round_trips_formatted_token(self):
+        token = datetime(2026, 1, 1, 12, 0, 0, 123000)
+        self.assertEqual(main.parse_sync_token(main.format_sync_timestamp(token)), token)
+
+    def test_rejects_garbage(self):
+        self.assertIsNone(main.parse_sync_token("yesterday"))
+
+
+class TestChangesEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        patcher = patch.object(db, "_generate_embedding", return_value=[0.5])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        previous = main.mongo_client
+        main.mongo_client = self.client
+        self.addCleanup(setattr, main, "mongo_client", previous)
+        db.set_task(self.client, EMAIL, "Old", "c-old")
+        self.http = TestClient(main.app)
+
+    def test_invalid_since_is_rejected(self):
+        response = self.http.get(f"/api/sync/{EMAIL}/tasks", params={"since": "not-a-date"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_sync_token_round_trip(self):
+        first = self.http.get(f"/api/sync/{EMAIL}/tasks").json()
+        self.assertTrue(first["full_resync"])
+        self.assertEqual(len(first["tasks"]), 1)
+        self.assertNotIn("embedding", first["tasks"][0])
+
+        db.delete_task(self.client, EMAIL, "Old")
+        second = self.http.get(
+            f"/api/sync/{EMAIL}/tasks", params={"since": first["sync_token"]}
+        ).json()
+        self.assertFalse(second["full_resync"])
+        self.assertEqual([d["task_client_id"] for d in second["deleted"]], ["c-old"])
+        self.assertTrue(second["deleted"][0]["deleted_at"].endswith("Z"))
+
+    def test_task_titled_changes_is_reachable(self):
+        db.set_task(self.client, EMAIL, "changes", "c-changes")
+        response = self.http.get(f"/api/tasks/{EMAIL}/changes")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["task_client_id"], "c-changes")
+
+
+if __name__ == "__main__":
+    unittest.main()
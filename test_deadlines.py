@@ -0,0 +1,203 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import agent_utils
+import db
+import llm_client
+import time_estimation_agent
+from deadlines import Deadline, DeadlineExceeded, EstimationJobs, JobCancelled
+from mongo_fakes import FakeClient
+from task_events import TaskEventPublisher
+from websocket_manager import ConnectionManager
+from ws_pubsub import InMemoryPubSub
+
+EMAIL = "me@example.com"
+
+
+class SlowLLM:
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def invoke(self, messages):
+        time.sleep(self.seconds)
+        return MagicMock(content="RECOMMENDATION: keep")
+
+
+class TestDeadline(unittest.TestCase):
+
+    def test_check_raises_once_expired(self):
+        deadline = Deadline(0)
+        with self.assertRaises(DeadlineExceeded) as raised:
+            deadline.check("estimate_time")
+        self.assertEqual(raised.exception.stage, "estimate_time")
+
+    def test_cancel_wins_over_expiry(self):
+        deadline = Deadline(0)
+        deadline.cancel("deleted")
+        with self.assertRaises(JobCancelled):
+            deadline.check("estimate_time")
+
+    def test_stage_records_timing_and_outcome(self):
+        deadline = Deadline(10)
+        with deadline.stage("find_similar_tasks"):
+            pass
+        with self.assertRaises(DeadlineExceeded):
+            with deadline.stage("estimate_time"):
+                raise DeadlineExceeded("estimate_time")
+        self.assertEqual(deadline.stages["find_similar_tasks"]["status"], "ok")
+        self.assertEqual(deadline.stages["estimate_time"]["status"], "timeout")
+
+
+class TestEstimationJobs(unittest.TestCase):
+
+    def setUp(self):
+        self.jobs = EstimationJobs(timeout_seconds=10)
+
+    def test_new_job_supersedes_running_one(self):
+        first = self.jobs.begin("c1")
+        second = self.jobs.begin("c1")
+        self.assertTrue(first.cancelled)
+        self.assertEqual(first.cancel_reason, "superseded")
+        self.assertFalse(second.cancelled)
+        # The superseded job finishing must not forget the newer one
+        self.jobs.finish("c1", first, JobCancelled("superseded"))
+        self.assertEqual(self.jobs.metrics()["running"], 1)
+
+    def listen(self, manager=None):
+        """Starts the jobs' cancellation hooks on a write-hook TaskEventPublisher."""
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        events = TaskEventPublisher(manager or ConnectionManager(), dict, mode="write_hook")
+        events.start(None, loop)
+        self.addCleanup(events.stop)
+        self.jobs.start(events)
+        self.addCleanup(self.jobs.stop, events)
+
+    def test_deleting_the_task_cancels_its_job(self):
+        self.listen()
+        job = self.jobs.begin("c1")
+        db._notify_task_change("deleted", {"_id": "x", "email": EMAIL, "task_client_id": "c1"})
+        self.assertTrue(job.cancelled)
+        self.assertEqual(job.cancel_reason, "deleted")
+
+    def test_editing_estimate_inputs_cancels_its_job(self):
+        self.listen()
+        client = FakeClient()
+        with patch.object(db, "_generate_embedding", return_value=None):
+            db.set_task(client, EMAIL, "Gym", "c1", duration=30)
+        task_id = str(client[db.DB_NAME]["tasks"].find_one({"title": "Gym"})["_id"])
+
+        job = self.jobs.begin("c1")
+        db.update_task_fields(client, task_id, {"start_time": "2026-03-01T09:00:00Z"})
+        db.update_task_ai_estimation(client, "c1", "success", ai_time_estimation=40)
+        self.assertFalse(job.cancelled)
+
+        db.update_task_fields(client, task_id, {"duration": 45})
+        self.assertTrue(job.cancelled)
+        self.assertEqual(job.cancel_reason, "edited")
+
+    def test_edits_on_other_workers_cancel_the_job(self):
+        class SharedPubSub(InMemoryPubSub):
+            is_local = False
+
+        async def scenario():
+            manager = ConnectionManager(SharedPubSub())
+            await manager.start()
+            self.listen(manager)
+            job = self.jobs.begin("c1")
+            # A task_event published by another worker's write hook
+            await manager._deliver_local({
+                "target": "user", "id": EMAIL, "origin": "other-worker",
+                "message": {"type": "task_event", "op": "updated", "task_id": "x",
+                            "task_client_id": "c1", "task": {}, "fields": ["description", "updated_at"]}
+            })
+            return job
+
+        job = asyncio.run(scenario())
+        self.assertEqual(job.cancel_reason, "edited")
+
+    def test_metrics_count_outcomes(self):
+        self.jobs.finish("a", self.jobs.begin("a"))
+        self.jobs.finish("b", self.jobs.begin("b"), DeadlineExceeded("estimate_time"))
+        metrics = self.jobs.metrics()
+        self.assertEqual(metrics["completed"], 1)
+        self.assertEqual(metrics["timeouts_by_stage"], {"estimate_time": 1})
+
+
+class TestDeadlineAwareCalls(unittest.TestCase):
+
+    def test_slow_llm_call_is_abandoned_at_the_deadline(self):
+        started = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            llm_client.invoke_chat(SlowLLM(1), [], Deadline(0.1), "estimate_time")
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_cancel_interrupts_the_wait(self):
+        deadline = Deadline(10)
+        threading.Timer(0.05, deadline.cancel, args=("deleted",)).start()
+        with self.assertRaises(JobCancelled):
+            llm_client.invoke_chat(SlowLLM(1), [], deadline)
+
+    def test_estimate_node_reports_timeout_instead_of_falling_back(self):
+        state = {
+            "task_title": "Gym", "task_description": "", "tag_name": "hobbies",
+            "tag_description": "", "estimated_time": 30, "historical_tasks": [],
+            "deadline": Deadline(0.1)
+        }
+        with patch.object(time_estimation_agent, "llm", SlowLLM(1)):
+            with self.assertRaises(DeadlineExceeded):
+                time_estimation_agent.estimate_time_node(state)
+        self.assertEqual(state["deadline"].stages["estimate_time"]["status"], "timeout")
+
+
+class TestRunAgentBackground(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = AsyncMock()
+        self.persist = MagicMock()
+        patchers = [
+            patch.object(agent_utils.manager, "send_personal_message", self.sent),
+            patch.object(agent_utils.db, "get_tag", return_value=None),
+            patch.object(agent_utils.db, "get_recent_tasks_with_tag", return_value=[]),
+            patch.object(agent_utils.db, "update_task_ai_estimation", self.persist),
+            patch.object(agent_utils, "MongoClient", MagicMock()),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def sent_types(self):
+        return [call.args[0]["type"] for call in self.sent.await_args_list]
+
+    def test_deleted_task_gets_no_result(self):
+        def estimate(deadline, **kwargs):
+            agent_utils.estimation_jobs.cancel("c1", "deleted")
+            deadline.check("estimate_time")
+
+        async def scenario():
+            with patch.object(agent_utils, "estimate_task_time", side_effect=estimate):
+                await agent_utils.run_agent_background("client", "c1", EMAIL, "Gym", None, ["hobbies"])
+
+        asyncio.run(scenario())
+        phases = [call.args[0].get("phase") for call in self.sent.await_args_list]
+        self.assertNotIn("final", phases)
+        self.assertNotIn("agent_error", self.sent_types())
+        self.persist.assert_not_called()
+
+    def test_timeout_reports_the_stage(self):
+        async def scenario():
+            with patch.object(agent_utils, "estimate_task_time", side_effect=DeadlineExceeded("find_similar_tasks")):
+                await agent_utils.run_agent_background("client", "c2", EMAIL, "Gym", None, ["hobbies"])
+
+        asyncio.run(scenario())
+        error = self.sent.await_args_list[-1].args[0]
+        self.assertEqual(error["type"], "agent_error")
+        self.assertEqual(error["stage"], "find_similar_tasks")
+        self.assertEqual(self.persist.call_args.kwargs["ai_estimation_status"], "error")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import agent_utils
+import db
+from mongo_fakes import FakeClient
+
+EMAIL = "me@example.com"
+
+
+def llm_result(minutes):
+    return {
+        "recommendation": "increase",
+        "suggested_minutes": minutes,
+        "reasoning": "From the LLM",
+        "confidence": "high",
+        "degraded": False,
+        "tier": "fast"
+    }
+
+
+class TestEstimationSignature(unittest.TestCase):
+
+    def test_ignores_case_whitespace_and_tag_order(self):
+        self.assertEqual(
+            db.estimation_signature("Weekly  Review", "Go over  notes", ["work", "school"], 30),
+            db.estimation_signature("weekly review ", "go over notes", ["school", "work"], 30)
+        )
+
+    def test_initial_estimate_is_part_of_the_signature(self):
+        self.assertNotEqual(
+            db.estimation_signature("Weekly review", None, ["work"], 30),
+            db.estimation_signature("Weekly review", None, ["work"], 45)
+        )
+
+
+class TestEstimationMemo(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        patcher = patch.object(db, "_generate_embedding", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_history_version_changes_with_completed_tasks_only(self):
+        before = db.get_history_version(self.client, EMAIL, ["gym"])
+        db.set_task(self.client, EMAIL, "Planned", "c-1", tag_names=["gym"], duration=30)
+        db.set_task(self.client, EMAIL, "Other", "c-2", tag_names=["work"], duration=30, is_completed=True)
+        self.assertEqual(db.get_history_version(self.client, EMAIL, ["gym"]), before)
+
+        db.set_task(self.client, EMAIL, "Done", "c-3", tag_names=["gym"], duration=45, is_completed=True)
+        self.assertNotEqual(db.get_history_version(self.client, EMAIL, ["gym"]), before)
+
+    def test_memo_hits_until_history_changes(self):
+        version = db.get_history_version(self.client, EMAIL, ["gym"])
+        db.set_estimation_memo(self.client, EMAIL, "sig", version, 60, "increase", "Because", "high")
+        self.assertEqual(db.get_estimation_memo(self.client, EMAIL, "sig", version)["ai_time_estimation"], 60)
+
+        db.set_task(self.client, EMAIL, "Done", "c-3", tag_names=["gym"], duration=45, is_completed=True)
+        new_version = db.get_history_version(self.client, EMAIL, ["gym"])
+        self.assertIsNone(db.get_estimation_memo(self.client, EMAIL, "sig", new_version))
+
+    def test_memo_is_per_user(self):
+        db.set_estimation_memo(self.client, EMAIL, "sig", "v", 60, "increase", "Because", "high")
+        self.assertIsNone(db.get_estimation_memo(self.client, "other@example.com", "sig", "v"))
+
+
+class TestMemoizedEstimation(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.client.close = lambda: None
+        self.sent = AsyncMock()
+        patchers = [
+            patch.object(db, "_generate_embedding", return_value=None),
+            patch.object(agent_utils.manager, "send_personal_message", self.sent),
+            patch.object(agent_utils, "MongoClient", return_value=self.client),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def estimate(self, result):
+        with patch.object(agent_utils, "estimate_task_time", return_value=result) as pipeline:
+            asyncio.run(agent_utils.run_agent_background(
+                "client", "c-new", EMAIL, "Weekly review", "Go over notes", ["work"], 30
+            ))
+        results = [call.args[0] for call in self.sent.await_args_list if call.args[0]["type"] == "agent_result"]
+        self.sent.reset_mock()
+        return pipeline, results
+
+    def test_repeat_task_reuses_the_estimate(self):
+        pipeline, _ = self.estimate(llm_result(60))
+        pipeline.assert_called_once()
+
+        pipeline, results = self.estimate(llm_result(90))
+        pipeline.assert_not_called()
+        self.assertEqual([(r["phase"], r["tier"], r["duration"]) for r in results], [("final", "memo", 60)])
+
+    def test_completed_task_with_the_tag_invalidates(self):
+        self.estimate(llm_result(60))
+        db.set_task(self.client, EMAIL, "Review", "c-old", tag_names=["work"], duration=75, is_completed=True)
+
+        pipeline, results = self.estimate(llm_result(90))
+        pipeline.assert_called_once()
+        self.assertEqual(results[-1]["duration"], 90)
+
+    def test_degraded_results_are_not_memoized(self):
+        self.estimate({**llm_result(60), "degraded": True})
+        pipeline, _ = self.estimate(llm_result(60))
+        pipeline.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+from unittest.mock import patch
+
+from langchain_core.messages import AIMessage
+
+import time_estimation_agent as tea
+from time_estimation_agent import ModelTier, route_estimation
+
+CONSISTENT = [{"duration": 60}, {"duration": 55}, {"duration": 65}]
+SCATTERED = [{"duration": 10}, {"duration": 60}, {"duration": 180}]
+
+
+class FakeLLM:
+    def __init__(self):
+        self.calls = 0
+
+    def invoke(self, messages):
+        self.calls += 1
+        return AIMessage(
+            content="RECOMMENDATION: increase\nSUGGESTED_TIME: 75 minutes\nCONFIDENCE: high",
+            usage_metadata={"input_tokens": 1000, "output_tokens": 100, "total_tokens": 1100}
+        )
+
+
+class TestRouteEstimation(unittest.TestCase):
+
+    def test_consistent_history_and_short_description_skip_the_llm(self):
+        self.assertEqual(route_estimation("Gym", CONSISTENT), "none")
+
+    def test_scattered_history_goes_to_fast_tier(self):
+        self.assertEqual(route_estimation("Gym", SCATTERED), "fast")
+
+    def test_short_description_without_history_goes_to_fast_tier(self):
+        self.assertEqual(route_estimation("Read Book", []), "fast")
+
+    def test_long_description_without_history_goes_to_standard_tier(self):
+        self.assertEqual(route_estimation("x" * 200, []), "standard")
+
+    def test_long_description_with_history_goes_to_fast_tier(self):
+        self.assertEqual(route_estimation("x" * 200, CONSISTENT), "fast")
+
+    def test_routing_can_be_disabled(self):
+        with patch.object(tea, "ESTIMATION_ROUTING", False):
+            self.assertEqual(route_estimation("Gym", CONSISTENT), "standard")
+
+
+class TestTieredGraph(unittest.TestCase):
+
+    def run_graph(self, history, description="Gym"):
+        tiers = {
+            "none": ModelTier("none"),
+            "fast": ModelTier("fast", "fast-model", 0.10, 0.40),
+            "standard": ModelTier("standard", "standard-model", 0.30, 2.50),
+        }
+        fast_llm = FakeLLM()
+        tiers["fast"]._llm = fast_llm
+        with patch.object(tea, "embed_query_node", return_value={"query_embedding": None}), \
+                patch.object(tea, "find_similar_tasks_node", return_value={"tag_results": history}), \
+                patch.object(tea, "ESTIMATION_TIERS", tiers), \
+                patch.object(tea, "llm", FakeLLM()) as standard_llm:
+            result = tea.build_time_estimation_graph().invoke({
+                "id": "c1", "task_title": "Gym", "task_description": description, "tag_name": "hobbies",
+                "tag_description": "", "email": "me@example.com", "estimated_time": 30,
+                "deadline": None, "similar_tags": [], "historical_tasks": [], "messages": []
+            })
+        return result, tiers, fast_llm, standard_llm
+
+    def test_none_tier_answers_from_history(self):
+        result, tiers, fast_llm, standard_llm = self.run_graph(CONSISTENT)
+        self.assertEqual(result["tier"], "none")
+        self.assertEqual(result["suggested_minutes"], 60)
+        self.assertEqual(fast_llm.calls + standard_llm.calls, 0)
+        self.assertEqual(tiers["none"].metrics()["requests"], 1)
+
+    def test_fast_tier_uses_its_own_model_and_accounts_cost(self):
+        result, tiers, fast_llm, standard_llm = self.run_graph(SCATTERED)
+        self.assertEqual(result["tier"], "fast")
+        self.assertEqual(result["suggested_minutes"], 75)
+        self.assertEqual((fast_llm.calls, standard_llm.calls), (1, 0))
+        metrics = tiers["fast"].metrics()
+        self.assertEqual((metrics["input_tokens"], metrics["output_tokens"]), (1000, 100))
+        self.assertAlmostEqual(metrics["estimated_cost_usd"], 0.00014)
+
+    def test_standard_tier_uses_the_shared_llm(self):
+        result, _, fast_llm, standard_llm = self.run_graph([], description="x" * 200)
+        self.assertEqual(result["tier"], "standard")
+        self.assertEqual((fast_llm.calls, standard_llm.calls), (0, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,204 @@
+import asyncio
+import itertools
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from langchain_core.messages import AIMessageChunk
+
+import llm_client
+from llm_client import HedgePolicy
+
+
+class ScriptedLLM:
+    """Each invoke() sleeps for the next scripted delay, then answers with its call number."""
+
+    def __init__(self, *delays):
+        self.delays = iter(delays)
+        self.counter = itertools.count(1)
+
+    def invoke(self, messages):
+        call, delay = next(self.counter), next(self.delays)
+        time.sleep(delay)
+        return call
+
+
+class ScriptedStreamLLM:
+    """Each stream waits for the next scripted delay, then streams "call <number>"."""
+
+    def __init__(self, *delays):
+        self.delays = iter(delays)
+        self.counter = itertools.count(1)
+        self.closed = []
+
+    def stream(self, messages):
+        call, delay = next(self.counter), next(self.delays)
+        try:
+            time.sleep(delay)
+            for part in ("call ", str(call)):
+                yield AIMessageChunk(content=part)
+        finally:
+            self.closed.append(call)
+
+    async def astream(self, messages):
+        call, delay = next(self.counter), next(self.delays)
+        try:
+            await asyncio.sleep(delay)
+            for part in ("call ", str(call)):
+                yield AIMessageChunk(content=part)
+        finally:
+            self.closed.append(call)
+
+
+class FailingLLM:
+    def invoke(self, messages):
+        raise RuntimeError("provider error")
+
+
+def warmed_policy(latency=0.05, budget=10):
+    policy = HedgePolicy(enabled=True, percentile=95, min_samples=5, budget_per_minute=budget)
+    for _ in range(5):
+        policy.record(latency)
+    return policy
+
+
+class TestHedgePolicy(unittest.TestCase):
+
+    def test_no_delay_until_warmed_up(self):
+        policy = HedgePolicy(enabled=True, min_samples=3)
+        policy.record(0.1)
+        self.assertIsNone(policy.delay())
+
+    def test_delay_is_the_percentile(self):
+        policy = HedgePolicy(enabled=True, percentile=95, min_samples=1)
+        for ms in range(1, 101):
+            policy.record(ms / 1000)
+        self.assertAlmostEqual(policy.delay(), 0.096)
+
+    def test_disabled_policy_never_hedges(self):
+        policy = HedgePolicy(enabled=False, min_samples=1)
+        policy.record(0.1)
+        self.assertIsNone(policy.delay())
+
+    def test_budget_is_per_minute(self):
+        policy = HedgePolicy(enabled=True, budget_per_minute=2)
+        self.assertTrue(policy.try_spend())
+        self.assertTrue(policy.try_spend())
+        self.assertFalse(policy.try_spend())
+        self.assertEqual(policy.metrics()["budget_exhausted"], 1)
+
+    def test_in_flight_hedges_are_capped(self):
+        policy = HedgePolicy(enabled=True, max_in_flight=1)
+        self.assertTrue(policy.try_spend())
+        self.assertFalse(policy.try_spend())
+        policy.hedge_done()
+        self.assertTrue(policy.try_spend())
+        self.assertEqual(policy.metrics()["in_flight_limited"], 1)
+
+    def test_counters_are_thread_safe(self):
+        policy = HedgePolicy(enabled=True)
+
+        def count():
+            for _ in range(2000):
+                policy.count_call()
+                policy.count_win()
+
+        threads = [threading.Thread(target=count) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((policy.calls, policy.hedge_wins), (16000, 16000))
+
+
+class TestHedgedCalls(unittest.TestCase):
+
+    def invoke(self, llm, policy):
+        with patch.object(llm_client, "chat_hedging", policy):
+            started = time.monotonic()
+            result = llm_client.invoke_chat(llm, [])
+            return result, time.monotonic() - started
+
+    def test_slow_call_is_hedged_and_hedge_wins(self):
+        policy = warmed_policy()
+        result, elapsed = self.invoke(ScriptedLLM(1.0, 0.01), policy)
+        self.assertEqual(result, 2)
+        self.assertLess(elapsed, 0.5)
+        metrics = policy.metrics()
+        self.assertEqual((metrics["hedges"], metrics["hedge_wins"]), (1, 1))
+
+    def test_losing_hedge_stays_in_flight_until_it_finishes(self):
+        policy = warmed_policy()
+        result, _ = self.invoke(ScriptedLLM(0.2, 0.5), policy)
+        self.assertEqual(result, 1)
+        self.assertEqual(policy.metrics()["in_flight"], 1)
+        time.sleep(0.5)
+        self.assertEqual(policy.metrics()["in_flight"], 0)
+
+    def test_fast_call_is_not_hedged(self):
+        policy = warmed_policy(latency=0.5)
+        result, _ = self.invoke(ScriptedLLM(0.01), policy)
+        self.assertEqual(result, 1)
+        self.assertEqual(policy.metrics()["hedges"], 0)
+
+    def test_exhausted_budget_waits_for_the_original(self):
+        policy = warmed_policy(budget=0)
+        result, _ = self.invoke(ScriptedLLM(0.2), policy)
+        self.assertEqual(result, 1)
+        self.assertEqual(policy.metrics()["hedges"], 0)
+
+    def test_failures_are_not_retried(self):
+        policy = warmed_policy()
+        with patch.object(llm_client, "chat_hedging", policy):
+            with self.assertRaises(RuntimeError):
+                llm_client.invoke_chat(FailingLLM(), [])
+        self.assertEqual(policy.metrics()["hedges"], 0)
+
+
+class TestHedgedStreams(unittest.TestCase):
+
+    def stream(self, llm, policy):
+        deltas = []
+        with patch.object(llm_client, "stream_hedging", policy):
+            started = time.monotonic()
+            response = llm_client.stream_chat(llm, [], deltas.append)
+            return response, deltas, time.monotonic() - started
+
+    def test_slow_first_chunk_is_hedged_and_hedge_wins(self):
+        policy = warmed_policy()
+        response, deltas, elapsed = self.stream(ScriptedStreamLLM(1.0, 0.01), policy)
+        self.assertEqual((response.content, deltas), ("call 2", ["call ", "2"]))
+        self.assertLess(elapsed, 0.5)
+        metrics = policy.metrics()
+        self.assertEqual((metrics["hedges"], metrics["hedge_wins"]), (1, 1))
+
+    def test_losing_stream_is_closed_at_its_first_chunk(self):
+        policy = warmed_policy()
+        llm = ScriptedStreamLLM(0.2, 0.3)
+        response, deltas, _ = self.stream(llm, policy)
+        self.assertEqual((response.content, deltas), ("call 1", ["call ", "1"]))
+        self.assertEqual(policy.metrics()["in_flight"], 1)
+        time.sleep(0.4)
+        self.assertEqual(llm.closed, [1, 2])
+        self.assertEqual(policy.metrics()["in_flight"], 0)
+
+    def test_async_stream_keeps_whichever_yields_first(self):
+        async def collect(llm):
+            return [chunk.content async for chunk in llm_client.astream_chat(llm, [])]
+
+        policy = warmed_policy()
+        llm = ScriptedStreamLLM(1.0, 0.01)
+        with patch.object(llm_client, "stream_hedging", policy):
+            started = time.monotonic()
+            chunks = asyncio.run(collect(llm))
+        self.assertEqual(chunks, ["call ", "2"])
+        self.assertLess(time.monotonic() - started, 0.5)
+        # The slow stream was closed as soon as the hedge yielded
+        self.assertEqual(sorted(llm.closed), [1, 2])
+        metrics = policy.metrics()
+        self.assertEqual((metrics["hedges"], metrics["hedge_wins"], metrics["in_flight"]), (1, 1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
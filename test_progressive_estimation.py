@@ -0,0 +1,84 @@
+import asyncio
+import unittest
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import agent_utils
+import db
+from mongo_fakes import FakeClient
+
+EMAIL = "me@example.com"
+
+
+def llm_result(minutes, recommendation):
+    return {
+        "recommendation": recommendation,
+        "suggested_minutes": minutes,
+        "reasoning": "From the LLM",
+        "confidence": "high",
+        "similar_tags_found": 0,
+        "historical_tasks_analyzed": 3,
+        "degraded": False
+    }
+
+
+class TestProgressiveEstimation(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = AsyncMock()
+        self.persist = MagicMock()
+        history = [{"title": "Run", "duration": 40}, {"title": "Swim", "duration": 60}, {"title": "Lift", "duration": 50}]
+        patchers = [
+            patch.object(agent_utils.manager, "send_personal_message", self.sent),
+            patch.object(agent_utils.db, "get_tag", return_value=None),
+            patch.object(agent_utils.db, "get_recent_tasks_with_tag", return_value=history),
+            patch.object(agent_utils.db, "update_task_ai_estimation", self.persist),
+            patch.object(agent_utils, "MongoClient", MagicMock()),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_with(self, result):
+        async def scenario():
+            with patch.object(agent_utils, "estimate_task_time", return_value=result):
+                await agent_utils.run_agent_background("client", "c1", EMAIL, "Gym", None, ["hobbies"], 30)
+        asyncio.run(scenario())
+        return [call.args[0] for call in self.sent.await_args_list if call.args[0]["type"] == "agent_result"]
+
+    def test_provisional_result_comes_from_history_median(self):
+        results = self.run_with(llm_result(90, "increase"))
+        self.assertEqual(results[0]["phase"], "provisional")
+        self.assertEqual(results[0]["duration"], 50)
+        self.assertEqual(results[0]["historical_tasks_analyzed"], 3)
+
+    def test_refined_result_is_pushed_when_it_differs(self):
+        results = self.run_with(llm_result(90, "increase"))
+        self.assertEqual([r["phase"] for r in results], ["provisional", "final"])
+        self.assertEqual(results[1]["duration"], 90)
+        self.assertEqual(self.persist.call_args.kwargs["ai_time_estimation"], 90)
+
+    def test_refined_result_is_skipped_when_it_agrees(self):
+        results = self.run_with(llm_result(50, "increase"))
+        self.assertEqual([r["phase"] for r in results], ["provisional"])
+        # The LLM's reasoning is still what gets stored
+        self.assertEqual(self.persist.call_args.kwargs["ai_reasoning"], "From the LLM")
+
+
+class TestRecentTasksWithTag(unittest.TestCase):
+
+    def test_returns_latest_durations_for_the_tag(self):
+        client = FakeClient()
+        with patch.object(db, "_generate_embedding", return_value=None):
+            db.set_task(client, EMAIL, "Old", "c-old", tag_names=["gym"], duration=20)
+            db.set_task(client, EMAIL, "New", "c-new", tag_names=["gym"], duration=40)
+            db.set_task(client, EMAIL, "Self", "c-self", tag_names=["gym"], duration=99)
+            db.set_task(client, EMAIL, "Other tag", "c-x", tag_names=["work"], duration=60)
+        client[db.DB_NAME]["tasks"].update_one({"task_client_id": "c-new"}, {"$set": {"updated_at": datetime(2099, 1, 1)}})
+
+        recent = db.get_recent_tasks_with_tag(client, EMAIL, "gym", exclude_task_client_id="c-self", limit=1)
+        self.assertEqual(recent, [{"title": "New", "duration": 40}])
+
+
+if __name__ == "__main__":
+    unittest.main()
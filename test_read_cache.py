@@ -0,0 +1,99 @@
+import unittest
+from unittest.mock import patch
+
+import db
+from mongo_fakes import FakeClient
+
+EMAIL = "me@example.com"
+
+
+class TestReadCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = db.ReadCache(max_entries=2, ttl_seconds=60)
+
+    def test_caches_none(self):
+        self.cache.put(("user", EMAIL), None)
+        self.assertIsNone(self.cache.get(("user", EMAIL)))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put(("a",), 1)
+        self.cache.put(("b",), 2)
+        self.cache.get(("a",))
+        self.cache.put(("c",), 3)
+        self.assertIs(self.cache.get(("b",)), db._MISSING)
+        self.assertEqual(self.cache.get(("a",)), 1)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_entries_expire(self):
+        with patch.object(db.time, "monotonic", return_value=1000.0):
+            self.cache.put(("a",), 1)
+        with patch.object(db.time, "monotonic", return_value=1061.0):
+            self.assertIs(self.cache.get(("a",)), db._MISSING)
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_disabled_cache_stores_nothing(self):
+        cache = db.ReadCache(max_entries=2, ttl_seconds=60, enabled=False)
+        cache.put(("a",), 1)
+        self.assertIs(cache.get(("a",)), db._MISSING)
+
+
+class TestCachedReads(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        db.read_cache.clear()
+        self.addCleanup(db.read_cache.clear)
+        patcher = patch.object(db, "_generate_tag_embedding", return_value=[0.1])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        db.set_user(self.client, EMAIL, "student")
+        db.set_tag(self.client, EMAIL, "work", "Work stuff")
+        self.client.calls.clear()
+
+    def reads(self):
+        return [call for call in self.client.calls if call[1].startswith("find")]
+
+    def test_repeated_reads_hit_the_cache(self):
+        for _ in range(3):
+            self.assertEqual(db.get_tag(self.client, EMAIL, "work")["tag_description"], "Work stuff")
+            self.assertEqual(db.get_tag_description(self.client, EMAIL, "work"), "Work stuff")
+            self.assertEqual(db.get_user_description(self.client, EMAIL), "student")
+            self.assertEqual(len(db.get_all_tags_for_user(self.client, EMAIL)), 1)
+        self.assertEqual(self.reads(), [("tags", "find_one"), ("users", "find_one"), ("tags", "find")])
+
+    def test_returned_documents_are_copies(self):
+        db.get_tag(self.client, EMAIL, "work")["_id"] = "mutated"
+        db.get_all_tags_for_user(self.client, EMAIL)[0]["_id"] = "mutated"
+        self.assertNotEqual(db.get_tag(self.client, EMAIL, "work")["_id"], "mutated")
+        self.assertNotEqual(db.get_all_tags_for_user(self.client, EMAIL)[0]["_id"], "mutated")
+
+    def test_tag_writes_invalidate(self):
+        db.get_tag(self.client, EMAIL, "work")
+        db.get_all_tags_for_user(self.client, EMAIL)
+
+        db.set_tag_description(self.client, EMAIL, "work", "Job stuff")
+        self.assertEqual(db.get_tag_description(self.client, EMAIL, "work"), "Job stuff")
+
+        db.set_tag(self.client, EMAIL, "school", "Classes")
+        self.assertEqual(len(db.get_all_tags_for_user(self.client, EMAIL)), 2)
+
+        db.delete_tag(self.client, EMAIL, "work")
+        self.assertIsNone(db.get_tag(self.client, EMAIL, "work"))
+        self.assertEqual(len(db.get_all_tags_for_user(self.client, EMAIL)), 1)
+
+    def test_user_writes_invalidate(self):
+        self.assertIsNone(db.get_user(self.client, "new@example.com"))
+        db.set_user(self.client, "new@example.com")
+        self.assertIsNotNone(db.get_user(self.client, "new@example.com"))
+
+        db.set_user_description(self.client, EMAIL, "teacher")
+        self.assertEqual(db.get_user_description(self.client, EMAIL), "teacher")
+
+        db.delete_user(self.client, EMAIL)
+        self.assertIsNone(db.get_user(self.client, EMAIL))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from bson import ObjectId
+
+import time_estimation_agent as tea
+
+RESULTS = {
+    "work": [{"_id": "a", "duration": 60, "score": 0.9}, {"_id": "b", "duration": 60, "score": 0.5}],
+    "school": [{"_id": "c", "duration": 60, "score": 0.8}, {"_id": "b", "duration": 60, "score": 0.7}],
+    "hobbies": [{"_id": "d", "duration": 60, "score": 0.6}, {"_id": "e", "duration": 60, "score": 0.1}],
+}
+
+
+class TestTagFanOut(unittest.TestCase):
+
+    def run_graph(self, tag_names, embedding=(1.0,), delay=0.0):
+        searched = []
+        lock = threading.Lock()
+
+        def search(state, query_embedding):
+            with lock:
+                searched.append(state["tag_name"])
+            time.sleep(delay)
+            return [dict(task) for task in RESULTS[state["tag_name"]]]
+
+        def recent(state):
+            with lock:
+                searched.append(state["tag_name"])
+            return [{"task_client_id": f"{state['tag_name']}-{i}", "duration": 60} for i in range(2)]
+
+        with patch.object(tea, "embed_query_node", return_value={"query_embedding": embedding and list(embedding)}), \
+                patch.object(tea, "_vector_search", side_effect=search), \
+                patch.object(tea, "_recent_tasks_with_tag", side_effect=recent):
+            result = tea.build_time_estimation_graph().invoke({
+                "id": "c1", "task_title": "Gym", "task_description": "Gym", "tag_name": tag_names[0],
+                "tag_names": tag_names, "tag_description": "", "email": "me@example.com", "estimated_time": 30,
+                "deadline": None, "similar_tags": [], "tag_results": [], "historical_tasks": [], "messages": []
+            })
+        return result, searched
+
+    def test_searches_every_tag_once(self):
+        _, searched = self.run_graph(["work", "school", "hobbies", "work"])
+        self.assertEqual(sorted(searched), ["hobbies", "school", "work"])
+
+    def test_merge_keeps_top_k_by_score_without_duplicates(self):
+        result, _ = self.run_graph(["work", "school", "hobbies"])
+        self.assertEqual([task["_id"] for task in result["historical_tasks"]], ["a", "c", "b", "d"])
+        self.assertEqual(result["historical_tasks"][2]["score"], 0.7)
+
+    def test_searches_run_in_parallel(self):
+        started = time.monotonic()
+        self.run_graph(["work", "school", "hobbies"], delay=0.3)
+        self.assertLess(time.monotonic() - started, 0.8)
+
+    def test_without_embedding_each_tag_uses_recent_tasks(self):
+        result, searched = self.run_graph(["work", "school"], embedding=None)
+        self.assertEqual(sorted(searched), ["school", "work"])
+        self.assertEqual(len(result["historical_tasks"]), 4)
+
+
+class TestVectorSearch(unittest.TestCase):
+
+    def test_runs_a_scored_vector_search_aggregate(self):
+        task_id = ObjectId()
+        collection = MagicMock()
+        collection.aggregate.return_value = iter([
+            {"_id": task_id, "description": "Lift", "duration": 45, "score": 0.8},
+            {"_id": ObjectId(), "duration": 10, "score": 0.5},
+        ])
+        with patch.object(tea, "collection", collection):
+            tasks = tea._vector_search({"tag_name": "gym", "id": "c1", "deadline": None}, [0.1, 0.2])
+
+        self.assertEqual(tasks, [{"_id": str(task_id), "description": "Lift", "duration": 45, "score": 0.8}])
+        pipeline = collection.aggregate.call_args.args[0]
+        search = pipeline[0]["$vectorSearch"]
+        self.assertEqual(search["queryVector"], [0.1, 0.2])
+        self.assertEqual(search["limit"], tea.SIMILAR_TASKS_K)
+        self.assertEqual(search["filter"]["$and"][0], {"tag_names": {"$eq": "gym"}})
+        self.assertEqual(pipeline[1], {"$set": {"score": {"$meta": "vectorSearchScore"}}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import db
+import main
+from mongo_fakes import FakeClient
+
+EMAIL = "new@example.com"
+
+
+def fake_embeddings(texts):
+    return [[float(len(text))] for text in texts]
+
+
+class TestTagTemplates(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        db.read_cache.clear()
+        self.addCleanup(db.read_cache.clear)
+
+    def tags(self):
+        return {t["tag_name"]: t for t in self.client[db.DB_NAME]["tags"].find({"email": EMAIL})}
+
+    def test_templates_are_embedded_once(self):
+        with patch.object(db, "_generate_embeddings", side_effect=fake_embeddings) as embed:
+            self.assertEqual(db.ensure_tag_templates(self.client), len(db.DEFAULT_TAG_TEMPLATES))
+            self.assertEqual(db.ensure_tag_templates(self.client), 0)
+        self.assertEqual(embed.call_count, 1)
+
+    def test_changed_description_is_re_embedded(self):
+        with patch.object(db, "_generate_embeddings", side_effect=fake_embeddings):
+            db.ensure_tag_templates(self.client)
+        changed = [("work", "Paid work")] + db.DEFAULT_TAG_TEMPLATES[1:]
+        with patch.object(db, "DEFAULT_TAG_TEMPLATES", changed), \
+                patch.object(db, "_generate_embeddings", side_effect=fake_embeddings) as embed:
+            self.assertEqual(db.ensure_tag_templates(self.client), 1)
+            embed.assert_called_once_with(["Paid work"])
+
+    def test_default_tags_use_stored_embeddings(self):
+        with patch.object(db, "_generate_embeddings", side_effect=fake_embeddings):
+            db.ensure_tag_templates(self.client)
+        self.client.calls.clear()
+        with patch.object(db, "_generate_embedding") as embed:
+            self.assertEqual(db.create_default_tags(self.client, EMAIL), 3)
+        embed.assert_not_called()
+        self.assertIn(("tags", "bulk_write"), self.client.calls)
+        work = self.tags()["work"]
+        self.assertEqual(work["tag_description"], "Work related tasks and projects")
+        self.assertEqual(work["embedding"], [31.0])
+
+    def test_existing_tags_are_not_overwritten(self):
+        with patch.object(db, "_generate_tag_embedding", return_value=[9.0]):
+            db.set_tag(self.client, EMAIL, "work", "My own work tag")
+        db.create_default_tags(self.client, EMAIL)
+        self.assertEqual(self.tags()["work"]["tag_description"], "My own work tag")
+        self.assertEqual(len(self.tags()), 3)
+
+    def test_tags_created_before_templates_are_backfilled(self):
+        db.create_default_tags(self.client, EMAIL)
+        self.assertNotIn("embedding", self.tags()["school"])
+        db.read_cache.clear()
+        with patch.object(db, "_generate_embeddings", side_effect=fake_embeddings):
+            db.ensure_tag_templates(self.client)
+        self.assertEqual(self.tags()["school"]["embedding"], [42.0])
+
+
+class TestSignUp(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        db.read_cache.clear()
+        self.addCleanup(db.read_cache.clear)
+        previous = main.mongo_client
+        main.mongo_client = self.client
+        self.addCleanup(setattr, main, "mongo_client", previous)
+        with patch.object(db, "_generate_embeddings", side_effect=fake_embeddings):
+            db.ensure_tag_templates(self.client)
+        self.http = TestClient(main.app)
+
+    def test_sign_up_does_not_call_the_embedding_provider(self):
+        with patch.object(db, "_get_embeddings_model", side_effect=AssertionError("provider called")):
+            response = self.http.post("/api/users", json={"email": EMAIL})
+        self.assertEqual(response.status_code, 201)
+        tags = self.client[db.DB_NAME]["tags"].find({"email": EMAIL})
+        self.assertEqual(sorted(t["tag_name"] for t in tags), ["hobbies", "school", "work"])
+
+
+if __name__ == "__main__":
+    unittest.main()
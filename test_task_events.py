@@ -0,0 +1,123 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import db
+from mongo_fakes import FakeClient
+from task_events import TaskEventPublisher
+from websocket_manager import ConnectionManager
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        self.sent.append(message)
+
+
+class TestTaskEvents(unittest.TestCase):
+
+    def test_write_hook_fans_out_to_user_connections(self):
+        async def scenario():
+            manager = ConnectionManager()
+            tab_a, tab_b, other_user = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+            await manager.connect(tab_a, "tab-a", "me@example.com")
+            await manager.connect(tab_b, "tab-b", "me@example.com")
+            await manager.connect(other_user, "tab-c", "other@example.com")
+
+            publisher = TaskEventPublisher(manager, lambda task: {**task, "_id": str(task["_id"])}, mode="write_hook")
+            publisher.start(None, asyncio.get_running_loop())
+            try:
+                db._notify_task_change("updated", {"_id": 1, "email": "me@example.com", "title": "Gym"})
+                db._notify_task_change("deleted", {"_id": 2, "email": "me@example.com", "task_client_id": "c2"})
+                await asyncio.sleep(0.05)
+            finally:
+                publisher.stop()
+            return tab_a, tab_b, other_user
+
+        tab_a, tab_b, other_user = asyncio.run(scenario())
+
+        self.assertEqual(tab_a.sent, tab_b.sent)
+        self.assertEqual(len(tab_a.sent), 2)
+        self.assertEqual(tab_a.sent[0]["type"], "task_event")
+        self.assertEqual(tab_a.sent[0]["op"], "updated")
+        self.assertEqual(tab_a.sent[0]["task"]["title"], "Gym")
+        self.assertIsNone(tab_a.sent[0]["fields"])
+        self.assertEqual(tab_a.sent[1]["op"], "deleted")
+        self.assertEqual(tab_a.sent[1]["task_id"], "2")
+        self.assertIsNone(tab_a.sent[1]["task"])
+        self.assertEqual(other_user.sent, [])
+
+    def test_stop_unregisters_write_hook(self):
+        loop = asyncio.new_event_loop()
+        publisher = TaskEventPublisher(ConnectionManager(), dict, mode="write_hook")
+        publisher.start(None, loop)
+        self.assertIn(publisher.publish, db._task_change_listeners)
+        publisher.stop()
+        self.assertNotIn(publisher.publish, db._task_change_listeners)
+        loop.close()
+
+
+class TestWriteHookEvents(unittest.TestCase):
+    """Write hooks build events from the write's own result, without re-reading the task."""
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.events = []
+        listener = lambda op, task, fields: self.events.append((op, task))
+        db.add_task_change_listener(listener)
+        self.addCleanup(db.remove_task_change_listener, listener)
+        patchers = [
+            patch.object(db, "_generate_embedding", return_value=[0.1]),
+            patch.object(db, "_generate_embeddings", side_effect=lambda texts: [[0.1]] * len(texts)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_writes_do_not_read_the_task_back(self):
+        db.set_task(self.client, "me@example.com", "Gym", "c1")
+        task_id = str(self.events[0][1]["_id"])
+        db.set_task_tags(self.client, "me@example.com", task_id, ["health"])
+        db.update_task_ai_estimation(self.client, "c1", "success", ai_time_estimation=40)
+        db.delete_task_by_id(self.client, task_id)
+
+        self.assertEqual([call for call in self.client.calls if call[0] == "tasks"], [
+            # set_task's idempotency check, then the write itself
+            ("tasks", "find_one"),
+            ("tasks", "find_one_and_update"),
+            ("tasks", "find_one_and_update"),
+            ("tasks", "find_one_and_update"),
+            ("tasks", "find_one_and_delete"),
+        ])
+        self.assertEqual([op for op, _ in self.events], ["created", "updated", "updated", "deleted"])
+        self.assertEqual(self.events[1][1]["tag_names"], ["health"])
+        self.assertEqual(self.events[2][1]["ai_time_estimation"], 40)
+        for _, task in self.events:
+            self.assertNotIn("embedding", task)
+
+    def test_bulk_write_reads_back_once(self):
+        db.set_tasks_bulk(self.client, [
+            {"email": "me@example.com", "title": "A", "task_client_id": "a"},
+            {"email": "me@example.com", "title": "B", "task_client_id": "b"},
+            {"email": "other@example.com", "title": "A", "task_client_id": "oa"},
+        ])
+        # Idempotency lookup, the write, and one read-back for the events
+        self.assertEqual(self.client.calls, [("tasks", "find"), ("tasks", "bulk_write"), ("tasks", "find")])
+        self.assertEqual(
+            sorted((task["email"], task["title"]) for _, task in self.events),
+            [("me@example.com", "A"), ("me@example.com", "B"), ("other@example.com", "A")]
+        )
+
+    def test_no_listeners_no_read_back(self):
+        db.remove_task_change_listener(db._task_change_listeners[-1])
+        db.set_tasks_bulk(self.client, [{"email": "me@example.com", "title": "A", "task_client_id": "a"}])
+        self.assertEqual(self.client.calls, [("tasks", "find"), ("tasks", "bulk_write")])
+
+
+if __name__ == "__main__":
+    unittest.main()
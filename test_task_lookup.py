@@ -0,0 +1,79 @@
+import unittest
+from unittest.mock import patch
+
+import db
+from mongo_fakes import FakeClient
+
+EMAIL = "me@example.com"
+
+
+class TestIdOrTitleLookup(unittest.TestCase):
+    """Task helpers take an _id or a title and must resolve it in one round trip."""
+
+    def setUp(self):
+        self.client = FakeClient()
+        patcher = patch.object(db, "_generate_embedding", return_value=[0.1])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        db.set_task(self.client, EMAIL, "Write report", "c-1", description="draft", tag_names=["work"])
+        self.task_id = str(self.client[db.DB_NAME]["tasks"].find_one({"title": "Write report"})["_id"])
+        self.client.calls.clear()
+
+    def assert_one_round_trip(self, operation):
+        for identifier in (self.task_id, "Write report"):
+            self.client.calls.clear()
+            operation(identifier)
+            self.assertEqual(len(self.client.calls), 1, self.client.calls)
+
+    def test_reads_take_one_query(self):
+        self.assert_one_round_trip(lambda i: self.assertEqual(
+            db.get_task_description(self.client, EMAIL, i), "draft"))
+        self.assert_one_round_trip(lambda i: self.assertEqual(
+            db.get_task_tags(self.client, EMAIL, i), ["work"]))
+
+    def test_writes_take_one_query(self):
+        self.assert_one_round_trip(lambda i: self.assertTrue(
+            db.set_task_tags(self.client, EMAIL, i, ["home"])))
+        self.assert_one_round_trip(lambda i: self.assertTrue(
+            db.add_tag_to_task(self.client, EMAIL, i, "deep")))
+        self.assert_one_round_trip(lambda i: self.assertTrue(
+            db.remove_tag_from_task(self.client, EMAIL, i, "deep")))
+
+    def test_description_write_takes_one_query(self):
+        self.assert_one_round_trip(lambda i: self.assertTrue(
+            db.set_task_description(self.client, EMAIL, i, "final")))
+
+    def test_delete_by_id_and_title_take_one_query(self):
+        self.client.calls.clear()
+        self.assertTrue(db.delete_task(self.client, EMAIL, self.task_id))
+        self.assertEqual(
+            [call for call in self.client.calls if call[0] == "tasks"],
+            [("tasks", "find_one_and_delete")]
+        )
+
+    def test_title_that_is_not_an_object_id_still_resolves(self):
+        self.assertTrue(db.add_tag_to_task(self.client, EMAIL, "Write report", "focus"))
+        self.assertIn("focus", db.get_task_tags(self.client, EMAIL, "Write report"))
+
+    def test_other_users_task_is_not_resolved(self):
+        self.assertIsNone(db.get_task_description(self.client, "other@example.com", self.task_id))
+        self.assertFalse(db.set_task_tags(self.client, "other@example.com", self.task_id, ["x"]))
+
+    def test_return_document_returns_updated_task(self):
+        task = db.add_tag_to_task(self.client, EMAIL, self.task_id, "deep", return_document=True)
+        self.assertIn("deep", task["tag_names"])
+        self.assertNotIn("embedding", task)
+        self.assertIsNone(db.set_task_tags(self.client, EMAIL, "Missing", ["x"], return_document=True))
+        task = db.update_task_fields(self.client, self.task_id, {"duration": 15}, return_document=True)
+        self.assertEqual(task["duration"], 15)
+
+    def test_description_write_on_id_path_updates_embedding(self):
+        with patch.object(db, "_generate_embedding", return_value=[0.9]):
+            db.set_task_description(self.client, EMAIL, self.task_id, "final")
+        stored = self.client[db.DB_NAME]["tasks"].find_one({"title": "Write report"})
+        self.assertEqual(stored["description"], "final")
+        self.assertEqual(stored["embedding"], [0.9])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+import agent_utils
+import llm_client
+import search_agent
+import time_estimation_agent as tea
+from deadlines import Deadline
+from task_time_estimator import estimate_task_time
+
+EMAIL = "me@example.com"
+ESTIMATE_TEXT = "RECOMMENDATION: increase\nSUGGESTED_TIME: 75 minutes\nCONFIDENCE: high\nREASONING: Longer than usual."
+SCATTERED = [{"title": "Run", "duration": 30}, {"title": "Swim", "duration": 90}]
+
+
+class StreamingLLM:
+    """Streams a canned reply a few characters at a time."""
+
+    def __init__(self, text):
+        self.text = text
+        self.streams = 0
+
+    def stream(self, messages):
+        self.streams += 1
+        for start in range(0, len(self.text), 5):
+            yield AIMessageChunk(content=self.text[start:start + 5])
+
+    def invoke(self, messages):
+        raise AssertionError("expected a streamed call")
+
+
+class TestStreamChat(unittest.TestCase):
+
+    def test_forwards_chunks_and_returns_whole_message(self):
+        deltas = []
+        response = llm_client.stream_chat(StreamingLLM("Hello there, world"), [], deltas.append)
+        self.assertEqual(deltas[0], "Hello")
+        self.assertEqual("".join(deltas), "Hello there, world")
+        self.assertIsInstance(response, AIMessage)
+        self.assertEqual(response.content, "Hello there, world")
+
+    def test_streams_on_worker_with_deadline(self):
+        deltas = []
+        response = llm_client.stream_chat(StreamingLLM("abcdefghij"), [], deltas.append, Deadline(5))
+        self.assertEqual(("".join(deltas), response.content), ("abcdefghij", "abcdefghij"))
+
+
+class TestEstimateStreaming(unittest.TestCase):
+
+    def test_deltas_stream_and_fields_are_parsed(self):
+        fast_llm = StreamingLLM(ESTIMATE_TEXT)
+        deltas = []
+        with patch.object(tea, "embed_query_node", return_value={"query_embedding": None}), \
+                patch.object(tea, "find_similar_tasks_node", return_value={"tag_results": SCATTERED}), \
+                patch.object(tea.ESTIMATION_TIERS["fast"], "_llm", fast_llm):
+            result = estimate_task_time(
+                id="c1", email=EMAIL, task_title="Gym", task_description="Gym", tag_name="hobbies",
+                tag_description="", initial_estimate_minutes=30, on_delta=deltas.append
+            )
+        self.assertEqual(fast_llm.streams, 1)
+        self.assertEqual("".join(deltas), ESTIMATE_TEXT)
+        self.assertEqual(result["suggested_minutes"], 75)
+        self.assertEqual(result["confidence"], "high")
+
+
+class TestBackgroundStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = AsyncMock()
+        patcher = patch.object(agent_utils.manager, "send_personal_message", self.sent)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sent_messages(self):
+        return [call.args[0] for call in self.sent.await_args_list]
+
+    def test_flowbot_streams_deltas_before_result(self):
+        with patch.object(search_agent, "llm", StreamingLLM("Here is a plan for your week.")):
+            asyncio.run(agent_utils.run_search_agent_background("client", EMAIL, "Plan my week"))
+        messages = self.sent_messages()
+        types = [m["type"] for m in messages]
+        self.assertEqual(types[0], "flowbot_status")
+        self.assertEqual(types[-1], "flowbot_result")
+        self.assertEqual(set(types[1:-1]), {"flowbot_delta"})
+        self.assertEqual("".join(m["delta"] for m in messages[1:-1]), "Here is a plan for your week.")
+        self.assertEqual(messages[-1]["response"], "Here is a plan for your week.")
+
+    def test_agent_deltas_precede_final_result(self):
+        def estimate(on_delta, **kwargs):
+            for text in ("RECOMMENDATION: ", "increase"):
+                on_delta(text)
+            return {
+                "recommendation": "increase", "suggested_minutes": 90, "reasoning": "Long",
+                "confidence": "high", "degraded": False, "tier": "standard"
+            }
+
+        patchers = [
+            patch.object(agent_utils.db, "get_tag", return_value=None),
+            patch.object(agent_utils.db, "get_recent_tasks_with_tag", return_value=[]),
+            patch.object(agent_utils.db, "update_task_ai_estimation"),
+            patch.object(agent_utils, "MongoClient", MagicMock()),
+            patch.object(agent_utils, "estimate_task_time", side_effect=estimate),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        asyncio.run(agent_utils.run_agent_background("client", "c1", EMAIL, "Gym", None, ["hobbies"]))
+
+        messages = [m for m in self.sent_messages() if m["type"] in ("agent_delta", "agent_result")]
+        deltas = [m for m in messages if m["type"] == "agent_delta"]
+        self.assertEqual("".join(m["delta"] for m in deltas), "RECOMMENDATION: increase")
+        self.assertTrue(all(m["task_client_id"] == "c1" for m in deltas))
+        self.assertEqual(messages[-1]["type"], "agent_result")
+        self.assertEqual(messages[-1]["phase"], "final")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,217 @@
+import asyncio
+import threading
+import time
+import unittest
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import db
+import html_text
+import search_agent
+import web_fetcher
+from mongo_fakes import FakeClient
+
+PAGE = b"<html><head><style>p {}</style><script>var x;</script></head><body>\n<h1>Title</h1>\n<p>Body text</p>\n</body></html>"
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """Serves PAGE (?repeat= times) after ?delay= seconds, or ?status= as an error. Answers 304 to a matching If-None-Match."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        self.server.client_ports.add(self.client_address[1])
+        self.server.requests.append((self.path, self.headers.get("If-None-Match")))
+        with self.server.lock:
+            self.server.active += 1
+            self.server.peak = max(self.server.peak, self.server.active)
+        try:
+            time.sleep(float(query.get("delay", ["0"])[0]))
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+        if self.headers.get("If-None-Match") == self.server.etag:
+            self.send_response(304)
+            self.send_header("ETag", self.server.etag)
+            self.end_headers()
+            return
+        status = int(query.get("status", ["200"])[0])
+        body = PAGE * int(query.get("repeat", ["1"])[0])
+        self.send_response(status)
+        self.send_header("ETag", self.server.etag)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client gave up on a slow page
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WebFetcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.client_ports = set()
+        self.server.requests = []
+        self.server.etag = '"v1"'
+        self.server.active = 0
+        self.server.peak = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def run_fetch(self, coro_fn):
+        async def run():
+            try:
+                return await coro_fn()
+            finally:
+                await web_fetcher.close()
+        return asyncio.run(run())
+
+
+class TestFetchAll(WebFetcherTestCase):
+
+    def test_pages_are_fetched_concurrently(self):
+        urls = [f"{self.base}/{i}?delay=0.3" for i in range(2)] + ["http://localhost:%d/?delay=0.3" % self.server.server_address[1]]
+        start = time.monotonic()
+        results = self.run_fetch(lambda: web_fetcher.fetch_all(urls))
+        self.assertLess(time.monotonic() - start, 0.8)
+        self.assertTrue(all(r.status_code == 200 for r in results.values()))
+
+    def test_per_host_limit(self):
+        urls = [f"{self.base}/{i}?delay=0.1" for i in range(4)]
+        with patch.object(web_fetcher, "SCRAPE_PER_HOST_CONCURRENCY", 1):
+            self.run_fetch(lambda: web_fetcher.fetch_all(urls))
+        self.assertEqual(self.server.peak, 1)
+
+    def test_slow_pages_miss_the_deadline(self):
+        urls = [f"{self.base}/fast", f"{self.base}/slow?delay=1"]
+        results = self.run_fetch(lambda: web_fetcher.fetch_all(urls, deadline_seconds=0.3))
+        self.assertEqual(results[urls[0]].status_code, 200)
+        self.assertIsInstance(results[urls[1]], web_fetcher.FetchDeadlineExceeded)
+
+    def test_http_errors_are_returned(self):
+        url = f"{self.base}/missing?status=404"
+        results = self.run_fetch(lambda: web_fetcher.fetch_all([url]))
+        self.assertIsInstance(results[url], web_fetcher.httpx.HTTPStatusError)
+
+    def test_connections_are_reused(self):
+        async def fetch_in_turn():
+            for i in range(3):
+                await web_fetcher.fetch(f"{self.base}/{i}")
+        self.run_fetch(fetch_in_turn)
+        self.assertEqual(len(self.server.client_ports), 1)
+
+    def test_large_bodies_are_cut_off(self):
+        url = f"{self.base}/huge?repeat=1000"
+        with patch.object(web_fetcher, "SCRAPE_MAX_BYTES", 1000):
+            response = self.run_fetch(lambda: web_fetcher.fetch(url))
+        self.assertEqual(response.content, (PAGE * 1000)[:1000])
+        self.assertEqual(response.headers["ETag"], '"v1"')
+
+
+class TestScrapeNode(WebFetcherTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(search_agent, "client", FakeClient())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_extracts_text_and_reports_errors(self):
+        ok, missing = f"{self.base}/page", f"{self.base}/gone?status=500"
+        result = self.run_fetch(lambda: search_agent.scrape_urls_node({"urls": [ok, missing]}))
+        self.assertEqual(result["scraped_content"][ok], "Title\nBody text")
+        self.assertTrue(result["scraped_content"][missing].startswith("Error scraping content:"))
+
+
+@pytest.mark.parametrize("backend, module", [
+    ("selectolax", "selectolax.lexbor"),
+    ("lxml", "lxml.html"),
+    ("html.parser", "bs4"),
+])
+def test_backends_agree(backend, module):
+    pytest.importorskip(module)
+    assert html_text.extract_text(PAGE, backend) == "Title\nBody text"
+    assert html_text.extract_text(b"", backend) == ""
+
+
+class TestExtractText(unittest.TestCase):
+
+    def test_runs_on_the_parse_pool(self):
+        self.assertEqual(asyncio.run(html_text.extract_text_async(PAGE)), "Title\nBody text")
+
+
+class TestPageCache(WebFetcherTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = FakeClient()
+        patchers = [
+            patch.object(search_agent, "client", self.client),
+            patch.dict(db.page_cache_stats, {key: 0 for key in db.page_cache_stats}),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.url = f"{self.base}/course"
+
+    def scrape(self):
+        result = self.run_fetch(lambda: search_agent.scrape_urls_node({"urls": [self.url]}))
+        return result["scraped_content"][self.url]
+
+    def age_cache(self):
+        for page in self.client[db.DB_NAME]["page_cache"].docs:
+            page["checked_at"] -= timedelta(seconds=db.PAGE_CACHE_TTL_SECONDS + 1)
+
+    def test_fresh_page_is_served_without_a_request(self):
+        self.assertEqual(self.scrape(), "Title\nBody text")
+        self.assertEqual(self.scrape(), "Title\nBody text")
+        self.assertEqual(len(self.server.requests), 1)
+        metrics = db.page_cache_metrics()
+        self.assertEqual((metrics["misses"], metrics["hits"], metrics["stored"]), (1, 1, 1))
+        self.assertEqual(metrics["bytes_saved"], len(PAGE))
+        self.assertEqual(metrics["hit_rate"], 0.5)
+
+    def test_stale_page_is_revalidated(self):
+        self.scrape()
+        self.age_cache()
+        self.assertEqual(self.scrape(), "Title\nBody text")
+        self.assertEqual(self.server.requests[-1][1], '"v1"')
+        self.assertEqual(db.page_cache_stats["revalidated"], 1)
+        self.assertEqual(db.page_cache_stats["bytes_saved"], len(PAGE))
+
+        # Revalidation makes the page fresh again
+        self.scrape()
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_changed_page_replaces_the_cached_text(self):
+        self.scrape()
+        self.age_cache()
+        self.server.etag = '"v2"'
+        self.scrape()
+        self.assertEqual(db.page_cache_stats["revalidated"], 0)
+        self.assertEqual(db.page_cache_stats["stored"], 2)
+        self.assertEqual(self.client[db.DB_NAME]["page_cache"].docs[0]["etag"], '"v2"')
+
+    def test_stale_copy_is_used_when_the_page_fails(self):
+        self.scrape()
+        self.age_cache()
+        with patch.object(web_fetcher, "fetch", side_effect=web_fetcher.httpx.ConnectError("down")):
+            self.assertEqual(self.scrape(), "Title\nBody text")
+
+
+if __name__ == "__main__":
+    unittest.main()
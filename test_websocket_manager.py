@@ -0,0 +1,336 @@
+import asyncio
+import unittest
+
+import websocket_manager
+from websocket_manager import ConnectionManager
+from ws_pubsub import PubSubBackend
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        self.sent.append(message)
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+class StalledWebSocket(FakeWebSocket):
+    """Never finishes a send, like a client on a dead network."""
+
+    async def send_json(self, message):
+        await asyncio.Event().wait()
+
+
+class BrokenWebSocket(FakeWebSocket):
+    async def send_json(self, message):
+        raise ConnectionResetError("peer gone")
+
+
+async def flush(*managers):
+    """Waits until every healthy connection's writer has emptied its queue."""
+    await asyncio.wait_for(asyncio.gather(*(
+        connection.drained()
+        for manager in managers
+        for connection in list(manager.active_connections.values())
+        if not isinstance(connection.websocket, StalledWebSocket)
+    )), timeout=1)
+
+
+class SharedBus:
+    """Stands in for a cross-process transport: every subscriber sees every envelope."""
+
+    def __init__(self):
+        self.handlers = []
+
+    def backend(self):
+        bus = self
+
+        class BusBackend(PubSubBackend):
+            is_local = False
+
+            async def start(self, handler):
+                bus.handlers.append(handler)
+
+            async def publish(self, envelope):
+                for handler in list(bus.handlers):
+                    await handler(envelope)
+
+        return BusBackend()
+
+
+class TestConnectionManager(unittest.TestCase):
+
+    def test_in_memory_routing(self):
+        async def scenario():
+            manager = ConnectionManager()
+            await manager.start()
+            a, b, c = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+            await manager.connect(a, "a", "me@example.com")
+            await manager.connect(b, "b", "me@example.com")
+            await manager.connect(c, "c")
+
+            await manager.send_personal_message({"n": 1}, "a")
+            await manager.send_to_user({"n": 2}, "me@example.com")
+            await manager.broadcast({"n": 3})
+            await manager.send_personal_message({"n": 4}, "missing")
+            await flush(manager)
+            await manager.stop()
+            return a, b, c
+
+        a, b, c = asyncio.run(scenario())
+        self.assertEqual(a.sent, [{"n": 1}, {"n": 2}, {"n": 3}])
+        self.assertEqual(b.sent, [{"n": 2}, {"n": 3}])
+        self.assertEqual(c.sent, [{"n": 3}])
+
+    def test_message_reaches_socket_held_by_another_worker(self):
+        async def scenario():
+            bus = SharedBus()
+            worker_a, worker_b = ConnectionManager(), ConnectionManager()
+            await worker_a.start(bus.backend())
+            await worker_b.start(bus.backend())
+            socket = FakeWebSocket()
+            await worker_b.connect(socket, "client-1", "me@example.com")
+
+            # A background job on worker A sends to a socket held by worker B
+            await worker_a.send_personal_message({"type": "agent_result"}, "client-1")
+            await worker_a.send_to_user({"type": "task_event"}, "me@example.com")
+            await flush(worker_a, worker_b)
+            return socket
+
+        socket = asyncio.run(scenario())
+        self.assertEqual(socket.sent, [{"type": "agent_result"}, {"type": "task_event"}])
+
+    def test_broadcast_does_not_wait_for_slow_or_dead_clients(self):
+        async def scenario():
+            manager = ConnectionManager()
+            slow, broken, healthy = StalledWebSocket(), BrokenWebSocket(), FakeWebSocket()
+            await manager.connect(slow, "slow")
+            await manager.connect(broken, "broken")
+            await manager.connect(healthy, "healthy")
+
+            await asyncio.wait_for(manager.broadcast({"n": 1}), timeout=1)
+            await manager.broadcast({"n": 2})
+            await flush(manager)
+            return manager, healthy, broken
+
+        manager, healthy, broken = asyncio.run(scenario())
+        self.assertEqual(healthy.sent, [{"n": 1}, {"n": 2}])
+        self.assertNotIn("broken", manager.active_connections)
+        self.assertIn("slow", manager.active_connections)
+
+    def test_overflow_evicts_slow_consumer(self):
+        async def scenario():
+            manager = ConnectionManager(overflow_policy="evict")
+            slow = StalledWebSocket()
+            await manager.connect(slow, "slow")
+            capacity = manager.metrics()["queue_capacity"]
+            # The writer takes the first message and stalls; the rest fill the queue
+            await manager.send_personal_message({"n": 0}, "slow")
+            await asyncio.sleep(0)
+            for n in range(1, capacity + 2):
+                await manager.send_personal_message({"n": n}, "slow")
+            await asyncio.sleep(0)
+            return manager, slow
+
+        manager, slow = asyncio.run(scenario())
+        metrics = manager.metrics()
+        self.assertNotIn("slow", manager.active_connections)
+        self.assertEqual(slow.closed_with, 1013)
+        self.assertEqual(metrics["evictions"], 1)
+        self.assertGreater(metrics["messages_dropped"], 0)
+
+    def test_overflow_drop_oldest_keeps_connection(self):
+        async def scenario():
+            manager = ConnectionManager(overflow_policy="drop_oldest")
+            await manager.connect(StalledWebSocket(), "slow")
+            capacity = manager.metrics()["queue_capacity"]
+            await manager.send_personal_message({"n": 0}, "slow")
+            await asyncio.sleep(0)
+            for n in range(1, capacity + 5):
+                await manager.send_personal_message({"n": n}, "slow")
+            return manager, capacity
+
+        manager, capacity = asyncio.run(scenario())
+        metrics = manager.metrics()
+        self.assertIn("slow", manager.active_connections)
+        self.assertEqual(metrics["queue_depth_max"], capacity)
+        self.assertEqual(metrics["messages_dropped"], 4)
+
+    def test_stale_disconnect_keeps_reconnected_socket(self):
+        async def scenario():
+            manager = ConnectionManager()
+            old_socket, new_socket = FakeWebSocket(), FakeWebSocket()
+            await manager.connect(old_socket, "a")
+            await manager.connect(new_socket, "a")
+            manager.disconnect("a", old_socket)
+            return manager, new_socket
+
+        manager, new_socket = asyncio.run(scenario())
+        self.assertIs(manager.active_connections["a"].websocket, new_socket)
+
+    def test_disconnect_forgets_user_connection(self):
+        async def scenario():
+            manager = ConnectionManager()
+            await manager.connect(FakeWebSocket(), "a", "me@example.com")
+            manager.disconnect("a")
+            return manager
+
+        manager = asyncio.run(scenario())
+        self.assertEqual(manager.active_connections, {})
+        self.assertEqual(manager.user_connections, {})
+
+
+class TestOfflineBuffer(unittest.TestCase):
+
+    def test_reconnect_replays_buffered_messages_in_order(self):
+        async def scenario():
+            manager = ConnectionManager()
+            await manager.start()
+            await manager.send_personal_message({"n": 1}, "tab", "me@example.com")
+            await manager.send_personal_message({"n": 2}, "tab", "me@example.com")
+            socket = FakeWebSocket()
+            await manager.connect(socket, "tab", "me@example.com")
+            await manager.send_personal_message({"n": 3}, "tab", "me@example.com")
+            await flush(manager)
+            return manager, socket
+
+        manager, socket = asyncio.run(scenario())
+        self.assertEqual(socket.sent, [{"n": 1}, {"n": 2}, {"n": 3}])
+        metrics = manager.metrics()
+        self.assertEqual(metrics["offline_replayed"], 2)
+        self.assertEqual(metrics["offline_pending"], 0)
+
+    def test_new_socket_of_same_user_claims_pending_results(self):
+        async def scenario():
+            manager = ConnectionManager()
+            await manager.send_personal_message({"type": "agent_result"}, "old-tab", "me@example.com")
+            await manager.send_personal_message({"type": "other"}, "stranger", "other@example.com")
+            socket = FakeWebSocket()
+            await manager.connect(socket, "new-tab", "me@example.com")
+            await flush(manager)
+            # Claimed once: the old socket id gets nothing if it comes back
+            returning = FakeWebSocket()
+            await manager.connect(returning, "old-tab", "me@example.com")
+            await flush(manager)
+            return socket, returning
+
+        socket, returning = asyncio.run(scenario())
+        self.assertEqual(socket.sent, [{"type": "agent_result"}])
+        self.assertEqual(returning.sent, [])
+
+    def test_expired_messages_are_not_replayed(self):
+        async def scenario():
+            manager = ConnectionManager()
+            manager.offline.ttl = 0
+            await manager.send_personal_message({"n": 1}, "tab")
+            socket = FakeWebSocket()
+            await manager.connect(socket, "tab")
+            await flush(manager)
+            return manager, socket
+
+        manager, socket = asyncio.run(scenario())
+        self.assertEqual(socket.sent, [])
+        self.assertEqual(manager.metrics()["offline_expired"], 1)
+
+    def test_buffer_is_bounded_per_client(self):
+        manager = ConnectionManager()
+        manager.offline.max_per_key = 3
+        for n in range(5):
+            manager.offline.add("tab", None, {"n": n})
+        self.assertEqual(manager.offline.claim("tab", None), [{"n": 2}, {"n": 3}, {"n": 4}])
+
+    def test_reconnect_on_another_worker_claims_buffered_results(self):
+        async def scenario():
+            bus = SharedBus()
+            worker_a, worker_b = ConnectionManager(), ConnectionManager()
+            await worker_a.start(bus.backend())
+            await worker_b.start(bus.backend())
+
+            first = FakeWebSocket()
+            await worker_b.connect(first, "tab", "me@example.com")
+            # Held by worker B, so worker A does not buffer
+            await worker_a.send_personal_message({"n": 1}, "tab", "me@example.com")
+            await flush(worker_a, worker_b)
+            worker_b.disconnect("tab", first)
+            await asyncio.sleep(0)
+
+            # The socket is gone everywhere: worker A holds the result
+            await worker_a.send_personal_message({"n": 2}, "tab", "me@example.com")
+            self.assertEqual(worker_a.offline.pending(), 1)
+            self.assertEqual(worker_b.offline.pending(), 0)
+
+            second = FakeWebSocket()
+            await worker_b.connect(second, "tab-2", "me@example.com")
+            await flush(worker_a, worker_b)
+            return first, second, worker_a
+
+        first, second, worker_a = asyncio.run(scenario())
+        self.assertEqual(first.sent, [{"n": 1}])
+        self.assertEqual(second.sent, [{"n": 2}])
+        self.assertEqual(worker_a.offline.pending(), 0)
+
+
+class TestFraming(unittest.TestCase):
+
+    def test_batching_client_gets_one_frame_per_burst(self):
+        async def scenario():
+            manager = ConnectionManager()
+            batched, plain = FakeWebSocket(), FakeWebSocket()
+            await manager.connect(batched, "batched", batch=True)
+            await manager.connect(plain, "plain")
+            for n in range(3):
+                await manager.broadcast({"n": n})
+            await flush(manager)
+            return manager, batched, plain
+
+        manager, batched, plain = asyncio.run(scenario())
+        self.assertEqual(batched.sent, [{"type": "batch", "messages": [{"n": 0}, {"n": 1}, {"n": 2}]}])
+        self.assertEqual(plain.sent, [{"n": 0}, {"n": 1}, {"n": 2}])
+        metrics = manager.metrics()
+        self.assertEqual(metrics["messages_sent"], 6)
+        self.assertEqual(metrics["frames_sent"], 4)
+
+    def test_single_event_is_not_wrapped(self):
+        async def scenario():
+            manager = ConnectionManager()
+            socket = FakeWebSocket()
+            await manager.connect(socket, "a", batch=True)
+            await manager.send_personal_message({"n": 1}, "a")
+            await flush(manager)
+            return socket
+
+        self.assertEqual(asyncio.run(scenario()).sent, [{"n": 1}])
+
+    def test_msgpack_client_gets_binary_frames(self):
+        async def scenario():
+            manager = ConnectionManager()
+            socket = FakeWebSocket()
+            await manager.connect(socket, "a", encoding="msgpack")
+            await manager.send_personal_message({"n": 1}, "a")
+            await flush(manager)
+            return socket
+
+        [frame] = asyncio.run(scenario()).sent
+        self.assertEqual(websocket_manager.msgpack.unpackb(frame), {"n": 1})
+
+    def test_unknown_encoding_falls_back_to_json(self):
+        async def scenario():
+            manager = ConnectionManager()
+            await manager.connect(FakeWebSocket(), "a", encoding="xml")
+            return manager.active_connections["a"].encoding
+
+        self.assertEqual(asyncio.run(scenario()), "json")
+
+
+if __name__ == "__main__":
+    unittest.main()
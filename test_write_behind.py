@@ -0,0 +1,133 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+import db
+from mongo_fakes import FakeClient
+from write_behind import TaskWriteBehind
+
+EMAIL = "me@example.com"
+
+
+class TestTaskWriteBehind(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        with patch.object(db, "_generate_embedding", return_value=None):
+            db.set_task(self.client, EMAIL, "Gym", "c1", duration=30)
+            db.set_task(self.client, EMAIL, "Read", "c2", duration=20)
+        tasks = self.client[db.DB_NAME]["tasks"]
+        self.gym = str(tasks.find_one({"title": "Gym"})["_id"])
+        self.read = str(tasks.find_one({"title": "Read"})["_id"])
+        self.client.calls.clear()
+
+    def stored(self, title):
+        return self.client[db.DB_NAME]["tasks"].find_one({"title": title})
+
+    def test_burst_of_updates_becomes_one_bulk_write(self):
+        async def scenario():
+            writes = TaskWriteBehind(window_ms=20)
+            writes.start(self.client, asyncio.get_running_loop())
+            for minutes in (35, 40, 45):
+                writes.submit(self.gym, {"duration": minutes})
+            writes.submit(self.gym, {"is_completed": True})
+            writes.submit(self.read, {"duration": 25})
+            await asyncio.sleep(0.1)
+            return writes
+
+        writes = asyncio.run(scenario())
+        self.assertEqual(self.client.calls, [("tasks", "bulk_write")])
+        self.assertEqual(self.stored("Gym")["duration"], 45)
+        self.assertTrue(self.stored("Gym")["is_completed"])
+        self.assertEqual(self.stored("Read")["duration"], 25)
+        metrics = writes.metrics()
+        self.assertEqual(metrics["updates_submitted"], 5)
+        self.assertEqual(metrics["tasks_written"], 2)
+        self.assertEqual(metrics["flushes"], 1)
+
+    def test_reads_see_pending_updates(self):
+        async def scenario():
+            writes = TaskWriteBehind(window_ms=10_000)
+            writes.start(self.client, asyncio.get_running_loop())
+            writes.submit(self.gym, {"duration": 90})
+            tasks = writes.overlay(db.get_all_tasks_for_user(self.client, EMAIL))
+            await writes.stop()
+            return tasks
+
+        tasks = {task["title"]: task for task in asyncio.run(scenario())}
+        self.assertEqual(tasks["Gym"]["duration"], 90)
+        self.assertEqual(tasks["Read"]["duration"], 20)
+        # stop() flushed what was pending
+        self.assertEqual(self.stored("Gym")["duration"], 90)
+
+    def test_updates_for_another_user_do_not_apply(self):
+        async def scenario():
+            writes = TaskWriteBehind(window_ms=10_000)
+            writes.start(self.client, asyncio.get_running_loop())
+            writes.submit(self.gym, {"duration": 5}, email="other@example.com")
+            await writes.stop()
+
+        asyncio.run(scenario())
+        self.assertEqual(self.stored("Gym")["duration"], 30)
+
+    def test_foreign_pending_updates_are_not_overlaid(self):
+        async def scenario():
+            writes = TaskWriteBehind(window_ms=10_000)
+            writes.start(self.client, asyncio.get_running_loop())
+            writes.submit(self.gym, {"duration": 5}, email="other@example.com")
+            tasks = writes.overlay(db.get_all_tasks_for_user(self.client, EMAIL))
+            await writes.stop()
+            return tasks
+
+        tasks = {task["title"]: task for task in asyncio.run(scenario())}
+        self.assertEqual(tasks["Gym"]["duration"], 30)
+
+    def test_queue_rejects_missing_and_foreign_tasks(self):
+        async def scenario():
+            writes = TaskWriteBehind(window_ms=10_000)
+            writes.start(self.client, asyncio.get_running_loop())
+            results = (
+                await writes.queue(self.gym, {"duration": 40}, EMAIL),
+                await writes.queue(self.gym, {"duration": 5}, "other@example.com"),
+                await writes.queue(str(ObjectId()), {"duration": 5}),
+            )
+            metrics = writes.metrics()
+            await writes.stop()
+            return results, metrics
+
+        results, metrics = asyncio.run(scenario())
+        self.assertEqual(results, (True, False, False))
+        self.assertEqual(metrics["pending_tasks"], 1)
+        self.assertEqual(self.stored("Gym")["duration"], 40)
+
+    def test_failed_flush_keeps_updates_for_retry(self):
+        async def scenario():
+            writes = TaskWriteBehind(window_ms=10_000)
+            writes.start(self.client, asyncio.get_running_loop())
+            writes.submit(self.gym, {"duration": 50, "color": "red"})
+            with patch.object(db, "update_tasks_fields_bulk", side_effect=RuntimeError("down")):
+                await writes.flush()
+            writes.submit(self.gym, {"duration": 55})
+            await writes.stop()
+            return writes
+
+        writes = asyncio.run(scenario())
+        self.assertEqual(self.stored("Gym")["duration"], 55)
+        self.assertEqual(self.stored("Gym")["color"], "red")
+        self.assertEqual(writes.metrics()["failed_flushes"], 1)
+
+    def test_rejects_malformed_ids(self):
+        async def scenario():
+            writes = TaskWriteBehind(window_ms=20)
+            writes.start(self.client, asyncio.get_running_loop())
+            writes.submit("not-an-id", {"duration": 5})
+
+        with self.assertRaises(InvalidId):
+            asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from bson import ObjectId
+from pymongo.errors import CollectionInvalid
+
+from ws_pubsub import MongoCappedPubSub, PubSubBackend
+
+
+class FakeTailableCursor:
+    """Yields documents in insertion order; each pass over it is one await batch."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.position = 0
+        self.alive = True
+
+    def __iter__(self):
+        with self.collection.lock:
+            docs = list(self.collection.docs[self.position:])
+        self.position += len(docs)
+        if not docs:
+            time.sleep(0.01)
+        for doc in docs:
+            yield dict(doc)
+
+
+class FakeCappedCollection:
+    def __init__(self):
+        self.docs = []
+        self.cursors = []
+        self.lock = threading.Lock()
+
+    def insert_one(self, doc):
+        doc.setdefault("_id", ObjectId())
+        with self.lock:
+            self.docs.append(dict(doc))
+
+    def find(self, query, **kwargs):
+        cursor = FakeTailableCursor(self)
+        self.cursors.append(cursor)
+        return cursor
+
+    def find_one(self, query, projection=None):
+        with self.lock:
+            return next((doc for doc in self.docs if doc["_id"] == query["_id"]), None)
+
+
+class FakeCappedDatabase:
+    def __init__(self):
+        self.collection = FakeCappedCollection()
+        self.created = False
+
+    def __getitem__(self, name):
+        return self.collection
+
+    def create_collection(self, name, **kwargs):
+        if self.created:
+            raise CollectionInvalid(name)
+        self.created = True
+
+
+class FakeCappedClient:
+    def __init__(self):
+        self.database = FakeCappedDatabase()
+
+    def __getitem__(self, name):
+        return self.database
+
+
+def envelope(n, ts):
+    return {"ts": ts, "target": "all", "id": None, "message": {"n": n}}
+
+
+async def wait_for_messages(received, count):
+    for _ in range(200):
+        if len(received) >= count:
+            return
+        await asyncio.sleep(0.01)
+
+
+class TestMongoCappedPubSub(unittest.TestCase):
+
+    def run_backend(self, scenario):
+        async def main():
+            client = FakeCappedClient()
+            backend = MongoCappedPubSub(client)
+            received = []
+
+            async def handler(envelope):
+                received.append(envelope["message"]["n"])
+
+            collection = client.database.collection
+            collection.insert_one(envelope(0, time.time() - 60))
+            await backend.start(handler)
+            try:
+                await scenario(backend, collection, received)
+            finally:
+                await backend.stop()
+            return received
+
+        return asyncio.run(main())
+
+    def test_delivers_out_of_order_timestamps_in_insertion_order(self):
+        async def scenario(backend, collection, received):
+            now = time.time()
+            # A publisher stamped later committed first
+            collection.insert_one(envelope(1, now + 1.0))
+            collection.insert_one(envelope(2, now + 0.5))
+            await backend.publish({"target": "all", "id": None, "message": {"n": 3}})
+            await wait_for_messages(received, 3)
+
+        # Envelope 0 predates the subscriber and is skipped
+        self.assertEqual(self.run_backend(scenario), [1, 2, 3])
+
+    def test_reopened_cursor_resumes_after_last_processed(self):
+        async def scenario(backend, collection, received):
+            now = time.time()
+            collection.insert_one(envelope(1, now + 1.0))
+            await wait_for_messages(received, 1)
+            collection.cursors[-1].alive = False
+            # Stamped before envelope 1, so a timestamp cut would drop it
+            collection.insert_one(envelope(2, now + 0.5))
+            await wait_for_messages(received, 2)
+            await asyncio.sleep(0.05)
+
+        self.assertEqual(self.run_backend(scenario), [1, 2])
+
+
+class TestPubSubBackendInterface(unittest.TestCase):
+
+    def test_backends_must_implement_start_and_publish(self):
+        class Incomplete(PubSubBackend):
+            async def start(self, handler):
+                pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+if __name__ == "__main__":
+    unittest.main()
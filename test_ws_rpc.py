@@ -0,0 +1,137 @@
+import asyncio
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import msgpack
+from fastapi.testclient import TestClient
+
+import db
+import main
+from mongo_fakes import FakeClient
+import ws_rpc
+from write_behind import TaskWriteBehind
+from ws_rpc import handle_rpc
+
+EMAIL = "me@example.com"
+
+
+class TestHandleRpc(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        patcher = patch.object(db, "_generate_embedding", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        db.set_task(self.client, EMAIL, "Gym", "c1", duration=30)
+        self.task_id = str(self.client[db.DB_NAME]["tasks"].find_one({"title": "Gym"})["_id"])
+
+    def call(self, method, params, email=EMAIL):
+        request = {"type": "rpc", "id": "r1", "method": method, "params": params}
+        return asyncio.run(handle_rpc(self.client, email, request))
+
+    def stored(self):
+        return self.client[db.DB_NAME]["tasks"].find_one({"title": "Gym"})
+
+    def test_move_task(self):
+        reply = self.call("move_task", {
+            "task_id": self.task_id, "start_time": "2026-03-01T09:30:00Z", "tag_names": ["health"]
+        })
+        self.assertEqual(reply, {
+            "type": "rpc_ack", "id": "r1",
+            "result": {"task_id": self.task_id, "updated": ["start_time", "tag_names"]}
+        })
+        self.assertEqual(self.stored()["start_time"], datetime(2026, 3, 1, 9, 30, tzinfo=timezone.utc))
+        self.assertEqual(self.stored()["tag_names"], ["health"])
+
+    def test_toggle_completion_and_duration(self):
+        self.assertEqual(self.call("toggle_completion", {"task_id": self.task_id, "is_completed": True})["type"], "rpc_ack")
+        self.assertEqual(self.call("update_duration", {"task_id": self.task_id, "duration": 45})["type"], "rpc_ack")
+        self.assertTrue(self.stored()["is_completed"])
+        self.assertEqual(self.stored()["duration"], 45)
+
+    def test_other_users_task_is_not_found(self):
+        reply = self.call("update_duration", {"task_id": self.task_id, "duration": 45}, email="other@example.com")
+        self.assertEqual(reply["code"], "not_found")
+        self.assertEqual(self.stored()["duration"], 30)
+
+    def test_write_behind_rejects_other_users_task(self):
+        async def scenario():
+            writes = TaskWriteBehind(window_ms=10_000)
+            writes.start(self.client, asyncio.get_running_loop())
+            request = {"type": "rpc", "id": "r1", "method": "update_duration", "params": {"task_id": self.task_id, "duration": 45}}
+            with patch.object(ws_rpc, "task_writes", writes):
+                replies = [
+                    await handle_rpc(self.client, "other@example.com", request),
+                    await handle_rpc(self.client, EMAIL, request)
+                ]
+            await writes.stop()
+            return replies
+
+        foreign, own = asyncio.run(scenario())
+        self.assertEqual(foreign["code"], "not_found")
+        self.assertEqual(own["type"], "rpc_ack")
+        self.assertEqual(self.stored()["duration"], 45)
+
+    def test_malformed_id_is_not_found(self):
+        self.assertEqual(self.call("update_duration", {"task_id": "nope", "duration": 45})["code"], "not_found")
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.call("drop_table", {})["code"], "unknown_method")
+        self.assertEqual(self.call("update_duration", {"task_id": self.task_id, "duration": -5})["code"], "invalid_params")
+        self.assertEqual(self.call("update_duration", {"task_id": self.task_id})["code"], "invalid_params")
+        self.assertEqual(self.call("update_duration", {"task_id": self.task_id, "duration": 5}, email=None)["code"], "unauthenticated")
+
+
+class TestRpcOverSocket(unittest.TestCase):
+
+    def test_ack_arrives_on_the_socket(self):
+        client = FakeClient()
+        with patch.object(db, "_generate_embedding", return_value=None):
+            db.set_task(client, EMAIL, "Gym", "c1")
+        task_id = str(client[db.DB_NAME]["tasks"].find_one({"title": "Gym"})["_id"])
+        previous = main.mongo_client
+        main.mongo_client = client
+        self.addCleanup(setattr, main, "mongo_client", previous)
+
+        with TestClient(main.app).websocket_connect(f"/ws/tab-1?email={EMAIL}") as socket:
+            socket.send_text("not json")
+            socket.send_json({
+                "type": "rpc", "id": 7, "method": "update_duration",
+                "params": {"task_id": task_id, "duration": 50}
+            })
+            reply = socket.receive_json()
+            while reply["type"] != "rpc_ack":
+                reply = socket.receive_json()
+
+        self.assertEqual(reply["id"], 7)
+        self.assertEqual(client[db.DB_NAME]["tasks"].find_one({"title": "Gym"})["duration"], 50)
+
+    def test_msgpack_socket_gets_binary_batches(self):
+        client = FakeClient()
+        with patch.object(db, "_generate_embedding", return_value=None):
+            db.set_task(client, EMAIL, "Gym", "c1")
+        task_id = str(client[db.DB_NAME]["tasks"].find_one({"title": "Gym"})["_id"])
+        previous = main.mongo_client
+        main.mongo_client = client
+        self.addCleanup(setattr, main, "mongo_client", previous)
+
+        url = f"/ws/tab-1?email={EMAIL}&encoding=msgpack&batch=true"
+        with TestClient(main.app).websocket_connect(url) as socket:
+            socket.send_json({
+                "type": "rpc", "id": 8, "method": "update_duration",
+                "params": {"task_id": task_id, "duration": 55}
+            })
+            messages = []
+            while not any(m["type"] == "rpc_ack" for m in messages):
+                # The frontend unwraps frames the same way (WebSocketContext.tsx)
+                frame = msgpack.unpackb(socket.receive_bytes())
+                messages.extend(frame["messages"] if frame["type"] == "batch" else [frame])
+
+        ack = next(m for m in messages if m["type"] == "rpc_ack")
+        self.assertEqual(ack["id"], 8)
+        self.assertEqual(ack["result"]["updated"], ["duration"])
+
+
+if __name__ == "__main__":
+    unittest.main()
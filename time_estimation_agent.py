@@ -8,15 +8,26 @@ LangGraph-based agent that:
 4. Suggests time allocation (increase or keep, never decrease)
 """
 
+import json
+import operator
 import os
-from typing import Annotated, TypedDict, List, Dict, Any, Literal
+import statistics
+import threading
+import time
+from contextlib import nullcontext
+from typing import Annotated, Callable, TypedDict, List, Dict, Any, Literal, Optional
 from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
+from langgraph.types import Send
 from langchain_core.messages import SystemMessage, HumanMessage
+import pymongo
 from pymongo import MongoClient
-from langchain_mongodb import MongoDBAtlasVectorSearch
+
+import llm_client
+from deadlines import Deadline, DeadlineExceeded, JobCancelled
 
 
 # Load environment variables
@@ -35,6 +46,107 @@ llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
 
 embeddings = GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001")
 
+# =============================================================================
+# MODEL TIERS
+# =============================================================================
+# Not every estimate needs the full model. route_estimation picks a tier from the
+# task and its history:
+# - "none": consistent history and a short description; the history median is used
+# - "fast": short description, or history is available; a cheaper, faster model
+# - "standard": everything else
+# Set ESTIMATION_ROUTING=false to send every estimate to the standard tier.
+
+ESTIMATION_ROUTING = os.getenv("ESTIMATION_ROUTING", "true").lower() not in ("0", "false", "no")
+ESTIMATION_SHORT_DESCRIPTION_CHARS = int(os.getenv("ESTIMATION_SHORT_DESCRIPTION_CHARS", "80"))
+# Similar tasks with durations needed before history alone is trusted
+ESTIMATION_MIN_HISTORY = int(os.getenv("ESTIMATION_MIN_HISTORY", "3"))
+# Max coefficient of variation (stdev / mean) of those durations to skip the LLM
+ESTIMATION_MAX_VARIATION = float(os.getenv("ESTIMATION_MAX_VARIATION", "0.25"))
+
+
+class ModelTier:
+    """A model choice for estimations, with its prices and latency/cost accounting."""
+
+    def __init__(self, name: str, model: Optional[str] = None, input_cost_per_m: float = 0.0, output_cost_per_m: float = 0.0):
+        self.name = name
+        self.model = model
+        self.input_cost_per_m = input_cost_per_m
+        self.output_cost_per_m = output_cost_per_m
+        self._llm = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def get_llm(self):
+        """Returns this tier's chat model; the standard tier shares the module-level llm."""
+        if self.name == "standard":
+            return llm
+        if self._llm is None:
+            self._llm = ChatGoogleGenerativeAI(model=self.model)
+        return self._llm
+
+    def record(self, elapsed_ms: float, response: Any = None, failed: bool = False) -> None:
+        usage = getattr(response, "usage_metadata", None) or {}
+        with self._lock:
+            self.requests += 1
+            self.errors += int(failed)
+            self.total_ms += elapsed_ms
+            self.input_tokens += usage.get("input_tokens", 0)
+            self.output_tokens += usage.get("output_tokens", 0)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            cost = (self.input_tokens * self.input_cost_per_m + self.output_tokens * self.output_cost_per_m) / 1_000_000
+            return {
+                "model": self.model,
+                "requests": self.requests,
+                "errors": self.errors,
+                "avg_ms": round(self.total_ms / self.requests, 1) if self.requests else 0.0,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "estimated_cost_usd": round(cost, 6)
+            }
+
+
+ESTIMATION_TIERS: Dict[str, ModelTier] = {
+    "none": ModelTier("none"),
+    "fast": ModelTier(
+        "fast",
+        os.getenv("ESTIMATION_FAST_MODEL", "gemini-2.5-flash-lite"),
+        float(os.getenv("ESTIMATION_FAST_INPUT_COST_PER_M", "0.10")),
+        float(os.getenv("ESTIMATION_FAST_OUTPUT_COST_PER_M", "0.40"))
+    ),
+    "standard": ModelTier(
+        "standard",
+        "gemini-2.5-flash",
+        float(os.getenv("ESTIMATION_STANDARD_INPUT_COST_PER_M", "0.30")),
+        float(os.getenv("ESTIMATION_STANDARD_OUTPUT_COST_PER_M", "2.50"))
+    ),
+}
+
+
+def route_estimation(task_description: str, historical_tasks: List[Dict[str, Any]]) -> str:
+    """Picks the tier for an estimate from description length and history spread."""
+    if not ESTIMATION_ROUTING:
+        return "standard"
+    short = len((task_description or "").strip()) <= ESTIMATION_SHORT_DESCRIPTION_CHARS
+    durations = [task["duration"] for task in historical_tasks if task.get("duration")]
+    if short and len(durations) >= ESTIMATION_MIN_HISTORY:
+        variation = statistics.pstdev(durations) / statistics.mean(durations)
+        if variation <= ESTIMATION_MAX_VARIATION:
+            return "none"
+    if short or durations:
+        return "fast"
+    return "standard"
+
+
+def tier_metrics() -> Dict[str, Any]:
+    return {name: tier.metrics() for name, tier in ESTIMATION_TIERS.items()}
+
+
 # =============================================================================
 # STATE DEFINITION
 # =============================================================================
@@ -45,13 +157,18 @@ class TimeEstimationState(TypedDict):
     id: str
     task_title: str
     task_description: str
-    tag_name: str
+    tag_name: str  # Primary tag
     tag_description: str
+    tag_names: List[str]  # All of the task's tags; each is searched for similar tasks
     email: str
     estimated_time: int  # User's initial estimate in minutes
+    deadline: Optional[Deadline]  # Time limit and cancellation token for this run
+    stream_tokens: bool  # Send partial LLM text to the graph's "custom" stream
     
     # Intermediate results
     similar_tags: List[Dict[str, Any]]
+    query_embedding: Optional[List[float]]
+    tag_results: Annotated[List[Dict[str, Any]], operator.add]  # Appended to by each tag branch
     historical_tasks: List[Dict[str, Any]]
     
     # LLM conversation
@@ -62,71 +179,207 @@ class TimeEstimationState(TypedDict):
     suggested_minutes: int
     reasoning: str
     confidence: Literal["high", "medium", "low"]
+    degraded: bool  # True when the LLM was unavailable and a heuristic was used
+    tier: str  # Model tier the estimate was routed to
+
+
+# =============================================================================
+# DEADLINES
+# =============================================================================
+
+def _stage(state: TimeEstimationState, name: str):
+    """Times a stage against the run's deadline; a no-op for runs without one."""
+    deadline = state.get("deadline")
+    return deadline.stage(name) if deadline is not None else nullcontext()
+
+
+def _mongo_timeout(state: TimeEstimationState):
+    """Bounds MongoDB operations by the time left on the run's deadline."""
+    deadline = state.get("deadline")
+    return pymongo.timeout(deadline.remaining()) if deadline is not None else nullcontext()
+
+
+def _token_writer(state: TimeEstimationState, node: str) -> Optional[Callable[[str], None]]:
+    """Forwards partial LLM text to the "custom" stream when the caller asked for tokens."""
+    if not state.get("stream_tokens"):
+        return None
+    writer = get_stream_writer()
+    return lambda text: writer({"node": node, "delta": text})
+
+
+def _raise_if_out_of_time(state: TimeEstimationState, stage: str, error: Exception) -> None:
+    """Turns a failure caused by the deadline passing into DeadlineExceeded."""
+    deadline = state.get("deadline")
+    if isinstance(error, (DeadlineExceeded, JobCancelled)):
+        raise error
+    if deadline is not None:
+        deadline.check(stage)
 
 
 # =============================================================================
 # Vector Search
 # =============================================================================
+# The description is embedded once, then every tag of the task is searched in
+# its own parallel branch (LangGraph Send), so retrieval takes as long as the
+# slowest single search. The merge keeps the SIMILAR_TASKS_K best matches.
+
+SIMILAR_TASKS_K = 4
+
+
+def _search_tags(state: TimeEstimationState) -> List[str]:
+    """Every tag of the task, primary tag first, without duplicates."""
+    return list(dict.fromkeys([state["tag_name"], *(state.get("tag_names") or [])]))
+
+
+def embed_query_node(state: TimeEstimationState) -> Dict[str, Any]:
+    """
+    Node 1: Embed the task description once for all tag searches.
+    While embeddings are unavailable the searches fall back to recent tasks.
+    """
+    print(f"\n[Node 1] Embedding task description...")
+    with _stage(state, "embed_query"):
+        try:
+            # Embed through the shared client so an embeddings outage fails fast
+            query_embedding = llm_client.embed_query(
+                embeddings, state["task_description"], state.get("deadline"), "embed_query"
+            )
+        except Exception as e:
+            _raise_if_out_of_time(state, "embed_query", e)
+            print(f"Embeddings unavailable, using recent tasks with the same tags: {e}")
+            query_embedding = None
+    return {"query_embedding": query_embedding}
+
+
+def fan_out_tags_edge(state: TimeEstimationState) -> List[Send]:
+    """Conditional edge: one parallel find_similar_tasks branch per tag."""
+    return [Send("find_similar_tasks", {**state, "tag_name": tag}) for tag in _search_tags(state)]
 
 
 def find_similar_tasks_node(state: TimeEstimationState) -> Dict[str, Any]:
     """
-    Node 1: Find similar tasks with the same tag using Atlas Vector Search.
-    Uses the langchain_mongodb vector store class.
+    Node 2 (one branch per tag): Find similar tasks with the branch's tag using
+    a $vectorSearch aggregate on the Atlas Vector Search index.
     """
-    print(f"\n[Node 1] Finding similar tasks with tag '{state['tag_name']}'...")
-    
-    # Initialize the vector store
-    vector_store = MongoDBAtlasVectorSearch(
-        collection=collection,
-        embedding=embeddings,
-        index_name="default",
-        embedding_key="embedding",
-        text_key="description",
-        relevance_score_fn="cosine"
-    )
-    
+    print(f"\n[Node 2] Finding similar tasks with tag '{state['tag_name']}'...")
+    with _stage(state, "find_similar_tasks"):
+        if state.get("query_embedding") is None:
+            return {"tag_results": _recent_tasks_with_tag(state)}
+        return {"tag_results": _vector_search(state, state["query_embedding"])}
+
+
+def merge_similar_tasks(tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Keeps each task once with its best score, and the SIMILAR_TASKS_K best overall."""
+    best: Dict[Any, Dict[str, Any]] = {}
+    for task in tasks:
+        key = task.get("_id") or task.get("task_client_id") or id(task)
+        current = best.get(key)
+        if current is None or (task.get("score") or 0) > (current.get("score") or 0):
+            best[key] = task
+    # sorted is stable, so unscored fallback results keep their recency order
+    merged = sorted(best.values(), key=lambda task: task.get("score") or 0, reverse=True)
+    return merged[:SIMILAR_TASKS_K]
+
+
+def merge_similar_tasks_node(state: TimeEstimationState) -> Dict[str, Any]:
+    """Node 3: Merge the per-tag results into the historical tasks used for the estimate."""
+    historical_tasks = merge_similar_tasks(state.get("tag_results", []))
+    print(f"Kept {len(historical_tasks)} similar tasks across {len(_search_tags(state))} tags")
+    return {"historical_tasks": historical_tasks}
+
+
+def _vector_search(state: TimeEstimationState, query_embedding: List[float]) -> List[Dict[str, Any]]:
+    """Similar tasks with the state's tag, nearest to query_embedding."""
     # Define the filter to ensure we only get tasks with the same tag
-    # Using pre_filter for performance
+    # Using a pre-filter in $vectorSearch for performance
     search_filter = {
         "$and": [
             {"tag_names": {"$eq": state["tag_name"]}},
             {"_id": {"$ne": state["id"]}}
         ]
     }
-    
+    pipeline = [
+        {"$vectorSearch": {
+            "index": "default",
+            "path": "embedding",
+            "queryVector": query_embedding,
+            "numCandidates": SIMILAR_TASKS_K * 10,
+            "limit": SIMILAR_TASKS_K,
+            "filter": search_filter
+        }},
+        {"$set": {"score": {"$meta": "vectorSearchScore"}}},
+        {"$project": {"embedding": 0}}
+    ]
+
     try:
-        # Perform similarity search
         # k=4 as per user request in previous conversations
-        docs = vector_store.similarity_search(
-            query=state["task_description"],
-            k=4,
-            pre_filter=search_filter
-        )
-        
-        # Convert List[Document] to List[Dict] for easier LLM processing in the next node
+        with _mongo_timeout(state):
+            results = list(collection.aggregate(pipeline))
+
+        # Tasks without a description can't be compared by the LLM in the next node
         historical_tasks = []
-        for doc in docs:
-            task_dict = doc.metadata.copy()
-            task_dict["description"] = doc.page_content
-            historical_tasks.append(task_dict)
+        for task in results:
+            if "description" not in task:
+                continue
+            task["_id"] = str(task["_id"])
+            historical_tasks.append(task)
             
-        print(f"Found {len(historical_tasks)} similar tasks with the same tag")
-        return {"historical_tasks": historical_tasks}
+        print(f"Found {len(historical_tasks)} similar tasks with tag '{state['tag_name']}'")
+        return historical_tasks
 
     except Exception as e:
+        _raise_if_out_of_time(state, "find_similar_tasks", e)
         print(f"Error executing vector search: {e}")
-        return {"historical_tasks": []}
+        return []
 
 
+def _recent_tasks_with_tag(state: TimeEstimationState, limit: int = 4) -> List[Dict[str, Any]]:
+    """Degraded retrieval: the user's most recently updated tasks with the same tag."""
+    try:
+        with _mongo_timeout(state):
+            cursor = collection.find(
+                {"email": state["email"], "tag_names": state["tag_name"], "duration": {"$gt": 0}},
+                {"embedding": 0, "_id": 0}
+            ).sort("updated_at", -1).limit(limit)
+            return list(cursor)
+    except Exception as e:
+        _raise_if_out_of_time(state, "find_similar_tasks", e)
+        print(f"Error loading recent tasks: {e}")
+        return []
+
 
+def heuristic_estimate(estimated_time: int, historical_tasks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Estimate without the LLM: the median duration of the historical tasks,
+    never below the user's own estimate.
+    """
+    durations = [task["duration"] for task in historical_tasks if task.get("duration")]
+    if not durations:
+        return {
+            "recommendation": "keep",
+            "suggested_minutes": estimated_time,
+            "reasoning": "No similar tasks with recorded durations, so your estimate was kept.",
+            "confidence": "low"
+        }
+    median = round(statistics.median(durations))
+    suggested = max(median, estimated_time)
+    return {
+        "recommendation": "increase" if suggested > estimated_time else "keep",
+        "suggested_minutes": suggested,
+        "reasoning": f"Median of {len(durations)} similar tasks is {median} minutes.",
+        "confidence": "medium" if len(durations) >= 3 else "low"
+    }
 
 
 def estimate_time_node(state: TimeEstimationState) -> Dict[str, Any]:
     """
-    Node 2: Use LLM to analyze historical data and suggest time allocation.
+    Node 4: Use LLM to analyze historical data and suggest time allocation.
     """
-    print(f"\n[Node 2] Analyzing with LLM...")
+    print(f"\n[Node 4] Analyzing with LLM...")
+    with _stage(state, "estimate_time"):
+        return _estimate_time(state)
+
+
+def _estimate_time(state: TimeEstimationState) -> Dict[str, Any]:
     
     # Prepare context from historical tasks
     historical_tasks = state.get("historical_tasks", [])
@@ -198,8 +451,21 @@ REASONING: [your detailed reasoning]
         HumanMessage(content=user_message)
     ]
     
-    # Invoke LLM
-    response = llm.invoke(messages)
+    # Invoke the tier's LLM; while it is unavailable fall back to the history heuristic
+    tier = ESTIMATION_TIERS[state.get("tier") or "standard"]
+    on_delta = _token_writer(state, "estimate_time")
+    started = time.monotonic()
+    try:
+        if on_delta is None:
+            response = llm_client.invoke_chat(tier.get_llm(), messages, state.get("deadline"), "estimate_time")
+        else:
+            response = llm_client.stream_chat(tier.get_llm(), messages, on_delta, state.get("deadline"), "estimate_time")
+    except Exception as e:
+        tier.record((time.monotonic() - started) * 1000, failed=True)
+        _raise_if_out_of_time(state, "estimate_time", e)
+        print(f"LLM unavailable, using heuristic estimate: {e}")
+        return {**heuristic_estimate(state["estimated_time"], historical_tasks), "degraded": True}
+    tier.record((time.monotonic() - started) * 1000, response)
     response_text = response.content
     
     # Parse LLM response
@@ -246,10 +512,136 @@ REASONING: [your detailed reasoning]
         "suggested_minutes": suggested_minutes,
         "reasoning": reasoning,
         "confidence": confidence,
+        "degraded": False,
         "messages": [response]
     }
 
 
+def route_estimation_edge(state: TimeEstimationState) -> str:
+    """Conditional edge after retrieval: the no-LLM tier skips estimate_time."""
+    return "history_estimate" if state.get("tier") == "none" else "estimate_time"
+
+
+def route_estimation_node(state: TimeEstimationState) -> Dict[str, Any]:
+    """Records which tier the estimate is routed to."""
+    tier = route_estimation(state["task_description"], state.get("historical_tasks", []))
+    print(f"Routing estimate to the '{tier}' tier")
+    return {"tier": tier}
+
+
+def history_estimate_node(state: TimeEstimationState) -> Dict[str, Any]:
+    """Estimate for the "none" tier: the history median, no LLM call."""
+    started = time.monotonic()
+    result = heuristic_estimate(state["estimated_time"], state.get("historical_tasks", []))
+    ESTIMATION_TIERS["none"].record((time.monotonic() - started) * 1000)
+    return {**result, "degraded": False}
+
+
+# =============================================================================
+# BATCH ESTIMATION
+# =============================================================================
+# Building blocks for agent_utils.run_batch_estimation ("estimate my week").
+# All descriptions are embedded in one provider call, and up to
+# ESTIMATE_BATCH_PROMPT_SIZE tasks share one prompt whose answer has one JSON
+# object per line, so each estimate can be used as soon as its line streams in.
+
+ESTIMATE_BATCH_PROMPT_SIZE = int(os.getenv("ESTIMATE_BATCH_PROMPT_SIZE", "10"))
+
+
+def embed_descriptions(texts: List[str]) -> List[Optional[List[float]]]:
+    """
+    Embeds all texts in one call; all None while embeddings are unavailable.
+    The vectors are search queries, embedded like embed_query's.
+    """
+    try:
+        return llm_client.embed_documents(embeddings, texts, task_type="RETRIEVAL_QUERY")
+    except Exception as e:
+        print(f"Embeddings unavailable, batch will use recent tasks with the same tag: {e}")
+        return [None] * len(texts)
+
+
+def similar_tasks_for(
+    task_id: str,
+    email: str,
+    tag_name: str,
+    embedding: Optional[List[float]],
+    deadline: Optional[Deadline] = None
+) -> List[Dict[str, Any]]:
+    """Retrieval for one task from a precomputed embedding; recent tasks with the tag without one."""
+    state = {"id": task_id, "email": email, "tag_name": tag_name, "deadline": deadline}
+    if embedding is None:
+        return _recent_tasks_with_tag(state)
+    return _vector_search(state, embedding)
+
+
+def build_batch_prompt(tasks: List[Dict[str, Any]]) -> List[Any]:
+    """
+    One prompt for several tasks. Each task dict has key, title, description,
+    tag_name, tag_description, estimated_time and historical_tasks.
+    """
+    task_parts = []
+    for task in tasks:
+        history = [
+            f"'{past.get('title', 'Untitled')}': {past['duration']} min"
+            for past in task["historical_tasks"] if past.get("duration")
+        ]
+        task_parts.append(
+            f"[{task['key']}] {task['title']}\n"
+            f"  Description: {task['description'] or '-'}\n"
+            f"  Tag: {task['tag_name']} - {task['tag_description']}\n"
+            f"  User's initial estimate: {task['estimated_time']} minutes\n"
+            f"  Similar past tasks: {'; '.join(history) if history else 'none'}"
+        )
+
+    system_prompt = f"""You are a time estimation expert helping users allocate appropriate time for their tasks.
+
+CRITICAL RULES:
+1. You can ONLY recommend to "increase" or "keep" the estimated time
+2. You must NEVER suggest decreasing the time estimate
+3. Base each recommendation on that task's historical data and complexity
+
+Answer with exactly one line of JSON per task, in the order given, and nothing else:
+{{"id": "<task id>", "recommendation": "increase" | "keep", "suggested_minutes": <number >= initial estimate>, "confidence": "high" | "medium" | "low", "reasoning": "<one or two sentences>"}}
+
+Tasks:
+{chr(10).join(task_parts)}
+"""
+    return [
+        SystemMessage(content=system_prompt),
+        HumanMessage(content=f"Should I adjust my estimates for these {len(tasks)} tasks?")
+    ]
+
+
+def parse_batch_line(line: str) -> Optional[Dict[str, Any]]:
+    """Parses one line of a batch answer; None for anything that isn't a task estimate."""
+    line = line.strip().rstrip(",")
+    if not line.startswith("{"):
+        return None
+    try:
+        parsed = json.loads(line)
+        return {
+            "id": str(parsed["id"]),
+            "recommendation": parsed.get("recommendation", "keep"),
+            "suggested_minutes": int(parsed["suggested_minutes"]),
+            "confidence": parsed.get("confidence", "medium"),
+            "reasoning": str(parsed.get("reasoning", ""))
+        }
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+def batch_estimate_result(parsed: Dict[str, Any], estimated_time: int) -> Dict[str, Any]:
+    """Applies the never-decrease rule to a parsed batch line."""
+    suggested = max(parsed["suggested_minutes"], estimated_time)
+    confidence = parsed["confidence"] if parsed["confidence"] in ("high", "medium", "low") else "medium"
+    return {
+        "recommendation": "increase" if suggested > estimated_time else "keep",
+        "suggested_minutes": suggested,
+        "reasoning": parsed["reasoning"],
+        "confidence": confidence
+    }
+
+
 # =============================================================================
 # BUILD GRAPH
 # =============================================================================
@@ -259,13 +651,21 @@ def build_time_estimation_graph():
     graph_builder = StateGraph(TimeEstimationState)
     
     # Add nodes
+    graph_builder.add_node("embed_query", embed_query_node)
     graph_builder.add_node("find_similar_tasks", find_similar_tasks_node)
+    graph_builder.add_node("merge_similar_tasks", merge_similar_tasks_node)
+    graph_builder.add_node("route_estimation", route_estimation_node)
     graph_builder.add_node("estimate_time", estimate_time_node)
+    graph_builder.add_node("history_estimate", history_estimate_node)
     
     # Define edges
-    graph_builder.add_edge(START, "find_similar_tasks")
-    graph_builder.add_edge("find_similar_tasks", "estimate_time")
+    graph_builder.add_edge(START, "embed_query")
+    graph_builder.add_conditional_edges("embed_query", fan_out_tags_edge, ["find_similar_tasks"])
+    graph_builder.add_edge("find_similar_tasks", "merge_similar_tasks")
+    graph_builder.add_edge("merge_similar_tasks", "route_estimation")
+    graph_builder.add_conditional_edges("route_estimation", route_estimation_edge, ["estimate_time", "history_estimate"])
     graph_builder.add_edge("estimate_time", END)
+    graph_builder.add_edge("history_estimate", END)
     
     return graph_builder.compile()
 
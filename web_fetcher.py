@@ -0,0 +1,149 @@
+"""
+Web Fetcher
+
+Async page fetching for the search agent. All fetches on an event loop share one
+pooled httpx.AsyncClient, so repeated hosts reuse open connections, and pasted
+links are fetched concurrently: a chat message with several links waits for the
+slowest page, not the sum of them.
+
+- at most SCRAPE_MAX_CONCURRENCY fetches run at once, SCRAPE_PER_HOST_CONCURRENCY per host
+- each fetch is limited to SCRAPE_FETCH_TIMEOUT_SECONDS, and bodies are streamed and
+  cut off after SCRAPE_MAX_BYTES
+- fetch_all stops waiting after SCRAPE_DEADLINE_SECONDS; pages still loading then
+  come back as errors
+"""
+
+import asyncio
+import os
+from typing import Dict, List, Optional, Union
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SCRAPE_MAX_CONCURRENCY = int(os.getenv("SCRAPE_MAX_CONCURRENCY", "8"))
+SCRAPE_PER_HOST_CONCURRENCY = int(os.getenv("SCRAPE_PER_HOST_CONCURRENCY", "2"))
+SCRAPE_FETCH_TIMEOUT_SECONDS = float(os.getenv("SCRAPE_FETCH_TIMEOUT_SECONDS", "10"))
+SCRAPE_DEADLINE_SECONDS = float(os.getenv("SCRAPE_DEADLINE_SECONDS", "15"))
+# Only the first 4000 characters of a page's text are used, so huge pages are cut off
+SCRAPE_MAX_BYTES = int(os.getenv("SCRAPE_MAX_BYTES", str(1024 * 1024)))
+
+# Describe the original encoded body, not the decoded and possibly cut off one
+_BODY_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+
+class FetchDeadlineExceeded(Exception):
+    """The page was still loading when fetch_all's deadline passed."""
+
+
+class _LoopPool:
+    """The shared client and concurrency limits of one event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=SCRAPE_FETCH_TIMEOUT_SECONDS,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=SCRAPE_MAX_CONCURRENCY,
+                max_keepalive_connections=SCRAPE_MAX_CONCURRENCY
+            )
+        )
+        self.slots = asyncio.Semaphore(SCRAPE_MAX_CONCURRENCY)
+        self.host_slots: Dict[str, asyncio.Semaphore] = {}
+
+    def host_slot(self, host: str) -> asyncio.Semaphore:
+        if host not in self.host_slots:
+            self.host_slots[host] = asyncio.Semaphore(SCRAPE_PER_HOST_CONCURRENCY)
+        return self.host_slots[host]
+
+
+_pool: Optional[_LoopPool] = None
+
+
+def _get_pool() -> _LoopPool:
+    """
+    Returns the pool for the running loop. httpx connections belong to the loop
+    that opened them, so a new loop (e.g. in tests) gets a new pool.
+    """
+    global _pool
+    loop = asyncio.get_running_loop()
+    if _pool is None or _pool.loop is not loop or _pool.client.is_closed:
+        _pool = _LoopPool(loop)
+    return _pool
+
+
+async def close() -> None:
+    """Closes the shared client. Called on app shutdown."""
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.client.aclose()
+
+
+async def fetch(url: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    """
+    GETs url through the shared client within the concurrency limits. Raises on
+    HTTP errors; a 304 answer to a conditional request is returned. The returned
+    response holds at most SCRAPE_MAX_BYTES of the body.
+    """
+    pool = _get_pool()
+    host = httpx.URL(url).host
+    async with pool.slots, pool.host_slot(host):
+        async with pool.client.stream("GET", url, headers=headers) as response:
+            if response.status_code != 304:
+                response.raise_for_status()
+            body = await _read_capped(response)
+    return httpx.Response(
+        response.status_code,
+        headers=[(k, v) for k, v in response.headers.multi_items() if k.lower() not in _BODY_HEADERS],
+        content=body,
+        request=response.request
+    )
+
+
+async def _read_capped(response: httpx.Response) -> bytes:
+    """Reads the body until SCRAPE_MAX_BYTES; the rest is never downloaded."""
+    chunks = []
+    size = 0
+    async for chunk in response.aiter_bytes():
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= SCRAPE_MAX_BYTES:
+            print(f"Stopped reading {response.url} after {SCRAPE_MAX_BYTES} bytes")
+            break
+    return b"".join(chunks)[:SCRAPE_MAX_BYTES]
+
+
+async def fetch_all(
+    urls: List[str],
+    deadline_seconds: float = SCRAPE_DEADLINE_SECONDS,
+    headers: Optional[Dict[str, Dict[str, str]]] = None
+) -> Dict[str, Union[httpx.Response, Exception]]:
+    """
+    Fetches all urls concurrently, with any extra headers given per url. Returns each
+    url's response, or the exception it failed with; pages unfinished at the
+    deadline get FetchDeadlineExceeded.
+    """
+    headers = headers or {}
+    tasks = {url: asyncio.ensure_future(fetch(url, headers.get(url))) for url in dict.fromkeys(urls)}
+    if not tasks:
+        return {}
+    await asyncio.wait(tasks.values(), timeout=deadline_seconds)
+
+    results: Dict[str, Union[httpx.Response, Exception]] = {}
+    for url, task in tasks.items():
+        if not task.done():
+            task.cancel()
+            results[url] = FetchDeadlineExceeded(f"No response within {deadline_seconds:g}s")
+        elif task.exception() is not None:
+            results[url] = task.exception()
+        else:
+            results[url] = task.result()
+    return results
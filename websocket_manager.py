@@ -1,30 +1,441 @@
+import asyncio
+import itertools
+import os
+import time
+import uuid
+from collections import deque
 from fastapi import WebSocket
-from typing import Dict
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+import msgpack
+from ws_pubsub import PubSubBackend, InMemoryPubSub
+
+# Outbound messages buffered per connection before the overflow policy applies
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# What to do when a connection's queue is full:
+# evict (close the slow socket), drop_oldest, or drop_newest
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "evict")
+# A single send taking longer than this marks the socket as dead
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+
+# Clients that opt into batching get the events queued within this window in one frame
+WS_BATCH_WINDOW_MS = float(os.getenv("WS_BATCH_WINDOW_MS", "20"))
+# Upper bound on events merged into one batch frame
+WS_BATCH_MAX_MESSAGES = int(os.getenv("WS_BATCH_MAX_MESSAGES", "50"))
+# Messages for a client with no open socket are held this long for it to reconnect
+WS_OFFLINE_BUFFER_TTL_SECONDS = float(os.getenv("WS_OFFLINE_BUFFER_TTL_SECONDS", "300"))
+# At most this many held messages per client and per user; the oldest go first
+WS_OFFLINE_BUFFER_SIZE = int(os.getenv("WS_OFFLINE_BUFFER_SIZE", "100"))
+
+# WebSocket close code 1013: "try again later"
+_CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class ClientConnection:
+    """
+    One accepted socket plus its bounded outbound queue.
+    A dedicated writer task drains the queue, so a slow client only delays itself.
+
+    encoding is "json" (text frames) or "msgpack" (binary frames). With batch=True,
+    events queued within WS_BATCH_WINDOW_MS go out as one {"type": "batch",
+    "messages": [...]} frame.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        client_id: str,
+        email: Optional[str],
+        manager: "ConnectionManager",
+        encoding: str = "json",
+        batch: bool = False
+    ):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.email = email
+        self.manager = manager
+        self.encoding = encoding
+        self.batch_window = WS_BATCH_WINDOW_MS / 1000 if batch else 0
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.sent = 0
+        self.frames = 0
+        self.dropped = 0
+        self.closed = False
+        self.writer = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        while True:
+            batch = [await self.queue.get()]
+            try:
+                if self.batch_window:
+                    await asyncio.sleep(self.batch_window)
+                    while len(batch) < WS_BATCH_MAX_MESSAGES and not self.queue.empty():
+                        batch.append(self.queue.get_nowait())
+                payload = batch[0] if len(batch) == 1 else {"type": "batch", "messages": batch}
+                # asyncio.timeout, unlike wait_for, never swallows a cancellation from close()
+                async with asyncio.timeout(WS_SEND_TIMEOUT_SECONDS):
+                    await self._send(payload)
+                self.sent += len(batch)
+                self.frames += 1
+            except Exception as e:
+                print(f"Failed to send to {self.client_id}: {e}")
+                self.manager._evict(self, reason="send failed")
+                return
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _send(self, payload: dict):
+        if self.encoding == "msgpack":
+            await self.websocket.send_bytes(msgpack.packb(payload, default=str))
+        else:
+            await self.websocket.send_json(payload)
+
+    async def drained(self):
+        """Waits until every queued message has been sent (or the writer gave up)."""
+        await self.queue.join()
+
+    def close(self):
+        """Stops the writer; queued messages are discarded."""
+        self.closed = True
+        if not self.writer.done():
+            self.writer.cancel()
+
+
+class BufferedMessage:
+    """A personal message held for a disconnected client, findable by client_id and by email."""
+
+    def __init__(self, seq: int, client_id: str, email: Optional[str], message: dict, expires_at: float):
+        self.seq = seq
+        self.client_id = client_id
+        self.email = email
+        self.message = message
+        self.expires_at = expires_at
+        self.claimed = False
+
+
+class OfflineBuffer:
+    """
+    TTL buffer of undelivered personal messages, indexed by client_id and by email.
+    A reconnect under the same client_id, or any new socket of the same user,
+    claims the pending messages in the order they were sent.
+    """
+
+    def __init__(self, ttl: float = WS_OFFLINE_BUFFER_TTL_SECONDS, max_per_key: int = WS_OFFLINE_BUFFER_SIZE):
+        self.ttl = ttl
+        self.max_per_key = max_per_key
+        self._seq = itertools.count()
+        self._by_client: Dict[str, Deque[BufferedMessage]] = {}
+        self._by_user: Dict[str, Deque[BufferedMessage]] = {}
+        self.buffered = 0
+        self.replayed = 0
+        self.expired = 0
+
+    def add(self, client_id: str, email: Optional[str], message: dict) -> None:
+        self.purge()
+        entry = BufferedMessage(next(self._seq), client_id, email, message, time.monotonic() + self.ttl)
+        self._append(self._by_client, client_id, entry)
+        if email:
+            self._append(self._by_user, email, entry)
+        self.buffered += 1
+
+    def _append(self, index: Dict[str, Deque[BufferedMessage]], key: str, entry: BufferedMessage) -> None:
+        entries = index.setdefault(key, deque())
+        if len(entries) >= self.max_per_key:
+            dropped = entries.popleft()
+            if not dropped.claimed:
+                dropped.claimed = True
+                self.expired += 1
+        entries.append(entry)
+
+    def claim(self, client_id: str, email: Optional[str]) -> List[dict]:
+        """Removes and returns the live messages held for client_id or email, oldest first."""
+        self.purge()
+        entries = list(self._by_client.pop(client_id, ()))
+        if email:
+            entries.extend(self._by_user.pop(email, ()))
+        claimed = []
+        for entry in sorted(entries, key=lambda e: e.seq):
+            if entry.claimed:
+                continue
+            entry.claimed = True
+            claimed.append(entry.message)
+        self.replayed += len(claimed)
+        return claimed
+
+    def purge(self) -> None:
+        now = time.monotonic()
+        for index in (self._by_client, self._by_user):
+            for key in list(index):
+                entries = index[key]
+                while entries and (entries[0].claimed or entries[0].expires_at <= now):
+                    entry = entries.popleft()
+                    if not entry.claimed:
+                        entry.claimed = True
+                        self.expired += 1
+                if not entries:
+                    del index[key]
+
+    def pending(self) -> int:
+        self.purge()
+        return len({id(e) for entries in self._by_client.values() for e in entries if not e.claimed})
+
 
 class ConnectionManager:
-    def __init__(self):
-        # client_id -> WebSocket
-        self.active_connections: Dict[str, WebSocket] = {}
+    """
+    Tracks this worker's WebSocket connections.
+    Outgoing messages go through a pub/sub backend so that every worker gets a
+    chance to deliver them; each worker only writes to sockets it holds.
+    Delivery only enqueues onto per-connection queues and never awaits network I/O.
+
+    Personal messages for a client no worker holds are kept in an OfflineBuffer and
+    replayed when that client, or another socket of the same user, connects.
+    Only the worker that sent a message buffers it. Workers announce connects and
+    disconnects as "presence" envelopes, so a message for a socket held elsewhere is
+    not buffered, and a connect on one worker claims what another worker is holding.
+
+    Message hooks let other components hear messages of a given type that another
+    worker published, whether or not this worker holds a socket for them.
+    """
+
+    def __init__(self, backend: Optional[PubSubBackend] = None, overflow_policy: str = WS_OVERFLOW_POLICY):
+        # client_id -> ClientConnection
+        self.active_connections: Dict[str, ClientConnection] = {}
+        # email -> client_ids, for connections that identified their user
+        self.user_connections: Dict[str, Set[str]] = {}
+        self.backend: PubSubBackend = backend or InMemoryPubSub()
+        self.overflow_policy = overflow_policy
+        self._started = False
+        # Counters for connections that have since gone away
+        self._closed_sent = 0
+        self._closed_frames = 0
+        self._closed_dropped = 0
+        self.evictions = 0
+        self.worker_id = uuid.uuid4().hex
+        self.offline = OfflineBuffer()
+        # client_id -> worker_id, for sockets held by other workers
+        self.remote_clients: Dict[str, str] = {}
+        # message type -> hooks called with messages other workers published
+        self._message_hooks: Dict[str, List[Callable[[dict], None]]] = {}
+
+    def add_message_hook(self, message_type: str, hook: Callable[[dict], None]):
+        """Calls hook(message) for each message of the type published by another worker."""
+        self._message_hooks.setdefault(message_type, []).append(hook)
+
+    def remove_message_hook(self, message_type: str, hook: Callable[[dict], None]):
+        hooks = self._message_hooks.get(message_type, [])
+        if hook in hooks:
+            hooks.remove(hook)
 
-    async def connect(self, websocket: WebSocket, client_id: str):
+    async def start(self, backend: Optional[PubSubBackend] = None):
+        """Subscribes to the pub/sub backend, optionally replacing it first."""
+        if backend is not None:
+            await self.stop()
+            self.backend = backend
+        await self.backend.start(self._deliver_local)
+        self._started = True
+
+    async def stop(self):
+        if self._started:
+            await self.backend.stop()
+            self._started = False
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        client_id: str,
+        email: Optional[str] = None,
+        encoding: str = "json",
+        batch: bool = False
+    ):
         await websocket.accept()
-        self.active_connections[client_id] = websocket
+        if encoding not in ("json", "msgpack"):
+            encoding = "json"
+        # A reconnect can reuse its client_id before the old socket's disconnect arrives
+        previous = self.active_connections.get(client_id)
+        if previous is not None:
+            self._remove(previous, announce=False)
+        connection = ClientConnection(websocket, client_id, email, self, encoding, batch)
+        self.active_connections[client_id] = connection
+        if email:
+            self.user_connections.setdefault(email, set()).add(client_id)
         print(f"WebSocket connected: {client_id}")
 
-    def disconnect(self, client_id: str):
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
-            print(f"WebSocket disconnected: {client_id}")
+        pending = self.offline.claim(client_id, email)
+        if pending:
+            print(f"Replaying {len(pending)} buffered message(s) to {client_id}")
+        for message in pending:
+            self._enqueue(connection, message)
+        await self._announce(client_id, email, online=True)
+
+    def disconnect(self, client_id: str, websocket: Optional[WebSocket] = None):
+        connection = self.active_connections.get(client_id)
+        if connection is None:
+            return
+        if websocket is not None and connection.websocket is not websocket:
+            # Stale disconnect for a socket that was already replaced
+            return
+        self._remove(connection)
+        print(f"WebSocket disconnected: {client_id}")
+
+    def _remove(self, connection: ClientConnection, announce: bool = True):
+        connection.close()
+        if announce and self._started and not self.backend.is_local:
+            asyncio.create_task(self._announce(connection.client_id, connection.email, online=False))
+        self._closed_sent += connection.sent
+        self._closed_frames += connection.frames
+        self._closed_dropped += connection.dropped
+        if self.active_connections.get(connection.client_id) is connection:
+            del self.active_connections[connection.client_id]
+        if connection.email:
+            clients = self.user_connections.get(connection.email)
+            if clients:
+                clients.discard(connection.client_id)
+                if not clients:
+                    del self.user_connections[connection.email]
+
+    def _evict(self, connection: ClientConnection, reason: str):
+        """Drops a slow or dead consumer and closes its socket so the client reconnects."""
+        if connection.closed:
+            return
+        self.evictions += 1
+        print(f"Evicting WebSocket {connection.client_id}: {reason}")
+        self._remove(connection)
+        asyncio.create_task(self._close_socket(connection.websocket))
+
+    @staticmethod
+    async def _close_socket(websocket: WebSocket):
+        try:
+            await websocket.close(code=_CLOSE_TRY_AGAIN_LATER)
+        except Exception:
+            pass
 
-    async def send_personal_message(self, message: dict, client_id: str):
-        if client_id in self.active_connections:
-            websocket = self.active_connections[client_id]
-            await websocket.send_json(message)
+    def _enqueue(self, connection: ClientConnection, message: dict):
+        try:
+            connection.queue.put_nowait(message)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        if self.overflow_policy == "drop_oldest":
+            connection.queue.get_nowait()
+            connection.queue.task_done()
+            connection.queue.put_nowait(message)
+            connection.dropped += 1
+        elif self.overflow_policy == "drop_newest":
+            connection.dropped += 1
         else:
-            print(f"DEBUG: client_id {client_id} not found in active connections. Current connections: {list(self.active_connections.keys())}")
+            connection.dropped += connection.queue.qsize() + 1
+            self._evict(connection, reason="send queue full")
+
+    async def send_personal_message(self, message: dict, client_id: str, email: Optional[str] = None):
+        """
+        Sends a message to one socket. If it is not connected anywhere, the message is
+        buffered for a reconnect; passing email lets another socket of that user claim it.
+        """
+        await self._publish("client", client_id, message, email)
+
+    async def send_to_user(self, message: dict, email: str):
+        """Sends a message to every connection the user has open (all tabs and devices)."""
+        await self._publish("user", email, message)
 
     async def broadcast(self, message: dict):
-        for connection in self.active_connections.values():
-            await connection.send_json(message)
+        await self._publish("all", None, message)
+
+    async def send_to_user_local(self, message: dict, email: str):
+        """Like send_to_user, but only to this worker's sockets (no pub/sub hop)."""
+        await self._deliver_local({"target": "user", "id": email, "message": message})
+
+    async def _publish(self, target: str, target_id: Optional[str], message: dict, email: Optional[str] = None):
+        # Only the publishing worker buffers a message nobody could deliver
+        envelope = {"target": target, "id": target_id, "message": message, "origin": self.worker_id}
+        if target == "client" and email:
+            envelope["email"] = email
+        if not self._started:
+            # Not subscribed yet (e.g. scripts and tests without a lifespan)
+            await self._deliver_local(envelope)
+            return
+        await self.backend.publish(envelope)
+
+    async def _announce(self, client_id: str, email: Optional[str], online: bool):
+        """Tells other workers a socket connected here or went away."""
+        if not self._started or self.backend.is_local:
+            return
+        try:
+            await self.backend.publish({
+                "target": "presence",
+                "id": client_id,
+                "email": email,
+                "worker": self.worker_id,
+                "online": online,
+                "message": None
+            })
+        except Exception as e:
+            print(f"Warning: Failed to announce WebSocket presence: {e}")
+
+    async def _handle_presence(self, envelope: Dict[str, Any]):
+        client_id, email, worker = envelope["id"], envelope.get("email"), envelope["worker"]
+        if worker == self.worker_id:
+            return
+        if not envelope["online"]:
+            if self.remote_clients.get(client_id) == worker:
+                del self.remote_clients[client_id]
+            return
+        self.remote_clients[client_id] = worker
+        # Hand anything this worker was holding to the worker that now has the socket
+        for message in self.offline.claim(client_id, email):
+            await self._publish("client", client_id, message)
+
+    async def _deliver_local(self, envelope: Dict[str, Any]):
+        target, target_id, message = envelope["target"], envelope.get("id"), envelope["message"]
+        if target == "presence":
+            await self._handle_presence(envelope)
+            return
+        if envelope.get("origin") not in (None, self.worker_id):
+            self._run_message_hooks(message)
+        if target == "client":
+            connection = self.active_connections.get(target_id)
+            if connection is not None:
+                self._enqueue(connection, message)
+            elif target_id not in self.remote_clients and envelope.get("origin") == self.worker_id:
+                self.offline.add(target_id, envelope.get("email"), message)
+                print(f"Buffered message for offline client {target_id}")
+            return
+        if target == "user":
+            client_ids = list(self.user_connections.get(target_id, ()))
+        else:
+            client_ids = list(self.active_connections.keys())
+
+        for client_id in client_ids:
+            connection = self.active_connections.get(client_id)
+            if connection is not None:
+                self._enqueue(connection, message)
+
+    def _run_message_hooks(self, message: dict):
+        for hook in list(self._message_hooks.get(message.get("type"), ())):
+            try:
+                hook(message)
+            except Exception as e:
+                print(f"Warning: WebSocket message hook failed: {e}")
+
+    def metrics(self) -> Dict[str, Any]:
+        """Queue depth, delivery and drop counters for this worker."""
+        depths = [connection.queue.qsize() for connection in self.active_connections.values()]
+        return {
+            "connections": len(self.active_connections),
+            "users": len(self.user_connections),
+            "queue_capacity": WS_SEND_QUEUE_SIZE,
+            "overflow_policy": self.overflow_policy,
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "messages_sent": self._closed_sent + sum(c.sent for c in self.active_connections.values()),
+            "frames_sent": self._closed_frames + sum(c.frames for c in self.active_connections.values()),
+            "messages_dropped": self._closed_dropped + sum(c.dropped for c in self.active_connections.values()),
+            "evictions": self.evictions,
+            "offline_pending": self.offline.pending(),
+            "offline_buffered": self.offline.buffered,
+            "offline_replayed": self.offline.replayed,
+            "offline_expired": self.offline.expired
+        }
 
 manager = ConnectionManager()
@@ -0,0 +1,162 @@
+"""
+Task Write-Behind
+
+Dragging or resizing a calendar block sends a burst of small field updates for the
+same task. With TASK_WRITE_BEHIND_MS > 0 those updates are merged per task in memory
+and written together, one bulk_write per window, instead of one update per event.
+
+- queue() checks the task exists for the user first, so edits to missing or
+  foreign tasks are rejected up front instead of matching nothing at flush time.
+- API reads pass tasks through overlay(), so users always read their own writes.
+- updated_at is stamped when the batch is written, which keeps delta sync correct.
+- Pending updates are flushed on shutdown; a failed flush is retried next window.
+
+With TASK_WRITE_BEHIND_MS=0 (the default) updates are written immediately.
+"""
+
+import asyncio
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+import db
+
+load_dotenv()
+
+TASK_WRITE_BEHIND_MS = float(os.getenv("TASK_WRITE_BEHIND_MS", "0"))
+
+# (task_id, email the write is limited to, or None)
+PendingKey = Tuple[str, Optional[str]]
+
+
+class TaskWriteBehind:
+    """Merges task field updates per task and writes them in batches."""
+
+    def __init__(self, window_ms: float = TASK_WRITE_BEHIND_MS):
+        self.window = window_ms / 1000
+        self._client: Optional[MongoClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # submit() may be called from worker threads, so pending state has its own lock
+        self._lock = threading.Lock()
+        self._pending: Dict[PendingKey, Dict[str, Any]] = {}
+        self._inflight: Dict[PendingKey, Dict[str, Any]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self.submitted = 0
+        self.written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self._client is not None
+
+    def start(self, client: MongoClient, loop: asyncio.AbstractEventLoop) -> None:
+        self._client = client
+        self._loop = loop
+        self._flush_lock = asyncio.Lock()
+        if self.window > 0:
+            print(f"✓ Task write-behind enabled ({self.window * 1000:.0f} ms window)")
+
+    async def stop(self) -> None:
+        """Writes everything still pending. Call before the Mongo client closes."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._client is not None:
+            await self.flush()
+        self._client = None
+
+    def submit(self, task_id: str, updates: Dict[str, Any], email: Optional[str] = None) -> None:
+        """
+        Queues a $set for a task. Later values for the same field win.
+        Raises bson.errors.InvalidId for a malformed task_id.
+        """
+        ObjectId(task_id)
+        updates = {k: v for k, v in updates.items() if k != "_id"}
+        with self._lock:
+            self._pending.setdefault((task_id, email), {}).update(updates)
+            self.submitted += 1
+        self._loop.call_soon_threadsafe(self._schedule)
+
+    async def queue(self, task_id: str, updates: Dict[str, Any], email: Optional[str] = None) -> bool:
+        """
+        Like submit(), but first checks the task exists (for email, if given).
+        Returns False without queueing anything if it does not.
+        """
+        ObjectId(task_id)
+        if not await asyncio.to_thread(db.task_exists, self._client, task_id, email):
+            return False
+        self.submit(task_id, updates, email)
+        return True
+
+    def _schedule(self) -> None:
+        if self._timer is None:
+            self._timer = self._loop.call_later(self.window, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        asyncio.ensure_future(self.flush())
+
+    async def flush(self) -> None:
+        """Writes all pending updates in one bulk_write."""
+        async with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+            if not batch:
+                return
+            try:
+                await asyncio.to_thread(
+                    db.update_tasks_fields_bulk,
+                    self._client,
+                    [(task_id, email, updates) for (task_id, email), updates in batch.items()]
+                )
+                self.flushes += 1
+                self.written += len(batch)
+            except Exception as e:
+                self.failed_flushes += 1
+                print(f"Warning: Task write-behind flush failed, retrying: {e}")
+                with self._lock:
+                    for key, updates in batch.items():
+                        # Updates submitted since the failed flush are newer and win
+                        self._pending[key] = {**updates, **self._pending.get(key, {})}
+                self._schedule()
+            finally:
+                with self._lock:
+                    self._inflight = {}
+
+    def overlay(self, tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Applies pending (not yet written) updates to tasks read from MongoDB."""
+        with self._lock:
+            if not self._pending and not self._inflight:
+                return tasks
+            merged: Dict[PendingKey, Dict[str, Any]] = {}
+            for key, updates in list(self._inflight.items()) + list(self._pending.items()):
+                merged.setdefault(key, {}).update(updates)
+        for task in tasks:
+            task_id = str(task.get("_id"))
+            # Updates limited to another user's email will never match this task
+            for email in (None, task.get("email")):
+                task.update(merged.get((task_id, email), {}))
+        return tasks
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "enabled": self.enabled,
+            "window_ms": self.window * 1000,
+            "pending_tasks": pending,
+            "updates_submitted": self.submitted,
+            "tasks_written": self.written,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes
+        }
+
+
+task_writes = TaskWriteBehind()
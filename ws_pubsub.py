@@ -0,0 +1,172 @@
+"""
+WebSocket Pub/Sub Backends
+
+ConnectionManager publishes every outgoing message as an envelope through a
+backend, and every API worker's manager receives all envelopes and delivers the
+ones addressed to sockets it holds. That lets a background job on worker A reach
+a socket held by worker B.
+
+Envelope: {"target": "client" | "user" | "all", "id": client_id | email | None,
+           "message": dict}
+
+Backends (WS_PUBSUB_BACKEND):
+- memory (default): delivers in-process. Correct for a single uvicorn worker.
+- mongo: a capped collection tailed by each worker. Works with any MongoDB,
+  including a local standalone mongod, so multiple workers need no extra service.
+"""
+
+import asyncio
+import os
+from abc import ABC, abstractmethod
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from pymongo import MongoClient, CursorType
+from pymongo.errors import CollectionInvalid
+from dotenv import load_dotenv
+
+from db import DB_NAME
+
+load_dotenv()
+
+WS_PUBSUB_BACKEND = os.getenv("WS_PUBSUB_BACKEND", "memory")
+WS_EVENTS_COLLECTION = "ws_events"
+# Capped collection size; old envelopes are overwritten once it is full
+WS_EVENTS_CAPPED_BYTES = int(os.getenv("WS_EVENTS_CAPPED_BYTES", str(16 * 1024 * 1024)))
+
+EnvelopeHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class PubSubBackend(ABC):
+    """Interface for envelope transport between API workers."""
+
+    # True when every subscriber lives in this process
+    is_local = True
+
+    @abstractmethod
+    async def start(self, handler: EnvelopeHandler) -> None:
+        """Begins delivering published envelopes to handler."""
+
+    @abstractmethod
+    async def publish(self, envelope: Dict[str, Any]) -> None:
+        """Sends an envelope to every subscribed worker, including this one."""
+
+    async def stop(self) -> None:
+        """Stops delivery and releases resources."""
+
+
+class InMemoryPubSub(PubSubBackend):
+    """Single-process backend: publish hands the envelope straight to the handler."""
+
+    def __init__(self):
+        self._handler: Optional[EnvelopeHandler] = None
+
+    async def start(self, handler: EnvelopeHandler) -> None:
+        self._handler = handler
+
+    async def publish(self, envelope: Dict[str, Any]) -> None:
+        if self._handler is not None:
+            await self._handler(envelope)
+
+    async def stop(self) -> None:
+        self._handler = None
+
+
+class MongoCappedPubSub(PubSubBackend):
+    """
+    Multi-process backend on a MongoDB capped collection.
+    Each worker tails the collection with a tailable-await cursor on a daemon thread
+    and hands new envelopes to its event loop.
+    """
+
+    is_local = False
+
+    def __init__(self, client: MongoClient, collection_name: str = WS_EVENTS_COLLECTION):
+        self.client = client
+        self.collection_name = collection_name
+        self.collection = client[DB_NAME][collection_name]
+        self._handler: Optional[EnvelopeHandler] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_collection(self) -> None:
+        database = self.client[DB_NAME]
+        try:
+            database.create_collection(self.collection_name, capped=True, size=WS_EVENTS_CAPPED_BYTES)
+            # Tailable cursors die immediately on an empty collection
+            self.collection.insert_one({"ts": 0.0, "noop": True})
+        except CollectionInvalid:
+            pass
+
+    async def start(self, handler: EnvelopeHandler) -> None:
+        self._handler = handler
+        self._loop = asyncio.get_running_loop()
+        await asyncio.to_thread(self._ensure_collection)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._tail, args=(time.time(),), name="ws-pubsub-tail", daemon=True
+        )
+        self._thread.start()
+
+    async def publish(self, envelope: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self.collection.insert_one, {"ts": time.time(), **envelope})
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            await asyncio.to_thread(self._thread.join, 5)
+
+    def _tail(self, started_at: float) -> None:
+        # ts is stamped before the threaded insert, so publishers can land out of ts order.
+        # It is only used to skip history on startup; after that envelopes are delivered in
+        # natural (insertion) order, and a reopened cursor skips to the last _id processed.
+        cut_ts = started_at
+        last_id = None
+        last_ts = started_at
+        while not self._stop.is_set():
+            try:
+                if last_id is not None and self.collection.find_one({"_id": last_id}, {"_id": 1}) is None:
+                    # The capped collection wrapped past our position; fall back to time
+                    print("Warning: WebSocket pub/sub position lost, resuming by timestamp")
+                    last_id, cut_ts = None, last_ts
+                skipping = True
+                # No filter: a tailable cursor whose query matches nothing dies at once
+                cursor = self.collection.find(
+                    {},
+                    cursor_type=CursorType.TAILABLE_AWAIT,
+                    max_await_time_ms=1000
+                )
+                while cursor.alive and not self._stop.is_set():
+                    for doc in cursor:
+                        if skipping:
+                            if last_id is not None:
+                                skipping = doc["_id"] != last_id
+                                continue
+                            if doc["ts"] < cut_ts:
+                                continue
+                            skipping = False
+                        last_id, last_ts = doc["_id"], doc["ts"]
+                        if doc.get("noop"):
+                            continue
+                        doc.pop("_id", None)
+                        doc.pop("ts", None)
+                        asyncio.run_coroutine_threadsafe(self._handler(doc), self._loop)
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                print(f"Warning: WebSocket pub/sub tail interrupted: {e}")
+            # Cursor died (e.g. collection recreated); reopen after a short pause
+            self._stop.wait(1)
+
+
+def create_pubsub_backend(client: Optional[MongoClient], name: str = WS_PUBSUB_BACKEND) -> PubSubBackend:
+    """Builds the backend selected by WS_PUBSUB_BACKEND."""
+    if name == "mongo":
+        if client is None:
+            raise ValueError("The mongo pub/sub backend needs a MongoDB client")
+        return MongoCappedPubSub(client)
+    if name != "memory":
+        print(f"Warning: Unknown WS_PUBSUB_BACKEND '{name}', using memory")
+    return InMemoryPubSub()
@@ -0,0 +1,103 @@
+"""
+WebSocket RPC
+
+Lets the calendar send interactive task edits (drag, resize, check off) over its
+open WebSocket instead of a PATCH request with a CORS preflight each time.
+
+Request:  {"type": "rpc", "id": str, "method": str, "params": dict}
+Replies:  {"type": "rpc_ack", "id": str, "result": {"task_id": str, "updated": [str]}}
+          {"type": "rpc_error", "id": str, "code": str, "error": str}
+
+Methods:
+- move_task {task_id, start_time, tag_names?}
+- toggle_completion {task_id, is_completed}
+- update_duration {task_id, duration}
+
+Edits go through db.update_task_fields, limited to tasks owned by the email the
+socket connected with, so they push the same task_event messages as REST updates.
+When task write-behind is enabled, edits to the user's existing tasks are queued
+there instead and the ack only confirms the edit was accepted.
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from bson.errors import InvalidId
+from pydantic import BaseModel, Field, ValidationError
+from pymongo import MongoClient
+
+import db
+from write_behind import task_writes
+
+
+class MoveTaskParams(BaseModel):
+    task_id: str
+    start_time: datetime
+    tag_names: Optional[List[str]] = None
+
+
+class ToggleCompletionParams(BaseModel):
+    task_id: str
+    is_completed: bool
+
+
+class UpdateDurationParams(BaseModel):
+    task_id: str
+    duration: int = Field(gt=0)
+
+
+def _move_task(params: MoveTaskParams) -> Dict[str, Any]:
+    updates: Dict[str, Any] = {"start_time": params.start_time}
+    if params.tag_names is not None:
+        updates["tag_names"] = params.tag_names
+    return updates
+
+
+# method -> (params model, builds the $set fields from validated params)
+RPC_METHODS: Dict[str, Tuple[Type[BaseModel], Callable[[Any], Dict[str, Any]]]] = {
+    "move_task": (MoveTaskParams, _move_task),
+    "toggle_completion": (ToggleCompletionParams, lambda p: {"is_completed": p.is_completed}),
+    "update_duration": (UpdateDurationParams, lambda p: {"duration": p.duration}),
+}
+
+
+def _error(request_id: Any, code: str, error: str) -> Dict[str, Any]:
+    return {"type": "rpc_error", "id": request_id, "code": code, "error": error}
+
+
+async def handle_rpc(client: MongoClient, email: Optional[str], request: Dict[str, Any]) -> Dict[str, Any]:
+    """Runs one RPC request for a socket connected as email and returns the reply to send."""
+    request_id = request.get("id")
+    if not email:
+        return _error(request_id, "unauthenticated", "Connect with ?email= to edit tasks")
+
+    method = RPC_METHODS.get(request.get("method"))
+    if method is None:
+        return _error(request_id, "unknown_method", f"Unknown method: {request.get('method')}")
+    model, build_updates = method
+
+    try:
+        params = model(**(request.get("params") or {}))
+    except (ValidationError, TypeError) as e:
+        return _error(request_id, "invalid_params", str(e))
+
+    updates = build_updates(params)
+    try:
+        if task_writes.enabled:
+            updated = await task_writes.queue(params.task_id, updates, email)
+        else:
+            updated = await asyncio.to_thread(db.update_task_fields, client, params.task_id, dict(updates), email)
+    except InvalidId:
+        updated = False
+    except Exception as e:
+        print(f"Error in WebSocket RPC {request.get('method')}: {e}")
+        return _error(request_id, "internal", "Update failed")
+
+    if not updated:
+        return _error(request_id, "not_found", "Task not found")
+    return {
+        "type": "rpc_ack",
+        "id": request_id,
+        "result": {"task_id": params.task_id, "updated": sorted(updates)}
+    }